@@ -0,0 +1,184 @@
+"""Check and time the in-process git index reader (gitindex.py) against git.
+
+For each index format (v2, v3, v4 and a split index) a synthetic repo gets a
+mix of edits: changed size, same size, touched only, chmod, deleted, staged,
+untracked, untracked folder and gitignored files. Every path is then
+classified by GitIndex and by `git status`, and any disagreement is
+reported as a mismatch (the run should show none). Also timed:
+
+    load_ms            parsing the index after it changed
+    index_us           one is_changed() decision, median
+    status_cache_us    the same decision from the `git status` cache after a change
+    git_status_ms      one `git status -- <path>` subprocess, as before the cache
+
+    python bench/bench_gitindex.py --files 20000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import gitcache  # noqa: E402
+import gitindex  # noqa: E402
+from synthetic import generate_repo, git  # noqa: E402
+
+FORMATS = ("2", "3", "4", "split")
+
+
+def mutate(repo, rel_paths, fraction, seed):
+    """Apply a mix of edits to about fraction of the files; returns the count per kind."""
+    rng = random.Random(seed)
+    chosen = rng.sample(rel_paths, max(8, int(len(rel_paths) * fraction)))
+    kinds = ("size", "same_size", "touch", "chmod", "delete", "staged")
+    done = dict.fromkeys(kinds, 0)
+    later = time.time() + 5
+    for i, rel in enumerate(chosen):
+        kind = kinds[i % len(kinds)]
+        if kind == "chmod" and os.name == "nt":
+            kind = "touch"
+        path = os.path.join(repo, rel)
+        if kind == "size":
+            with open(path, "ab") as f:
+                f.write(b"# more\n")
+        elif kind == "same_size":
+            with open(path, "r+b") as f:
+                first = f.read(1)
+                f.seek(0)
+                f.write(b"X" if first != b"X" else b"Y")
+            os.utime(path, (later, later))
+        elif kind == "touch":
+            os.utime(path, (later, later))
+        elif kind == "chmod":
+            os.chmod(path, 0o755)
+        elif kind == "delete":
+            os.remove(path)
+        elif kind == "staged":
+            with open(path, "ab") as f:
+                f.write(b"# staged\n")
+            git(repo, "add", rel)
+        done[kind] += 1
+    with open(os.path.join(repo, ".gitignore"), "a") as f:
+        f.write("*.log\nbuild/\n")
+    git(repo, "add", ".gitignore")
+    for i in range(20):
+        with open(os.path.join(repo, f"untracked{i}.txt"), "w") as f:
+            f.write("new")
+        with open(os.path.join(repo, f"ignored{i}.log"), "w") as f:
+            f.write("log")
+    for folder in ("newdir/sub", "build/out"):
+        os.makedirs(os.path.join(repo, folder))
+        for i in range(5):
+            with open(os.path.join(repo, folder, f"f{i}.txt"), "w") as f:
+                f.write("x")
+    # Intent-to-add entry
+    with open(os.path.join(repo, "intent.txt"), "w") as f:
+        f.write("i")
+    git(repo, "add", "-N", "intent.txt")
+    return done
+
+
+def git_changed(repo):
+    result = subprocess.run(["git", "status", "--porcelain=v2", "-z", "--untracked-files=all"],
+                            cwd=repo, capture_output=True, check=True)
+    changed, _ = gitcache.parse_porcelain_v2(result.stdout.decode("utf-8", "surrogateescape"))
+    return changed
+
+
+def all_paths(repo, index):
+    paths = set(index.entries)
+    for root, dirs, names in os.walk(repo):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in names:
+            paths.add(os.path.relpath(os.path.join(root, name), repo).replace(os.sep, "/"))
+    return sorted(paths)
+
+
+def run_format(fmt, args):
+    workdir = tempfile.mkdtemp(prefix="wls-bench-gitindex-")
+    try:
+        repo = os.path.join(workdir, "repo")
+        rel_paths = [p.replace(os.sep, "/") for p in generate_repo(repo, args.files, 512, args.depth, seed=args.seed)]
+        if fmt == "split":
+            git(repo, "update-index", "--split-index")
+        else:
+            git(repo, "update-index", "--no-split-index", "--index-version", fmt)
+        edits = mutate(repo, rel_paths, args.fraction, args.seed)
+        if fmt == "split":
+            # Make sure some entries live in the shared index and some in the split part
+            git(repo, "update-index", "--split-index")
+            with open(os.path.join(repo, rel_paths[-1]), "ab") as f:
+                f.write(b"# split\n")
+            git(repo, "add", rel_paths[-1])
+
+        index = gitindex.GitIndex(repo, os.path.join(repo, ".git"))
+        start = time.perf_counter()
+        with index.lock:
+            index._load()
+        load_ms = (time.perf_counter() - start) * 1000
+        expected = git_changed(repo)
+        paths = all_paths(repo, index)
+        timings = []
+        mismatches = []
+        for rel in paths:
+            start = time.perf_counter()
+            answer = index.is_changed(rel)
+            timings.append(time.perf_counter() - start)
+            if answer is not None and answer != (rel in expected):
+                mismatches.append({"path": rel, "index": answer, "git": rel in expected})
+
+        cache = gitcache.GitStatusCache(repo)
+        cache.is_changed(paths[0])
+        sample = random.Random(args.seed).sample(paths, min(50, len(paths)))
+        cache_timings = []
+        for rel in sample:
+            cache.mark_dirty(rel)
+            start = time.perf_counter()
+            cache.is_changed(rel)
+            cache_timings.append(time.perf_counter() - start)
+        status_timings = []
+        for rel in sample[:10]:
+            start = time.perf_counter()
+            subprocess.run(["git", "status", "--porcelain", "--", rel], cwd=repo, capture_output=True)
+            status_timings.append(time.perf_counter() - start)
+        return {
+            "format": fmt,
+            "paths": len(paths),
+            "git_changed": len(expected),
+            "edits": edits,
+            "mismatches": len(mismatches),
+            "mismatch_examples": mismatches[:5],
+            "stats": index.stats(),
+            "load_ms": round(load_ms, 2),
+            "index_us": round(statistics.median(timings) * 1e6, 1),
+            "status_cache_us": round(statistics.median(cache_timings) * 1e6, 1),
+            "git_status_ms": round(statistics.median(status_timings) * 1000, 2),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fraction", type=float, default=0.02, help="share of files edited")
+    parser.add_argument("--format", choices=FORMATS, action="append", help="index format (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    results = [run_format(fmt, args) for fmt in args.format or FORMATS]
+    print(json.dumps({"benchmark": "gitindex", "config": vars(args), "results": results}, indent=2))
+    if any(r["mismatches"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Micro-benchmark for the blacklist/.gitignore matcher (ignore.py).
+
+Builds a synthetic event stream that looks like an `npm install` plus a
+build running next to normal edits: mostly deep paths under node_modules/
+and dist/, some under src/. Reports paths checked per second for
+
+    matcher            ignore.IgnoreMatcher (name set + one combined regex)
+    matcher_negations  the same rules plus "!" re-includes (ordered evaluation)
+    naive_fnmatch      every rule tested with fnmatch against every path prefix
+
+    python bench/bench_ignore.py --paths 200000 --rules 40
+"""
+import argparse
+import fnmatch
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import ignore  # noqa: E402
+
+BASE_RULES = ["node_modules", "dist/", "__pycache__", "*.pyc", "*.log", "/build", ".venv/", "coverage/",
+              "*.tmp", "docs/**/*.pdf"]
+NEGATIONS = ["!keep.log", "!dist/README.md"]
+
+
+def make_rules(count, seed):
+    rng = random.Random(seed)
+    rules = list(BASE_RULES)
+    while len(rules) < count:
+        rules.append(rng.choice(["*.%s", "%s/", "gen_%s", "/out_%s", "**/cache_%s"]) % rng.randrange(10 ** 6))
+    return rules
+
+
+def make_paths(count, seed):
+    rng = random.Random(seed)
+    packages = [f"pkg{i}" for i in range(400)]
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            depth = rng.randrange(1, 6)
+            parts = ["node_modules", rng.choice(packages)] + [f"d{rng.randrange(20)}" for _ in range(depth)]
+            paths.append("/".join(parts + [f"f{rng.randrange(1000)}.js"]))
+        elif kind < 0.8:
+            paths.append(f"dist/chunk{rng.randrange(5000)}.js")
+        else:
+            parts = ["src"] + [f"m{rng.randrange(30)}" for _ in range(rng.randrange(0, 4))]
+            paths.append("/".join(parts + [f"file{rng.randrange(5000)}.{rng.choice(['py', 'ts', 'log'])}"]))
+    return paths
+
+
+def naive(rules):
+    """Per-rule fnmatch on every prefix, as a straightforward implementation would do."""
+    patterns = [r.lstrip("/").rstrip("/") for r in rules if not r.startswith("!")]
+
+    def match(path):
+        parts = path.split("/")
+        for i in range(len(parts)):
+            prefix = "/".join(parts[:i + 1])
+            for pattern in patterns:
+                if fnmatch.fnmatchcase(parts[i], pattern) or fnmatch.fnmatchcase(prefix, pattern):
+                    return True
+        return False
+    return match
+
+
+def throughput(match, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ignored = sum(1 for p in paths if match(p))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"paths_per_sec": round(len(paths) / best), "ignored": ignored}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, default=200000)
+    parser.add_argument("--rules", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules, args.seed)
+    paths = make_paths(args.paths, args.seed)
+
+    def matcher(lines):
+        # A fresh matcher per run would hide the folder cache; it is part of the design
+        m = ignore.IgnoreMatcher(ignore.parse_rule(line) for line in lines)
+        return m.match
+
+    results = {
+        "matcher": throughput(matcher(rules), paths, args.repeat),
+        "matcher_negations": throughput(matcher(rules + NEGATIONS), paths, args.repeat),
+        "naive_fnmatch": throughput(naive(rules), paths, 1),
+    }
+    results["speedup"] = round(results["matcher"]["paths_per_sec"] / results["naive_fnmatch"]["paths_per_sec"], 1)
+    print(json.dumps({"benchmark": "ignore", "config": vars(args), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
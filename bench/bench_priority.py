@@ -0,0 +1,133 @@
+"""Compare upload order with and without the priority scheduler (scheduler.py).
+
+A few large background files are queued, then small files are saved one
+after another while they upload. Workers "send" every job through a
+simulated uplink (a TokenBucket at --link-mbit), so large files hold up
+whatever waits behind them. Three runs:
+
+    fifo            first come, first served, as before
+    priority        small and recently edited files first
+    priority_limit  as priority, with background uploads capped at --limit-mbit
+
+Reported per class: time from submit until the upload finished (p50, p95,
+max), and the scheduler's queue wait statistics.
+
+    python bench/bench_priority.py --large 4 --large-mb 8 --saves 100
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import scheduler  # noqa: E402
+
+MODES = ("fifo", "priority", "priority_limit")
+CHUNK = 32 * 1024
+
+
+class Job:
+    __slots__ = ("path", "size", "edited", "submitted", "finished", "cls")
+
+    def __init__(self, path, size, edited):
+        self.path = path
+        self.size = size
+        self.edited = edited
+        self.submitted = 0.0
+        self.finished = 0.0
+        self.cls = None
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(mode, args):
+    rules = scheduler.PriorityRules(background_min_size=args.background_min_mb * 1024 * 1024)
+    if mode == "fifo":
+        def classify(job):
+            return rules.classify(job.path, job.size), ()
+    else:
+        def classify(job):
+            return rules.key(job.path, job.size, job.edited)
+    queue = scheduler.UploadScheduler(classify, max_background=None if mode == "fifo" else max(1, args.workers - 1))
+    link = scheduler.TokenBucket()
+    link.set_mbit(args.link_mbit)
+    background = scheduler.TokenBucket()
+    background.set_mbit(args.limit_mbit if mode == "priority_limit" else 0)
+
+    def worker():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            key, job, cls = item
+            job.cls = cls
+            for offset in range(0, job.size, CHUNK):
+                n = min(CHUNK, job.size - offset)
+                if cls in scheduler.LIMITED_CLASSES:
+                    background.consume(n)
+                link.consume(n)
+            job.finished = time.monotonic()
+            queue.task_done(key)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+    rng = random.Random(args.seed)
+    jobs = []
+    for i in range(args.large):
+        jobs.append(Job(f"assets/large{i}.bin", args.large_mb * 1024 * 1024, time.monotonic()))
+        jobs[-1].submitted = time.monotonic()
+        queue.put(jobs[-1].path, jobs[-1])
+    start = time.monotonic()
+    for i in range(args.saves):
+        job = Job(f"src/file{i}.py", rng.randint(1024, 64 * 1024), time.monotonic())
+        job.submitted = time.monotonic()
+        jobs.append(job)
+        queue.put(job.path, job)
+        time.sleep(args.interval_ms / 1000)
+    queue.join()
+    seconds = time.monotonic() - start
+    queue.close()
+
+    classes = {}
+    for cls in scheduler.CLASSES:
+        latencies = [j.finished - j.submitted for j in jobs if j.cls == cls]
+        if latencies:
+            classes[cls] = {
+                "jobs": len(latencies),
+                "p50_ms": round(statistics.median(latencies) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "max_ms": round(max(latencies) * 1000, 1),
+            }
+    return {"mode": mode, "seconds": round(seconds, 2), "latency": classes,
+            "queue": queue.stats(), "background_limit": background.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--large", type=int, default=4, help="large background files queued first")
+    parser.add_argument("--large-mb", type=int, default=8)
+    parser.add_argument("--saves", type=int, default=100, help="small files saved while they upload")
+    parser.add_argument("--interval-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--link-mbit", type=float, default=100)
+    parser.add_argument("--limit-mbit", type=float, default=40)
+    parser.add_argument("--background-min-mb", type=int, default=8)
+    parser.add_argument("--mode", choices=MODES, action="append", help="run only this mode (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    results = [run(mode, args) for mode in args.mode or MODES]
+    print(json.dumps({"benchmark": "priority", "config": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
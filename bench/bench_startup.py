@@ -0,0 +1,121 @@
+"""Startup benchmark for the headless service (cli.py).
+
+Measures, each as the median over --repeat fresh processes:
+
+    status_ms          `cli.py status` with no service running (the IPC-only path)
+    first_watch_ms     from launching `cli.py start` until the folder is watched
+    connected_ms       ... until the profile is connected and syncing
+    stop_ms            `cli.py stop` until the process has exited
+
+against the in-process SFTP server, optionally with injected latency:
+
+    python bench/bench_startup.py --rtt-ms 40 --files 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+CLI = os.path.join(REPO_DIR, "cli.py")
+sys.path.insert(0, REPO_DIR)
+
+import config  # noqa: E402
+from local_sftp import LocalSFTPServer, client_key_path  # noqa: E402
+from synthetic import generate_repo  # noqa: E402
+
+WATCHING = "Monitoring started on"
+CONNECTED = "Connected to "
+
+
+def _cli(workdir, *args):
+    return subprocess.run([sys.executable, CLI, "--workdir", workdir, *args],
+                          capture_output=True, text=True, timeout=60)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def time_status(workdir):
+    start = time.perf_counter()
+    _cli(workdir, "status")
+    return time.perf_counter() - start
+
+
+def time_start_stop(workdir, timeout=60):
+    """(first_watch, connected, stop) seconds for one service run."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", CLI, "--workdir", workdir, "start"],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    first_watch = connected = None
+    deadline = start + timeout
+    try:
+        for line in process.stdout:
+            now = time.perf_counter() - start
+            if first_watch is None and WATCHING in line:
+                first_watch = now
+            if CONNECTED in line and ", monitoring" in line:
+                connected = now
+                break
+            if time.perf_counter() > deadline:
+                break
+    finally:
+        stop_start = time.perf_counter()
+        _cli(workdir, "stop")
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        process.stdout.close()
+    return first_watch, connected, time.perf_counter() - stop_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--files", type=int, default=500, help="files in the synthetic repo")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--rtt-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="wls-bench-startup-")
+    try:
+        repo = os.path.join(workdir, "repo")
+        remote = os.path.join(workdir, "remote")
+        generate_repo(repo, args.files, 1024, args.depth)
+        shutil.copytree(repo, remote, ignore=shutil.ignore_patterns(".git"))
+        status = [time_status(workdir) for _ in range(args.repeat)]
+
+        with LocalSFTPServer(rtt_ms=args.rtt_ms) as server:
+            profile = dict(config.DEFAULT_PROFILE, name="bench", local_path=repo, remote_path=remote,
+                           server_host="127.0.0.1", server_port=server.port, username="bench",
+                           key_filename=client_key_path())
+            with open(os.path.join(workdir, config.CONFIG_FILE), "w") as f:
+                json.dump(dict(config.DEFAULT_CONFIG, profiles=[profile]), f)
+            runs = [time_start_stop(workdir) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    def median(values):
+        values = [v for v in values if v is not None]
+        return _ms(statistics.median(values)) if values else None
+
+    print(json.dumps({
+        "benchmark": "startup",
+        "config": vars(args),
+        "status_ms": median(status),
+        "first_watch_ms": median(r[0] for r in runs),
+        "connected_ms": median(r[1] for r in runs),
+        "stop_ms": median(r[2] for r in runs),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
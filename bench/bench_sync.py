@@ -0,0 +1,268 @@
+"""End-to-end sync benchmark: Monitor + SyncHandler + Uploader against a local SFTP server.
+
+Generates a synthetic git repo, mirrors it to the "server" directory and
+runs scenarios while the real watchdog pipeline is syncing:
+
+    single_save   one file saved at a time; latency per save
+    save_all      many files saved at once (editor "save all", formatter run)
+    checkout      `git checkout` of a branch that rewrites part of the tree
+    large_binary  one large incompressible file
+
+Latency is measured from the moment a file is written until the uploader
+reports it on the server. Prints JSON, so runs of different versions can be
+compared:
+
+    python bench/bench_sync.py --files 2000 --rtt-ms 40 --bandwidth-mbit 100
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import manifest  # noqa: E402
+import metrics  # noqa: E402
+import monitor  # noqa: E402
+import uploader  # noqa: E402
+from local_sftp import LocalSFTPServer, client_key_path  # noqa: E402
+from synthetic import generate_repo, git, make_branch  # noqa: E402
+
+SCENARIOS = ("single_save", "save_all", "checkout", "large_binary")
+
+
+def _key(relative_path):
+    return relative_path.replace('\\', '/')
+
+
+class TimedUploader(uploader.Uploader):
+    """Uploader that records when each relative path was last brought in sync."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.landed_lock = threading.Lock()
+        self.landed = {}
+
+    def _landed(self, relative_path):
+        now = time.perf_counter()
+        with self.landed_lock:
+            self.landed[_key(relative_path)] = now
+
+    def upload_file(self, local_path, relative_path, sftp=None, force=False):
+        ok = super().upload_file(local_path, relative_path, sftp, force)
+        if ok:
+            self._landed(relative_path)
+        return ok
+
+    def upload_bulk(self, items, force=False, background=False):
+        failed = super().upload_bulk(items, force, background)
+        if failed is not None:
+            failed = set(failed)
+            for _, relative_path in items:
+                if relative_path not in failed:
+                    self._landed(relative_path)
+        return failed
+
+    def remove_remote(self, relative_path, sftp=None):
+        ok = super().remove_remote(relative_path, sftp)
+        if ok:
+            self._landed(relative_path)
+        return ok
+
+    def landed_since(self, relative_path, since):
+        with self.landed_lock:
+            t = self.landed.get(_key(relative_path))
+        return t if t is not None and t >= since else None
+
+
+def _events_seen():
+    with metrics.REGISTRY.lock:
+        return sum(v for (name, _), v in metrics.REGISTRY.counters.items() if name == "events_total")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _wait(upl, started, timeout):
+    """{relative_path: latency} for paths (keys of started: path -> start time) that land in time."""
+    deadline = time.perf_counter() + timeout
+    latencies = {}
+    while len(latencies) < len(started) and time.perf_counter() < deadline:
+        for rel, since in started.items():
+            if rel not in latencies:
+                t = upl.landed_since(rel, since)
+                if t is not None:
+                    latencies[rel] = t - since
+        time.sleep(0.01)
+    return latencies
+
+
+def _result(name, started, latencies, nbytes, events, wall):
+    values = list(latencies.values())
+    return {
+        "scenario": name,
+        "files": len(started),
+        "landed": len(latencies),
+        "bytes": nbytes,
+        "seconds": round(wall, 3),
+        "events": events,
+        "events_per_sec": round(events / wall, 1) if wall > 0 else None,
+        "files_per_sec": round(len(latencies) / wall, 1) if wall > 0 else None,
+        "p50_ms": round(_percentile(values, 0.5) * 1000, 1) if values else None,
+        "p99_ms": round(_percentile(values, 0.99) * 1000, 1) if values else None,
+        "mb_per_s": round(nbytes / wall / (1024 * 1024), 2) if wall > 0 else None,
+    }
+
+
+def _append(repo, rel, rng):
+    line = f"# edit {rng.random()}\n".encode()
+    with open(os.path.join(repo, rel), "ab") as f:
+        f.write(line)
+    return os.path.getsize(os.path.join(repo, rel))
+
+
+def single_save(repo, upl, rel_paths, args, rng):
+    started, latencies, nbytes, events_before = {}, {}, 0, _events_seen()
+    wall_start = time.perf_counter()
+    for rel in rng.sample(rel_paths, min(args.saves, len(rel_paths))):
+        since = time.perf_counter()
+        nbytes += _append(repo, rel, rng)
+        started[_key(rel)] = since
+        latencies.update(_wait(upl, {_key(rel): since}, args.timeout))
+    wall = time.perf_counter() - wall_start
+    return _result("single_save", started, latencies, nbytes, _events_seen() - events_before, wall)
+
+
+def save_all(repo, upl, rel_paths, args, rng):
+    events_before = _events_seen()
+    since = time.perf_counter()
+    chosen = rng.sample(rel_paths, min(args.burst, len(rel_paths)))
+    nbytes = sum(_append(repo, rel, rng) for rel in chosen)
+    started = {_key(rel): since for rel in chosen}
+    latencies = _wait(upl, started, args.timeout)
+    wall = max(latencies.values()) if latencies else time.perf_counter() - since
+    return _result("save_all", started, latencies, nbytes, _events_seen() - events_before, wall)
+
+
+def checkout(repo, upl, changed, args, rng):
+    # Drop edits from earlier scenarios so the checkout is clean; not timed
+    git(repo, "reset", "-q", "--hard")
+    time.sleep(args.settle)
+    events_before = _events_seen()
+    since = time.perf_counter()
+    git(repo, "checkout", "-q", "feature")
+    nbytes = sum(os.path.getsize(os.path.join(repo, rel)) for rel in changed)
+    started = {_key(rel): since for rel in changed}
+    latencies = _wait(upl, started, args.timeout)
+    wall = max(latencies.values()) if latencies else time.perf_counter() - since
+    return _result("checkout", started, latencies, nbytes, _events_seen() - events_before, wall)
+
+
+def large_binary(repo, upl, rel_paths, args, rng):
+    events_before = _events_seen()
+    rel = "assets/large.bin"
+    os.makedirs(os.path.join(repo, "assets"), exist_ok=True)
+    data = rng.randbytes(args.binary_mb * 1024 * 1024)
+    since = time.perf_counter()
+    with open(os.path.join(repo, rel), "wb") as f:
+        f.write(data)
+    started = {rel: since}
+    latencies = _wait(upl, started, args.timeout)
+    wall = latencies.get(rel, time.perf_counter() - since)
+    return _result("large_binary", started, latencies, len(data), _events_seen() - events_before, wall)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BENCH_DIR),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="wls-bench-sync-")
+    results = []
+    try:
+        repo = os.path.join(workdir, "repo")
+        remote = os.path.join(workdir, "remote")
+        rel_paths = generate_repo(repo, args.files, args.size, args.depth, seed=args.seed)
+        changed = make_branch(repo, "feature", rel_paths, args.checkout_fraction, seed=args.seed + 1)
+        # Start from a server that already mirrors the repo
+        shutil.copytree(repo, remote, ignore=shutil.ignore_patterns(".git"))
+
+        with LocalSFTPServer(rtt_ms=args.rtt_ms, bandwidth_mbit=args.bandwidth_mbit) as server:
+            upload_manifest = (manifest.UploadManifest("bench", remote, os.path.join(workdir, "manifest.db"))
+                               if args.manifest else None)
+            upl = TimedUploader("127.0.0.1", server.port, "bench", remote, key_filename=client_key_path(),
+                                manifest=upload_manifest)
+            if not upl.connect():
+                raise SystemExit("could not connect to local SFTP server")
+            mon = monitor.Monitor(repo, upl, upload_workers=args.workers, bulk_threshold=args.bulk_threshold)
+            if args.quiet_seconds is not None:
+                mon.handler.coalescer.quiet_seconds = args.quiet_seconds
+            mon.start()
+            time.sleep(0.5)  # Let the observer settle
+            try:
+                for name in args.scenarios:
+                    scenario = {"single_save": single_save, "save_all": save_all,
+                                "checkout": checkout, "large_binary": large_binary}[name]
+                    results.append(scenario(repo, upl, changed if name == "checkout" else rel_paths, args, rng))
+                    time.sleep(args.settle)
+            finally:
+                mon.stop()
+                upl.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--saves", type=int, default=20, help="saves in single_save")
+    parser.add_argument("--burst", type=int, default=200, help="files in save_all")
+    parser.add_argument("--checkout-fraction", type=float, default=0.2)
+    parser.add_argument("--binary-mb", type=int, default=32)
+    parser.add_argument("--rtt-ms", type=float, default=0)
+    parser.add_argument("--bandwidth-mbit", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--bulk-threshold", type=int, default=200)
+    parser.add_argument("--quiet-seconds", type=float, default=None, help="override the debounce interval")
+    parser.add_argument("--no-manifest", dest="manifest", action="store_false")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait per scenario")
+    parser.add_argument("--settle", type=float, default=2, help="pause between scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+
+    # Keep the JSON on stdout; the pipeline's own prints go to stderr
+    real_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        results = run(args)
+    finally:
+        sys.stdout = real_stdout
+    config = {k: v for k, v in vars(args).items() if k != "scenarios"}
+    print(json.dumps({"benchmark": "sync", "commit": _commit(), "config": config, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare paramiko's sftp.put with the pipelined write path in transfer.py.
+
+Runs against an in-process SFTP server on localhost, so numbers reflect CPU
+and protocol overhead rather than a real network. Prints JSON.
+
+    python bench/bench_upload.py --sizes 1,16,64 --repeat 3
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transfer  # noqa: E402
+import uploader  # noqa: E402
+from local_sftp import LocalSFTPServer, client_key_path  # noqa: E402
+
+
+def _mbps(nbytes, seconds):
+    return round(nbytes / seconds / (1024 * 1024), 2) if seconds > 0 else 0.0
+
+
+def run(sizes_mb, repeat, max_outstanding):
+    workdir = tempfile.mkdtemp(prefix="wls-bench-")
+    results = []
+    try:
+        local_dir = os.path.join(workdir, "local")
+        remote_dir = os.path.join(workdir, "remote")
+        os.makedirs(local_dir)
+        os.makedirs(remote_dir)
+        with LocalSFTPServer() as server:
+            upl = uploader.Uploader("127.0.0.1", server.port, "bench", remote_dir,
+                                    delta_transfer=False, key_filename=client_key_path())
+            if not upl.connect():
+                raise SystemExit("could not connect to local SFTP server")
+            sftp = upl.open_channel()
+            for size_mb in sizes_mb:
+                path = os.path.join(local_dir, f"{size_mb}mb.bin")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(size_mb * 1024 * 1024))
+                nbytes = os.path.getsize(path)
+                remote = remote_dir + f"/{size_mb}mb.bin"
+
+                put_times, stream_times = [], []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    sftp.put(path, remote)
+                    put_times.append(time.perf_counter() - start)
+
+                    _, seconds = transfer.write_file(sftp, path, remote, max_outstanding=max_outstanding)
+                    stream_times.append(seconds)
+
+                best_put, best_stream = min(put_times), min(stream_times)
+                results.append({
+                    "size_mb": size_mb,
+                    "put_mbps": _mbps(nbytes, best_put),
+                    "stream_mbps": _mbps(nbytes, best_stream),
+                    "speedup": round(best_put / best_stream, 2) if best_stream else None
+                })
+            sftp.close()
+            upl.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,16,64", help="comma separated file sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-outstanding", type=int, default=transfer.DEFAULT_MAX_OUTSTANDING)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    print(json.dumps({"benchmark": "upload", "results": run(sizes, args.repeat, args.max_outstanding)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""In-process SSH/SFTP server on localhost for benchmarks.
+
+Serves a local directory over SFTP (and a minimal `exec` channel that runs
+commands with that directory as cwd) using paramiko's server classes. Any
+public key is accepted, so no real credentials are involved.
+
+Round-trip latency and a bandwidth cap can be injected to mimic a WAN link;
+both apply to each direction of every connection.
+"""
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+from paramiko.sftp import SFTP_OK
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class _SFTPInterface(SFTPServerInterface):
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+
+    def _local(self, path):
+        # Remote paths are absolute paths on this machine
+        return os.path.normpath(path)
+
+    def list_folder(self, path):
+        path = self._local(path)
+        try:
+            out = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self._local(path)
+        try:
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        try:
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        try:
+            SFTPServer.set_file_attr(self._local(path), attr)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.normpath(path if os.path.isabs(path) else '/' + path)
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, allow_exec):
+        self.allow_exec = allow_exec
+        self.exec_requests = []
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.allow_exec:
+            return False
+        self.exec_requests.append((channel, command))
+        threading.Thread(target=_run_exec, args=(channel, command), daemon=True).start()
+        return True
+
+
+def _run_exec(channel, command):
+    try:
+        proc = subprocess.Popen(
+            command if isinstance(command, str) else command.decode('utf-8'),
+            shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def pump_stdin():
+            try:
+                while True:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+            except Exception:
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except Exception:
+                    pass
+
+        def pump_stderr():
+            for chunk in iter(lambda: proc.stderr.read(65536), b''):
+                channel.sendall_stderr(chunk)
+
+        threads = [threading.Thread(target=pump_stdin, daemon=True),
+                   threading.Thread(target=pump_stderr, daemon=True)]
+        for t in threads:
+            t.start()
+        for chunk in iter(lambda: proc.stdout.read(65536), b''):
+            channel.sendall(chunk)
+        threads[1].join()
+        channel.send_exit_status(proc.wait())
+    except Exception:
+        channel.send_exit_status(255)
+    finally:
+        channel.close()
+
+
+def _shape(src, dst, delay, bytes_per_second):
+    """Copy src to dst, delivering each chunk `delay` seconds after it was read
+    and no faster than bytes_per_second. Reading never waits on delivery, so
+    the link behaves like a pipe with latency rather than stop-and-wait."""
+    pending = queue.Queue()
+
+    def reader():
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                pending.put((time.monotonic() + delay, data))
+        except OSError:
+            pass
+        pending.put((0, None))
+
+    def writer():
+        free_at = 0.0  # When the simulated link finishes the previous chunk
+        try:
+            while True:
+                due, data = pending.get()
+                if data is None:
+                    break
+                if bytes_per_second:
+                    free_at = max(free_at, due - delay) + len(data) / bytes_per_second
+                    due = max(due, free_at + delay)
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    for target in (reader, writer):
+        threading.Thread(target=target, daemon=True).start()
+
+
+class LocalSFTPServer:
+    """Accepts SSH connections on 127.0.0.1 and serves SFTP from the local disk.
+
+    Use as a context manager; .port holds the bound port. allow_exec=False
+    simulates a server with exec disabled (SFTP-only accounts). rtt_ms adds
+    round-trip latency and bandwidth_mbit caps throughput per direction.
+    """
+
+    def __init__(self, allow_exec=True, rtt_ms=0, bandwidth_mbit=0):
+        self.allow_exec = allow_exec
+        self.rtt_ms = rtt_ms
+        self.bandwidth_mbit = bandwidth_mbit
+        self.host_key = paramiko.Ed25519Key.from_private_key_file(_host_key_path())
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(self._wrap(conn))
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, _SFTPInterface)
+            try:
+                transport.start_server(server=_ServerInterface(self.allow_exec))
+            except Exception:
+                continue
+            self.transports.append(transport)
+
+    def _wrap(self, conn):
+        if not self.rtt_ms and not self.bandwidth_mbit:
+            return conn
+        # Put a shaped pipe between the client's socket and the transport
+        inner, outer = socket.socketpair()
+        delay = self.rtt_ms / 2000.0
+        rate = self.bandwidth_mbit * 1000 * 1000 / 8
+        _shape(conn, outer, delay, rate)
+        _shape(outer, conn, delay, rate)
+        return inner
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for t in self.transports:
+            t.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _key_path(name):
+    """Path of a throwaway Ed25519 key next to this file, generated on first use."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    if not os.path.exists(path):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+        key = Ed25519PrivateKey.generate()
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+                                serialization.NoEncryption())
+        with open(path, 'wb') as f:
+            f.write(pem)
+    return path
+
+
+def _host_key_path():
+    return _key_path('.bench_host_key')
+
+
+def client_key_path():
+    """Key file to pass as Uploader(key_filename=...); the server accepts any key."""
+    return _key_path('.bench_client_key')
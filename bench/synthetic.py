@@ -0,0 +1,99 @@
+"""Synthetic git repositories for benchmarks.
+
+Creates a committed repo with a configurable number of files spread over a
+directory tree of the given depth. Contents are deterministic for a seed and
+look like source code (compressible) unless binary=True.
+
+    python bench/synthetic.py /tmp/repo --files 5000 --size 4096 --depth 4
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+
+WORDS = ("def", "return", "self", "import", "class", "value", "result", "path", "config",
+         "for", "in", "if", "else", "None", "True", "data", "item", "index", "name", "print")
+
+
+def git(repo, *args):
+    subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+
+def text_content(rng, size):
+    out, n = [], 0
+    while n < size:
+        line = "    " * rng.randint(0, 3) + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 10))) + "\n"
+        out.append(line)
+        n += len(line)
+    return "".join(out)[:size].encode("utf-8")
+
+
+def content(rng, size, binary=False):
+    return rng.randbytes(size) if binary else text_content(rng, size)
+
+
+def relative_paths(files, depth, fanout=8):
+    """Deterministic file paths spread over a tree `depth` directories deep."""
+    paths = []
+    for i in range(files):
+        parts, n = [], i
+        for level in range(depth):
+            parts.append(f"dir{level}_{n % fanout}")
+            n //= fanout
+        parts.append(f"file{i}.py")
+        paths.append(os.path.join(*parts))
+    return paths
+
+
+def generate_repo(path, files=1000, size=4096, depth=3, binary=False, seed=0):
+    """Create and commit a synthetic repo at path; returns its relative file paths."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.email", "bench@example.invalid")
+    git(path, "config", "user.name", "bench")
+    git(path, "config", "core.autocrlf", "false")
+    rel_paths = relative_paths(files, depth)
+    for rel in rel_paths:
+        full = os.path.join(path, rel)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(content(rng, size, binary))
+    git(path, "add", "-A")
+    git(path, "commit", "-q", "-m", "synthetic")
+    return rel_paths
+
+
+def make_branch(path, name, rel_paths, fraction=0.2, seed=1):
+    """Commit a branch that rewrites `fraction` of rel_paths, then return to main.
+
+    Returns the relative paths that differ between the two branches.
+    """
+    rng = random.Random(seed)
+    changed = sorted(rng.sample(rel_paths, max(1, int(len(rel_paths) * fraction))))
+    git(path, "checkout", "-q", "-b", name)
+    for rel in changed:
+        full = os.path.join(path, rel)
+        with open(full, "ab") as f:
+            f.write(b"# changed on " + name.encode() + b"\n")
+    git(path, "commit", "-q", "-am", f"changes on {name}")
+    git(path, "checkout", "-q", "main")
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_repo(args.path, args.files, args.size, args.depth, args.binary, args.seed)
+    print(json.dumps({"path": args.path, "files": len(paths)}))
+
+
+if __name__ == "__main__":
+    main()
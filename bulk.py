@@ -0,0 +1,165 @@
+"""Bulk upload of many files as one tar stream over an exec channel.
+
+One `tar -x` on the server replaces an SFTP open/write/close (plus directory
+checks) per file, which dominates when a checkout or generator touches
+thousands of small files.
+"""
+import gzip
+import hashlib
+import os
+import posixpath
+import shlex
+import stat
+import tarfile
+
+import remote
+
+
+def probe_tar(transport):
+    """True if the server accepts exec requests and has tar on PATH; None if it refused the channel."""
+    return remote.has_command(transport, 'tar')
+
+
+def remote_modes(sftp, remote_base, relative_paths):
+    """relative_path -> permission bits of the files that already exist under remote_base.
+
+    One directory listing per parent directory; missing directories hold no
+    existing files. Other errors are raised so the caller can fall back.
+    """
+    by_dir = {}
+    for relative_path in relative_paths:
+        parent, name = posixpath.split(relative_path.replace('\\', '/'))
+        by_dir.setdefault(parent, {})[name] = relative_path
+    modes = {}
+    for parent, names in by_dir.items():
+        try:
+            entries = sftp.listdir_attr(posixpath.join(remote_base, parent) if parent else remote_base)
+        except FileNotFoundError:
+            continue
+        for attr in entries:
+            if attr.filename in names and stat.S_ISREG(attr.st_mode or 0):
+                modes[names[attr.filename]] = stat.S_IMODE(attr.st_mode)
+    return modes
+
+
+def _tarinfo(f, arcname, mode=None):
+    st = os.fstat(f.fileno())
+    info = tarfile.TarInfo(arcname)
+    info.size = st.st_size
+    info.mtime = int(st.st_mtime)
+    if mode is None:
+        # New file: the server's umask applies, as for an SFTP upload. Windows
+        # reports 0o666/0o444; keep only the executable bit meaningfully.
+        mode = 0o777 if st.st_mode & stat.S_IXUSR and os.name != 'nt' else 0o666
+    info.mode = mode
+    return info
+
+
+def _extracted_names(output):
+    names = set()
+    for line in output.decode('utf-8', 'replace').splitlines():
+        line = line.strip()
+        if line.startswith('x '):  # bsdtar prints "x name"
+            line = line[2:]
+        if line:
+            names.add(line.rstrip('/'))
+    return names
+
+
+def tar_upload(transport, items, remote_base, compress=False, timeout=600, digests=None, on_chunk=None,
+               modes=None):
+    """Stream items [(local_path, relative_path), ...] into remote_base.
+
+    Returns (uploaded, failed, bytes_sent): the relative paths the server
+    reported as extracted, those it did not, and the size of the stream.
+    If digests is a dict, it is filled with relative_path -> (size,
+    mtime_ns, sha1) computed while the files are read into the stream.
+    on_chunk(n), if given, is called before n bytes go to the channel.
+    modes maps relative paths of files that already exist on the server to
+    their permission bits (see remote_modes), which they keep.
+    """
+    modes = modes or {}
+    flags = '-xvozf' if compress else '-xvof'
+    # tar replaces existing files, so their mode comes from the archive
+    command = 'mkdir -p {base} && tar --no-same-permissions {flags} - -C {base}'.format(base=shlex.quote(remote_base), flags=flags)
+    chan = transport.open_session()
+    try:
+        chan.settimeout(timeout)
+        chan.exec_command(command)
+        raw = chan.makefile('wb')
+        counter = _CountingWriter(raw, on_chunk)
+        out = gzip.GzipFile(fileobj=counter, mode='wb', compresslevel=1) if compress else counter
+        skipped = []
+        with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for local_path, relative_path in items:
+                arcname = relative_path.replace('\\', '/')
+                try:
+                    f = open(local_path, 'rb')
+                    info = _tarinfo(f, arcname, modes.get(relative_path))
+                except OSError as e:
+                    # File vanished or is locked; report it as failed
+                    print(f"Bulk upload skipped {arcname}: {e}")
+                    skipped.append(relative_path)
+                    continue
+                # Errors past this point leave a truncated member in the
+                # stream, so they abort the whole batch.
+                with f:
+                    reader = _HashingReader(f)
+                    tar.addfile(info, reader)
+                if digests is not None:
+                    digests[relative_path] = (info.size, reader.mtime_ns, reader.sha1.hexdigest())
+        if compress:
+            out.close()
+        raw.flush()
+        chan.shutdown_write()
+        stdout = b''.join(iter(lambda: chan.recv(65536), b''))
+        stderr = b''.join(iter(lambda: chan.recv_stderr(65536), b''))
+        status = chan.recv_exit_status()
+    finally:
+        chan.close()
+
+    extracted = _extracted_names(stdout) | _extracted_names(stderr)
+    uploaded, failed = [], list(skipped)
+    skipped = set(skipped)
+    for _, relative_path in items:
+        if relative_path in skipped:
+            continue
+        if relative_path.replace('\\', '/') in extracted:
+            uploaded.append(relative_path)
+        else:
+            failed.append(relative_path)
+    if status != 0 and not uploaded:
+        raise IOError(f"remote tar failed ({status}): {stderr.decode('utf-8', 'replace').strip()}")
+    return uploaded, failed, counter.count
+
+
+class _HashingReader:
+    """File wrapper that hashes whatever tarfile reads from it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+        self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha1.update(data)
+        return data
+
+
+class _CountingWriter:
+    """File-like wrapper that counts bytes written to the channel."""
+
+    def __init__(self, fileobj, on_chunk=None):
+        self.fileobj = fileobj
+        self.on_chunk = on_chunk
+        self.count = 0
+
+    def write(self, data):
+        if self.on_chunk:
+            self.on_chunk(len(data))
+        self.count += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
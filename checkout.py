@@ -0,0 +1,226 @@
+"""Branch switches, rebases and resets that move HEAD, applied as one batch.
+
+A checkout rewrites thousands of files within a second. Each of them used
+to go through the debounce, the branch check and its own git check, and the
+branch gate could flip halfway through. The files also end up clean as far
+as git is concerned, so most of them were never uploaded at all.
+
+CheckoutTracker notices git at work: HEAD, refs or the index changing
+inside .git, or HEAD having moved between two flushes (linked worktrees,
+whose .git directory is not watched). While git holds index.lock, and
+until the working tree has been quiet for SETTLE_SECONDS, SyncHandler hands
+it the flushed changes instead of uploading them. If HEAD did not move
+(`git add`, an editor refreshing `git status`), they are released as they
+were. If it did, on_settled gets the old and new commit and the held
+changes, and SyncHandler turns one `git diff --name-status` into one batch.
+
+Only the move of HEAD is diffed. Commands that rewrite files but leave HEAD
+where it was (`git checkout -- <path>`, `git restore`, `git stash`, `git
+reset --hard` to the current commit) are released like any other change,
+and files they made clean again are not uploaded.
+"""
+import os
+import subprocess
+import threading
+import time
+
+import logs
+
+# HEAD must stay put, and .git and the coalescer quiet, this long before a checkout is applied
+SETTLE_SECONDS = 1.0
+# Without a HEAD change, only this long after git released index.lock
+LOCK_GRACE_SECONDS = 0.3
+# Apply anyway if files keep changing for this long after HEAD moved
+MAX_STORM_SECONDS = 30
+POLL_SECONDS = 0.1
+
+# Paths inside .git (without a ".lock" suffix) that mean git is changing HEAD, refs or the index
+_TRIGGERS = ("HEAD", "ORIG_HEAD", "MERGE_HEAD", "CHERRY_PICK_HEAD", "packed-refs", "index")
+_TRIGGER_PREFIXES = ("refs/heads/", "rebase-merge/", "rebase-apply/")
+
+
+def _read(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def resolve_ref(common_dir, ref):
+    """Commit id for a ref such as refs/heads/main, from the loose ref or packed-refs."""
+    for _ in range(5):  # Symbolic refs may point at each other
+        value = _read(os.path.join(common_dir, ref))
+        if value is None:
+            break
+        if not value.startswith("ref:"):
+            return value or None
+        ref = value[len("ref:"):].strip()
+    packed = _read(os.path.join(common_dir, "packed-refs")) or ""
+    for line in packed.splitlines():
+        if line.endswith(" " + ref) and not line.startswith(("#", "^")):
+            return line.split(" ", 1)[0]
+    return None  # Unborn branch
+
+
+def read_head(git_dir, common_dir):
+    """Commit id HEAD points at, or None before the first commit."""
+    content = _read(os.path.join(git_dir, "HEAD"))
+    if not content:
+        return None
+    if content.startswith("ref:"):
+        return resolve_ref(common_dir, content[len("ref:"):].strip())
+    return content
+
+
+def diff_name_status(repo_path, old, new):
+    """[(status letter, path)] between two commits, renames split into delete and add."""
+    result = subprocess.run(["git", "--no-optional-locks", "diff", "--name-status", "--no-renames", "-z",
+                             old, new, "--"], cwd=repo_path, capture_output=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace").strip())
+    fields = result.stdout.decode("utf-8", "surrogateescape").split("\0")
+    return [(fields[i][:1], fields[i + 1]) for i in range(0, len(fields) - 1, 2) if fields[i]]
+
+
+class CheckoutTracker:
+    """Holds flushed changes while git works and hands them on once HEAD has settled.
+
+    If on_settled raises, the held changes are released through on_release
+    instead, so none are lost.
+    """
+
+    def __init__(self, git_dir, common_dir, on_settled, on_release, busy=None):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.lock_path = os.path.join(git_dir, "index.lock")
+        self.on_settled = on_settled  # on_settled(old_head, new_head, held_entries, since)
+        self.on_release = on_release  # on_release(held_entries) when HEAD did not move
+        self.busy = busy or (lambda: False)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.head = read_head(git_dir, common_dir)
+        # Wall clock time HEAD was last known to be at self.head
+        self.settled_at = time.time()
+        self.active = False
+        self.started = 0.0
+        self.last_activity = 0.0
+        self.held = {}
+        self.thread = None
+        self.running = False
+        self.storms = 0
+        self.checkouts = 0
+        self.last = {}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=logs.inherit_profile(self._run), name="CheckoutTracker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    @staticmethod
+    def is_trigger(git_relative_path):
+        """True for a path inside .git (relative to it) whose change means git is switching state."""
+        name = git_relative_path.replace("\\", "/")
+        if name.endswith(".lock"):
+            name = name[:-len(".lock")]
+        return name in _TRIGGERS or name.startswith(_TRIGGER_PREFIXES)
+
+    def _begin(self):
+        # Caller holds self.lock
+        now = time.monotonic()
+        self.last_activity = now
+        if not self.active:
+            self.active = True
+            self.started = now
+            self.storms += 1
+            self.wakeup.set()
+
+    def notify(self, git_relative_path):
+        """Called for every watchdog event inside .git."""
+        if self.is_trigger(git_relative_path):
+            with self.lock:
+                self._begin()
+
+    def hold(self, entries):
+        """Keep flushed entries while git is at work; False if they should be handled now."""
+        with self.lock:
+            if not self.active:
+                if read_head(self.git_dir, self.common_dir) == self.head:
+                    return False
+                self._begin()  # HEAD moved without us seeing it happen
+            for entry in entries:
+                self.held[entry.relative_path] = entry
+            self.last_activity = time.monotonic()
+            return True
+
+    def _run(self):
+        while self.running:
+            if not self.active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            time.sleep(POLL_SECONDS)
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Checkout handling failed: {e}")
+                self._finish(self.head)
+
+    def _poll(self):
+        now = time.monotonic()
+        if os.path.exists(self.lock_path):
+            self.last_activity = now
+            return
+        head = read_head(self.git_dir, self.common_dir)
+        quiet = now - self.last_activity
+        if head == self.head:
+            if quiet >= LOCK_GRACE_SECONDS:
+                self._finish(head)
+            return
+        if quiet < SETTLE_SECONDS or (self.busy() and now - self.started < MAX_STORM_SECONDS):
+            return
+        with self.lock:
+            held = list(self.held.values())
+        old, since = self.head, self.settled_at
+        start = time.perf_counter()
+        try:
+            result = self.on_settled(old, head, held, since) or {}
+        except Exception as e:
+            print(f"Checkout handling failed, handing the held changes on as usual: {e}")
+            self._finish(head)  # Releases everything still held
+            return
+        with self.lock:
+            # Keep entries that were replaced by newer ones in the meantime
+            for entry in held:
+                if self.held.get(entry.relative_path) is entry:
+                    del self.held[entry.relative_path]
+        self.checkouts += 1
+        self.last = dict(result, old=old, new=head, held=len(held),
+                         seconds=round(time.perf_counter() - start, 3))
+        self._finish(head)
+
+    def _finish(self, head):
+        with self.lock:
+            late, self.held = list(self.held.values()), {}
+            self.head = head
+            self.settled_at = time.time()
+            self.active = False
+        if late:
+            self.on_release(late)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": self.active,
+                "held": len(self.held),
+                "storms": self.storms,
+                "checkouts": self.checkouts,
+                "last_checkout": self.last,
+            }
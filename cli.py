@@ -0,0 +1,194 @@
+"""Command line entry point: run the sync service without the GUI, e.g. on Linux build boxes.
+
+    python cli.py start [--detach]        sync all enabled profiles until stopped
+    python cli.py stop                    stop the running service
+    python cli.py status [--json]         show the running service's status
+    python cli.py sync-once [-p NAME]     upload what changed since the last run, then exit
+    python cli.py reconnect [-p NAME]     reconnect all profiles, or one
+
+status, stop and reconnect only talk to the running service over its local
+socket and never import paramiko or watchdog, so they return almost at once.
+Files (config.json, status.json, sync.log, ...) live in the working
+directory, as with main.py; --workdir changes it.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import instancelock
+import ipc
+
+# Exit codes, following the LSB convention for "status"
+OK = 0
+FAILED = 1
+NOT_RUNNING = 3
+
+
+def _service():
+    """(port, token) of a running service, or None."""
+    address = ipc.discover()
+    if address is None:
+        return None
+    try:
+        ipc.request(address, "status", timeout=2)
+        return address
+    except (OSError, ValueError):
+        return None  # Stale status.json from a service that is gone
+
+
+def cmd_start(args):
+    if args.detach:
+        return _start_detached()
+    lock = instancelock.InstanceLock()
+    if not lock.acquire():
+        print("The sync service is already running.", file=sys.stderr)
+        return FAILED
+    try:
+        import main
+        app = main.App(echo=True)
+        app.run_headless()
+    finally:
+        lock.release()
+    return OK
+
+
+def _start_detached(timeout=15):
+    command = [sys.executable, os.path.abspath(__file__), "start"]
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, **kwargs)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            print("The sync service exited during startup; see sync.log.", file=sys.stderr)
+            return FAILED
+        try:
+            with open("status.json", "r") as f:
+                pid = json.load(f).get("pid")
+        except (OSError, ValueError):
+            pid = None
+        if pid == process.pid and _service():
+            print(f"Sync service started (pid {process.pid})")
+            return OK
+        time.sleep(0.1)
+    print("The sync service did not come up in time; see sync.log.", file=sys.stderr)
+    return FAILED
+
+
+def cmd_stop(args):
+    address = _service()
+    if address is None:
+        print("The sync service is not running.")
+        return NOT_RUNNING
+    reply = ipc.request(address, "shutdown", timeout=5)
+    if not reply.get("ok"):
+        # e.g. the GUI version, which is stopped by closing its window
+        print(f"Could not stop the service: {reply.get('error')}", file=sys.stderr)
+        return FAILED
+    # The lock is free once the process has exited
+    lock = instancelock.InstanceLock()
+    if not lock.acquire(timeout=args.timeout):
+        print("The sync service is still shutting down.", file=sys.stderr)
+        return FAILED
+    lock.release()
+    print("Sync service stopped.")
+    return OK
+
+
+def cmd_status(args):
+    address = _service()
+    if address is None:
+        print(json.dumps({"running": False}) if args.json else "The sync service is not running.")
+        return NOT_RUNNING
+    status = ipc.request(address, "status").get("result") or {}
+    if args.json:
+        print(json.dumps(dict(status, running=True), indent=2))
+        return OK
+    print(f"Sync service running (pid {status.get('pid')})")
+    profiles = status.get("profiles") or {}
+    if not profiles:
+        print("  no profiles running" + (f": {status['error']}" if status.get("error") else ""))
+    for name, profile in sorted(profiles.items()):
+        if profile.get("connected"):
+            journal = profile.get("retry_journal") or {}
+            print(f"  {name}: syncing, {profile.get('upload_queue', 0)} queued, "
+                  f"{profile.get('pending_events', 0)} pending, {journal.get('depth', 0)} waiting for retry")
+            classes = (profile.get("upload_scheduler") or {}).get("classes") or {}
+            if any(c["served"] or c["queued"] for c in classes.values()):
+                print("    queue wait: " + ", ".join(
+                    f"{cls} {c['queued']} queued, {c['mean_wait_seconds']:.1f}s mean, {c['max_wait_seconds']:.1f}s max"
+                    for cls, c in classes.items() if c["served"] or c["queued"]))
+            for path, upload in sorted(((profile.get("resumable") or {}).get("in_progress") or {}).items()):
+                print(f"    {path}: {upload['percent']}% of {upload['size'] / (1024 * 1024):.1f} MB"
+                      + (f", resumed {upload['resumes']}x" if upload["resumes"] else ""))
+        else:
+            print(f"  {name}: {profile.get('error') or 'stopped'}")
+    return OK
+
+
+def cmd_reconnect(args):
+    address = _service()
+    if address is None:
+        print("The sync service is not running.")
+        return NOT_RUNNING
+    fields = {"profile": args.profile} if args.profile else {}
+    reply = ipc.request(address, "reconnect", timeout=args.timeout, **fields)
+    connected = (reply.get("result") or {}).get("connected")
+    print("Connected." if connected else f"Not connected: {reply.get('error') or 'see sync.log'}")
+    return OK if connected else FAILED
+
+
+def cmd_sync_once(args):
+    # Running next to the service would race it for the same journal and files
+    lock = instancelock.InstanceLock()
+    if not lock.acquire():
+        print("The sync service is running and already syncing; use 'reconnect' to restart it.", file=sys.stderr)
+        return FAILED
+    try:
+        import main
+        return main.sync_once(args.profile)
+    finally:
+        lock.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--workdir", help="directory with config.json (default: current directory)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start = commands.add_parser("start", help="run the sync service without the GUI")
+    start.add_argument("--detach", action="store_true", help="run in the background and return")
+    start.set_defaults(func=cmd_start)
+
+    stop = commands.add_parser("stop", help="stop the running service")
+    stop.add_argument("--timeout", type=float, default=30)
+    stop.set_defaults(func=cmd_stop)
+
+    status = commands.add_parser("status", help="show the running service's status")
+    status.add_argument("--json", action="store_true")
+    status.set_defaults(func=cmd_status)
+
+    once = commands.add_parser("sync-once", help="upload what changed, then exit")
+    once.add_argument("-p", "--profile", action="append", help="profile name (repeatable); default: all enabled")
+    once.set_defaults(func=cmd_sync_once)
+
+    reconnect = commands.add_parser("reconnect", help="reconnect all profiles, or one")
+    reconnect.add_argument("-p", "--profile")
+    reconnect.add_argument("--timeout", type=float, default=60)
+    reconnect.set_defaults(func=cmd_reconnect)
+
+    args = parser.parse_args(argv)
+    if args.workdir:
+        os.chdir(args.workdir)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
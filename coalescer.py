@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import logs
+import metrics
+
+
+class PendingEvent:
+    """A burst of filesystem events for one path, collapsed into one entry."""
+    __slots__ = ("path", "relative_path", "kind", "first_seen", "last_seen", "count",
+                 "src_path", "src_relative_path", "edited", "children")
+
+    def __init__(self, path, relative_path, kind, now, src_path=None, src_relative_path=None, edited=True):
+        self.path = path
+        self.relative_path = relative_path
+        self.kind = kind
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+        # Where the file or directory came from, for renames
+        self.src_path = src_path
+        self.src_relative_path = src_relative_path
+        # For renames: the content may differ from the server's copy of the
+        # source, so the file must be uploaded after the remote rename
+        self.edited = edited
+        # For directory moves: entries that were pending for files inside the
+        # directory, moved to its new path. They go back to the coalescer once
+        # the directory is moved on the server (see requeue).
+        self.children = None
+
+
+def _rebase(path, old, new):
+    """path with the directory prefix old replaced by new, or None if it is not under old."""
+    if path is None or not path.startswith(old + os.sep):
+        return None
+    return new + path[len(old):]
+
+
+def _move_entry(entry, src_path, path, src_relative_path, relative_path):
+    """Point an entry for a file under src_path at the same file under path."""
+    entry.path = _rebase(entry.path, src_path, path)
+    entry.relative_path = _rebase(entry.relative_path, src_relative_path, relative_path)
+    if entry.src_path is not None:
+        entry.src_path = _rebase(entry.src_path, src_path, path) or entry.src_path
+        entry.src_relative_path = (_rebase(entry.src_relative_path, src_relative_path, relative_path)
+                                   or entry.src_relative_path)
+    for child in entry.children or ():
+        _move_entry(child, src_path, path, src_relative_path, relative_path)
+    return entry
+
+
+class EventCoalescer:
+    """Trailing-edge debounce for watchdog events.
+
+    add() is cheap and never blocks, so it is safe to call from the observer
+    thread. A background thread hands paths to on_flush once they have been
+    quiet for quiet_seconds (or pending for max_delay_seconds while still
+    being written); everything that is due at the same time is passed as one
+    list. on_flush may block, e.g. on a bounded queue; that only stalls the
+    flusher, never event delivery. If on_flush raises, every entry it was
+    given goes to on_failed(entry, attempted), like a failed upload.
+    """
+
+    def __init__(self, on_flush, quiet_seconds=1.0, max_delay_seconds=10.0, max_pending=10000, on_failed=None):
+        self.on_flush = on_flush
+        self.on_failed = on_failed
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_pending = max_pending
+        # Ordered by last event time: re-added paths move to the end
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=logs.inherit_profile(self._run), name="EventCoalescer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop flushing; returns the entries that were still pending."""
+        with self.cond:
+            self.running = False
+            dropped = list(self.pending.values())
+            self.pending.clear()
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        return dropped
+
+    def add(self, path, relative_path, kind="modified", src_path=None, src_relative_path=None):
+        now = time.monotonic()
+        with self.cond:
+            edited = True
+            children = None
+            if kind == "dir_moved" and src_path is not None:
+                # Pending changes inside the directory move with it, and wait
+                # until the directory itself has been moved on the server
+                prefix = src_path + os.sep
+                children = [_move_entry(self.pending.pop(p), src_path, path, src_relative_path, relative_path)
+                            for p in [p for p in self.pending if p.startswith(prefix)]]
+            if src_path is not None:
+                # A rename supersedes whatever was pending for its source. If
+                # the source was itself renamed (a -> b -> c), rename from the
+                # original so the two steps cannot race on different workers.
+                previous = self.pending.pop(src_path, None)
+                # Edits to the source that never reached the server move with it
+                edited = previous is not None and (previous.src_path is None or previous.edited)
+                if previous is not None and previous.children:
+                    children = [_move_entry(child, src_path, path, src_relative_path, relative_path)
+                                for child in previous.children] + (children or [])
+                if previous is not None and previous.src_path is not None:
+                    src_path, src_relative_path = previous.src_path, previous.src_relative_path
+            entry = self.pending.pop(path, None)
+            if entry is None:
+                entry = PendingEvent(path, relative_path, kind, now, src_path, src_relative_path, edited)
+            else:
+                entry.last_seen = now
+                entry.count += 1
+                if kind != "modified":
+                    entry.kind = kind
+                if src_path is not None:
+                    entry.src_path = src_path
+                    entry.src_relative_path = src_relative_path
+                entry.edited = edited
+            if children:
+                entry.children = (entry.children or []) + children
+            self.pending[path] = entry
+            # The flusher already sleeps until the oldest entry is due; it only
+            # needs waking when it was idle or the backlog overflows.
+            if len(self.pending) == 1 or len(self.pending) > self.max_pending:
+                self.cond.notify()
+
+    def requeue(self, entries):
+        """Make entries pending again, e.g. the children of a directory move.
+
+        An entry that is already pending for the same path is newer and wins,
+        but takes over the rename source so the server copy is moved.
+        """
+        now = time.monotonic()
+        with self.cond:
+            for entry in entries:
+                current = self.pending.get(entry.path)
+                if current is None:
+                    entry.last_seen = now
+                    self.pending[entry.path] = entry
+                elif current.src_path is None and entry.src_path is not None and current.kind in ("created", "modified"):
+                    current.kind = entry.kind
+                    current.src_path, current.src_relative_path = entry.src_path, entry.src_relative_path
+            self.cond.notify()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.pending)
+
+    def _take_due(self, now):
+        due = []
+        overflow = len(self.pending) - self.max_pending
+        for path, entry in list(self.pending.items()):
+            if overflow > 0:
+                overflow -= 1
+            elif now - entry.last_seen < self.quiet_seconds:
+                # Everything after this entry was touched even more recently,
+                # so only the max-delay check can still make it due.
+                if now - entry.first_seen < self.max_delay_seconds:
+                    continue
+            del self.pending[path]
+            due.append(entry)
+        return due
+
+    def _next_wakeup(self, now):
+        if not self.pending:
+            return None
+        oldest = next(iter(self.pending.values()))
+        return max(0.0, oldest.last_seen + self.quiet_seconds - now)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                due = self._take_due(now)
+                if not due:
+                    self.cond.wait(self._next_wakeup(now))
+                    continue
+            try:
+                self.on_flush(due)
+            except Exception as e:
+                print(f"Failed to dispatch {len(due)} pending change(s), leaving them to the retry journal: {e}")
+                metrics.inc("errors_total", stage="dispatch")
+                self._failed(due)
+
+    def _failed(self, entries):
+        if not self.on_failed:
+            return
+        for entry in entries:
+            try:
+                self.on_failed(entry, True)
+            except Exception as e:
+                print(f"Could not record failed change: {e}")
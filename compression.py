@@ -0,0 +1,184 @@
+"""Adaptive per-file compression for uploads.
+
+Text-heavy files shrink several times under zlib, already-compressed assets
+do not shrink at all. For each file we decide from its extension, a quick
+entropy sample and the measured link and compression speeds whether piping
+it through `gzip -dc` on the server beats sending it raw. Achieved ratios and
+estimated time saved are recorded so the heuristic can be checked.
+"""
+import math
+import os
+import shlex
+import threading
+import time
+import zlib
+from collections import Counter
+
+import remote
+
+# Formats that are already compressed (or encrypted); never worth compressing
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.aac', '.avi', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jar',
+    '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.pdf', '.png', '.pptx',
+    '.rar', '.tgz', '.webm', '.webp', '.whl', '.woff', '.woff2', '.xlsx', '.xz', '.zip', '.zst',
+}
+
+# Files smaller than this go over SFTP directly: the extra exec channel costs
+# more than compression can save
+MIN_SIZE = 16 * 1024
+SAMPLE_SIZE = 4096
+# Samples above this many bits per byte are treated as incompressible
+MAX_ENTROPY = 7.2
+LEVEL = 1
+
+# Fallback estimates until real measurements exist
+DEFAULT_LINK_MBPS = 5.0
+DEFAULT_COMPRESS_MBPS = 80.0
+# Only uploads at least this large say something about bandwidth rather than latency
+LINK_SAMPLE_MIN_BYTES = 256 * 1024
+
+
+def entropy(sample):
+    """Shannon entropy of a byte sample in bits per byte (0..8)."""
+    if not sample:
+        return 0.0
+    n = len(sample)
+    return -sum(c / n * math.log2(c / n) for c in Counter(sample).values())
+
+
+def _sample(data):
+    """Bytes from the start and the middle of the file."""
+    if len(data) <= 2 * SAMPLE_SIZE:
+        return bytes(data[:2 * SAMPLE_SIZE])
+    mid = len(data) // 2
+    return bytes(data[:SAMPLE_SIZE]) + bytes(data[mid:mid + SAMPLE_SIZE])
+
+
+class CompressionAdvisor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.link_mbps = None
+        self.compress_mbps = None
+        # extension -> [raw bytes, compressed bytes] observed so far
+        self.ratios = {}
+        self.stats = {"files": 0, "skipped": 0, "raw_bytes": 0, "compressed_bytes": 0,
+                      "compress_seconds": 0.0, "est_seconds_saved": 0.0}
+
+    @staticmethod
+    def _ewma(old, new):
+        return new if old is None else old * 0.8 + new * 0.2
+
+    def observe_link(self, nbytes, seconds):
+        """Feed the achieved rate of an uncompressed upload."""
+        if nbytes < LINK_SAMPLE_MIN_BYTES or seconds <= 0:
+            return
+        with self.lock:
+            self.link_mbps = self._ewma(self.link_mbps, nbytes / seconds / (1024 * 1024))
+
+    def _expected_ratio(self, ext, sample):
+        seen = self.ratios.get(ext)
+        if seen and seen[0] >= 1024 * 1024:
+            return seen[1] / seen[0]
+        return len(zlib.compress(sample, LEVEL)) / max(1, len(sample))
+
+    def should_compress(self, path, data):
+        """Decide whether to send data (the contents of path) compressed."""
+        size = len(data)
+        ext = os.path.splitext(path)[1].lower()
+        if size < MIN_SIZE or ext in INCOMPRESSIBLE_EXTENSIONS:
+            return False
+        sample = _sample(data)
+        if entropy(sample) > MAX_ENTROPY:
+            with self.lock:
+                self.stats["skipped"] += 1
+            return False
+        with self.lock:
+            ratio = self._expected_ratio(ext, sample)
+            link = self.link_mbps or DEFAULT_LINK_MBPS
+            speed = self.compress_mbps or DEFAULT_COMPRESS_MBPS
+        mb = size / (1024 * 1024)
+        # Compression and sending overlap only partly; count both in full
+        plain_seconds = mb / link
+        compressed_seconds = mb / speed + mb * ratio / link
+        if compressed_seconds < plain_seconds * 0.9:
+            return True
+        with self.lock:
+            self.stats["skipped"] += 1
+        return False
+
+    def should_compress_batch(self, items):
+        """Decide for a bulk batch [(local_path, relative_path), ...] by extension mix."""
+        compressible = 0
+        for local_path, _ in items:
+            if os.path.splitext(local_path)[1].lower() not in INCOMPRESSIBLE_EXTENSIONS:
+                compressible += 1
+        return compressible * 2 >= len(items)
+
+    def record(self, path, raw, compressed, compress_seconds, total_seconds):
+        ext = os.path.splitext(path)[1].lower()
+        with self.lock:
+            seen = self.ratios.setdefault(ext, [0, 0])
+            seen[0] += raw
+            seen[1] += compressed
+            if compress_seconds > 0:
+                self.compress_mbps = self._ewma(self.compress_mbps, raw / compress_seconds / (1024 * 1024))
+            link = self.link_mbps or DEFAULT_LINK_MBPS
+            plain_seconds = raw / (1024 * 1024) / link
+            self.stats["files"] += 1
+            self.stats["raw_bytes"] += raw
+            self.stats["compressed_bytes"] += compressed
+            self.stats["compress_seconds"] += compress_seconds
+            self.stats["est_seconds_saved"] += plain_seconds - total_seconds
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["ratio"] = round(stats["compressed_bytes"] / stats["raw_bytes"], 3) if stats["raw_bytes"] else None
+            stats["compress_seconds"] = round(stats["compress_seconds"], 3)
+            stats["est_seconds_saved"] = round(stats["est_seconds_saved"], 3)
+            stats["link_mbps"] = round(self.link_mbps, 2) if self.link_mbps else None
+            stats["compress_mbps"] = round(self.compress_mbps, 2) if self.compress_mbps else None
+            stats["by_extension"] = {ext: round(c / r, 3) for ext, (r, c) in self.ratios.items() if r}
+            return stats
+
+
+def upload_compressed(transport, data, remote_path, chunk_size=1024 * 1024, on_chunk=None):
+    """Send data gzip-compressed into `gzip -dc > remote_path` on the server.
+
+    The remote file is rewritten in place, like an SFTP put. on_chunk(n),
+    if given, is called before each compressed piece is sent. Returns
+    (compressed_bytes, compress_seconds).
+    """
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    compress_seconds = 0.0
+    sent = 0
+    chan = transport.open_session()
+    try:
+        chan.settimeout(300)
+        chan.exec_command('gzip -dc > {}'.format(shlex.quote(remote_path)))
+        for offset in range(0, len(data), chunk_size):
+            start = time.perf_counter()
+            piece = compressor.compress(data[offset:offset + chunk_size])
+            compress_seconds += time.perf_counter() - start
+            if piece:
+                if on_chunk:
+                    on_chunk(len(piece))
+                chan.sendall(piece)
+                sent += len(piece)
+        piece = compressor.flush()
+        if on_chunk:
+            on_chunk(len(piece))
+        chan.sendall(piece)
+        sent += len(piece)
+        chan.shutdown_write()
+        stderr = b''.join(iter(lambda: chan.recv_stderr(65536), b''))
+        status = chan.recv_exit_status()
+    finally:
+        chan.close()
+    if status != 0:
+        raise IOError(f"remote gzip failed ({status}): {stderr.decode('utf-8', 'replace').strip()}")
+    return sent, compress_seconds
+
+
+def gzip_available(transport):
+    return remote.has_command(transport, 'gzip')
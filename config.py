@@ -5,17 +5,53 @@ CONFIG_FILE = "config.json"
 
 DEFAULT_PROFILE = {
     "name": "Default Profile",
+    # Every enabled profile syncs at the same time
+    "enabled": True,
     "local_path": "",
     "remote_path": "",
     "server_host": "",
     "server_port": 22,
     "username": "",
-    "sync_branch": ""
+    # Private key file for machines without Pageant/ssh-agent; empty uses the agent
+    "key_filename": "",
+    "sync_branch": "",
+    # Paths never synced, in .gitignore syntax (e.g. "node_modules", "dist/", "*.log")
+    "blacklist": [],
+    # Also skip whatever the repo's .gitignore files ignore, tracked files included.
+    # On for new profiles; profiles saved before the setting existed read as off.
+    "use_gitignore": True,
+    # Decide whether a file changed by reading .git/index instead of running `git status`
+    "git_index": True,
+    "upload_workers": 4,
+    "delta_transfer": True,
+    "max_outstanding_writes": 64,
+    "bulk_threshold": 200,
+    "bulk_compress": True,
+    "reconcile_on_connect": True,
+    "skip_unchanged": True,
+    "compression": "auto",
+    # Files this large (MB) are sent in confirmed chunks and resumed after a broken connection; 0 disables
+    "resumable_min_mb": 32,
+    # Globs per upload class, e.g. {"high": ["src/"], "low": ["*.psd", "assets/"]}; the first matching class wins
+    "priority_rules": {},
+    # Files this large (MB) are background ("low") uploads, sent after smaller ones and under background_limit_mbit
+    "background_min_mb": 8
 }
 
 DEFAULT_CONFIG = {
     "profiles": [DEFAULT_PROFILE],
-    "active_index": 0
+    "active_index": 0,
+    # Upload jobs processed at once across all running profiles
+    "upload_workers_total": 8,
+    # Upload rate cap (Mbit/s) for background uploads across all profiles; 0 is unlimited
+    "background_limit_mbit": 0,
+    # The servers' sshd MaxSessions: channels allowed on one SSH connection shared by profiles
+    "ssh_max_sessions": 10,
+    # Lines kept in the GUI's Activity Log, and size at which sync.log is rotated
+    "log_lines": 1000,
+    "log_max_bytes": 5 * 1024 * 1024,
+    # Serve Prometheus metrics on 127.0.0.1:<port>/metrics; 0 disables
+    "metrics_port": 0
 }
 
 def load_config():
@@ -30,6 +66,7 @@ def load_config():
         # Migration check: if old config format (no 'profiles' key), migrate it
         if "profiles" not in data:
             migrated_profile = DEFAULT_PROFILE.copy()
+            migrated_profile["use_gitignore"] = False  # Keep syncing what it synced before
             migrated_profile.update(data) # Copy old keys like local_path etc.
             migrated_profile["name"] = "Default Profile"
             new_config = {
@@ -57,3 +94,18 @@ def get_active_profile(config_data):
     except (IndexError, TypeError):
         pass
     return None
+
+def get_enabled_profiles(config_data):
+    """Profiles the service should sync.
+
+    Configs written before profiles had an "enabled" flag sync only the
+    active profile.
+    """
+    profiles = config_data.get("profiles", [])
+    if not any("enabled" in p for p in profiles):
+        active = get_active_profile(config_data)
+        return [active] if active else []
+    return [p for p in profiles if p.get("enabled")]
+
+def is_profile_enabled(config_data, profile):
+    return any(p is profile for p in get_enabled_profiles(config_data))
@@ -0,0 +1,236 @@
+"""SSH connections shared by every uploader that targets the same server.
+
+The key exchange and agent authentication take 1-3 s through Pageant, so
+profiles with the same host, port and username share one authenticated
+SSHClient and open their own SFTP and exec channels on its transport.
+
+A connection stays open for IDLE_SECONDS after its last user is released,
+so a reconnect or profile switch reuses it instead of logging in again.
+A background thread checks connections every HEALTH_INTERVAL by opening
+and closing a session channel, and re-establishes dead ones, so the next
+channel opened by an uploader lands on a working transport. A refused
+channel still proves the server answered, so it counts as healthy.
+
+OpenSSH allows MaxSessions (default 10) channels per connection and refuses
+any more. Each lease says how many channels its holder may have open at
+once, and a connection takes leases only up to max_channels of them (the
+`ssh_max_sessions` setting); the next lease for the same server gets a
+second connection (and login) of its own. A lease larger than max_channels
+gets a connection to itself.
+"""
+import threading
+import time
+
+import paramiko
+
+import transfer
+
+KEEPALIVE_SECONDS = 15
+HEALTH_INTERVAL = 30
+HEALTH_TIMEOUT = 10
+IDLE_SECONDS = 120
+# Channels reserved on one connection unless ssh_max_sessions says otherwise;
+# OpenSSH's MaxSessions defaults to 10
+MAX_CHANNELS = 10
+
+
+def endpoint_name(key):
+    host, port, username = key[:3]
+    return f"{username}@{host}:{port}"
+
+
+class _Entry:
+    def __init__(self, key, key_filename, compress, index=0):
+        self.key = key
+        self.index = index  # Connections beyond the first to the same endpoint count up from 1
+        self.key_filename = key_filename
+        self.compress = compress
+        self.lock = threading.Lock()  # Held while connecting, so only one login runs
+        self.ssh = None
+        self.refs = 0
+        self.channels = 0  # Reserved by the current leases
+        self.idle_since = None
+        self.checked = 0.0
+        self.connects = 0
+        self.reuses = 0
+        self.opened = None
+
+    @property
+    def name(self):
+        return endpoint_name(self.key) + (f" #{self.index + 1}" if self.index else "")
+
+    def alive(self):
+        transport = self.ssh.get_transport() if self.ssh else None
+        return transport is not None and transport.is_active()
+
+    def healthy(self):
+        """One round trip on the transport, failing after HEALTH_TIMEOUT."""
+        if not self.alive():
+            return False
+        try:
+            self.ssh.get_transport().open_session(timeout=HEALTH_TIMEOUT).close()
+        except paramiko.ChannelException:
+            pass  # Refused, e.g. at MaxSessions, but the server answered
+        except Exception:
+            return False
+        self.checked = time.monotonic()
+        return True
+
+    def open(self):
+        # Caller holds self.lock
+        self.close()
+        host, port, username = self.key[:3]
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # allow_agent=True should pick up Pageant on Windows automatically
+        ssh.connect(host, port=port, username=username, allow_agent=True, look_for_keys=True,
+                    key_filename=self.key_filename, compress=self.compress)
+        transport = ssh.get_transport()
+        transfer.tune_transport(transport)
+        transport.set_keepalive(KEEPALIVE_SECONDS)
+        self.ssh = ssh
+        self.connects += 1
+        self.opened = self.checked = time.monotonic()
+        print(f"Opened SSH connection to {self.name}")
+
+    def close(self):
+        if self.ssh:
+            try:
+                self.ssh.close()
+            except Exception:
+                pass
+            self.ssh = None
+
+
+class Lease:
+    """One holder's claim on a pooled connection; release() it when done."""
+
+    def __init__(self, pool, entry, channels):
+        self.pool = pool
+        self.entry = entry
+        self.channels = channels
+        self.released = False
+
+    def client(self, stale=None):
+        """A connected SSHClient for the endpoint.
+
+        Pass the client that just failed as stale: it is replaced unless
+        another holder already did so or a health check shows it still works.
+        """
+        return self.pool._client(self.entry, stale)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.pool._release(self.entry, self.channels)
+
+
+class ConnectionPool:
+    def __init__(self, idle_seconds=IDLE_SECONDS, health_interval=HEALTH_INTERVAL, max_channels=MAX_CHANNELS):
+        self.idle_seconds = idle_seconds
+        self.health_interval = health_interval
+        self.max_channels = max_channels
+        self.lock = threading.Lock()
+        self.entries = {}  # (host, port, username, key_filename, compress) -> [_Entry]
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def lease(self, host, port, username, key_filename=None, compress=False, channels=1):
+        """Claim a connection to the endpoint for a holder that keeps up to `channels` channels open."""
+        key = (host, int(port), username, key_filename, bool(compress))
+        with self.lock:
+            entries = self.entries.setdefault(key, [])
+            # First connection with room; an unused one takes any lease
+            entry = next((e for e in entries if not e.refs or e.channels + channels <= self.max_channels), None)
+            if entry is None:
+                used = {e.index for e in entries}
+                entry = _Entry(key, key_filename, compress, min(i for i in range(len(entries) + 1) if i not in used))
+                entries.append(entry)
+            entry.refs += 1
+            entry.channels += channels
+            entry.idle_since = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="ConnectionPool", daemon=True)
+                self.thread.start()
+        return Lease(self, entry, channels)
+
+    def _client(self, entry, stale):
+        with entry.lock:
+            if entry.ssh is not None and entry.ssh is not stale and entry.alive():
+                if entry.refs > 1 or time.monotonic() - entry.checked < self.health_interval or entry.healthy():
+                    entry.reuses += 1
+                    print(f"Reusing SSH connection to {entry.name}")
+                    return entry.ssh
+            elif entry.ssh is not None and entry.ssh is stale and entry.healthy():
+                return entry.ssh  # Only the holder's channel broke
+            entry.open()
+            return entry.ssh
+
+    def _release(self, entry, channels):
+        with self.lock:
+            entry.refs -= 1
+            entry.channels -= channels
+            if entry.refs <= 0:
+                entry.refs = 0
+                entry.channels = 0
+                entry.idle_since = time.monotonic()
+
+    def _run(self):
+        while not self.wakeup.wait(min(5.0, self.health_interval)):
+            now = time.monotonic()
+            with self.lock:
+                entries = [entry for group in self.entries.values() for entry in group]
+            for entry in entries:
+                if entry.idle_since is not None and now - entry.idle_since > self.idle_seconds:
+                    with self.lock:
+                        if entry.refs or entry.idle_since is None:
+                            continue
+                        group = self.entries[entry.key]
+                        group.remove(entry)
+                        if not group:
+                            del self.entries[entry.key]
+                    with entry.lock:
+                        entry.close()
+                    print(f"Closed idle SSH connection to {entry.name}")
+                elif entry.refs and now - entry.checked > self.health_interval:
+                    # Skip a connection that is busy (re)connecting
+                    if not entry.lock.acquire(blocking=False):
+                        continue
+                    try:
+                        if entry.ssh is not None and not entry.healthy():
+                            print(f"SSH connection to {entry.name} is not responding; reconnecting")
+                            try:
+                                entry.open()
+                            except Exception as e:
+                                entry.close()
+                                print(f"Reconnect to {entry.name} failed: {e}")
+                    finally:
+                        entry.lock.release()
+
+    def close_all(self):
+        """Close every connection and stop the health thread, on shutdown."""
+        self.wakeup.set()
+        with self.lock:
+            entries = [entry for group in self.entries.values() for entry in group]
+            self.entries = {}
+        for entry in entries:
+            with entry.lock:
+                entry.close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                entry.name: {
+                    "users": entry.refs,
+                    "channels": entry.channels,
+                    "connected": entry.alive(),
+                    "logins": entry.connects,
+                    "reused": entry.reuses,
+                    "age_seconds": round(now - entry.opened, 1) if entry.opened else None,
+                }
+                for group in self.entries.values() for entry in group
+            }
+
+
+POOL = ConnectionPool()
@@ -0,0 +1,260 @@
+import os
+import subprocess
+import threading
+
+
+def _stamp(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def resolve_git_dir(repo_path):
+    """Return the git directory for a working tree, or None if it is not a repo.
+
+    Handles the usual `.git` directory as well as `.git` files containing a
+    `gitdir: <path>` pointer (linked worktrees and submodules).
+    """
+    dot_git = os.path.join(repo_path, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    if os.path.isfile(dot_git):
+        try:
+            with open(dot_git, 'r', encoding='utf-8') as f:
+                line = f.readline().strip()
+        except OSError:
+            return None
+        if line.startswith('gitdir:'):
+            git_dir = line[len('gitdir:'):].strip()
+            if not os.path.isabs(git_dir):
+                git_dir = os.path.join(repo_path, git_dir)
+            git_dir = os.path.normpath(git_dir)
+            if os.path.isdir(git_dir):
+                return git_dir
+    return None
+
+
+def resolve_common_dir(git_dir):
+    """Return the directory holding refs and packed-refs for a git directory.
+
+    For a linked worktree this is the main repository's .git (named in the
+    worktree's `commondir` file); otherwise it is git_dir itself.
+    """
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r', encoding='utf-8') as f:
+            common = f.read().strip()
+    except OSError:
+        return git_dir
+    if not os.path.isabs(common):
+        common = os.path.join(git_dir, common)
+    common = os.path.normpath(common)
+    return common if os.path.isdir(common) else git_dir
+
+
+def parse_porcelain_v2(output):
+    """Parse `git status --porcelain=v2 -z` output.
+
+    Returns (paths, untracked_dirs): the set of changed paths and the set of
+    untracked directory prefixes (ending in '/') that git collapsed.
+    """
+    paths = set()
+    untracked_dirs = set()
+    fields = output.split('\0')
+    i = 0
+    while i < len(fields):
+        entry = fields[i]
+        i += 1
+        if not entry:
+            continue
+        kind = entry[0]
+        if kind == '1':
+            paths.add(entry.split(' ', 8)[8])
+        elif kind == '2':
+            paths.add(entry.split(' ', 9)[9])
+            i += 1  # The original path of a rename/copy follows as its own field
+        elif kind == 'u':
+            paths.add(entry.split(' ', 10)[10])
+        elif kind == '?':
+            path = entry[2:]
+            if path.endswith('/'):
+                untracked_dirs.add(path)
+            else:
+                paths.add(path)
+    return paths, untracked_dirs
+
+
+class GitStatusCache:
+    """In-memory snapshot of `git status` for a whole repository.
+
+    A full snapshot is taken once and then only refreshed when the index or
+    HEAD change. Working tree changes reported by watchdog are recorded with
+    mark_dirty() and re-checked lazily, all pending paths in a single git call.
+    """
+
+    # Above this many pending paths a full snapshot is cheaper than a pathspec list
+    MAX_INCREMENTAL_PATHS = 200
+
+    def __init__(self, repo_path, git_dir=None):
+        self.repo_path = repo_path
+        self.git_dir = git_dir or os.path.join(repo_path, '.git')
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.untracked_dirs = set()
+        self.pending = set()
+        self.git_stamp = None
+        self.valid = False
+        self.hits = 0
+        self.misses = 0
+        self.full_refreshes = 0
+        self.incremental_refreshes = 0
+
+    def _git_stamp(self):
+        return (_stamp(os.path.join(self.git_dir, 'index')),
+                _stamp(os.path.join(self.git_dir, 'HEAD')))
+
+    def _run_status(self, pathspecs=None):
+        # --no-optional-locks keeps git from rewriting the index, which would
+        # otherwise invalidate our own snapshot on every refresh. Untracked
+        # files are listed one by one: a collapsed `dir/` would also cover
+        # the gitignored files inside it.
+        cmd = ['git', '--no-optional-locks', '--literal-pathspecs', 'status',
+               '--porcelain=v2', '-z', '--untracked-files=all']
+        if pathspecs:
+            cmd.append('--')
+            cmd.extend(pathspecs)
+        result = subprocess.run(
+            cmd,
+            cwd=self.repo_path,
+            capture_output=True,
+            timeout=30
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip())
+        return parse_porcelain_v2(result.stdout.decode('utf-8', 'surrogateescape'))
+
+    def _full_refresh(self):
+        stamp = self._git_stamp()
+        self.changed, self.untracked_dirs = self._run_status()
+        self.pending.clear()
+        self.git_stamp = stamp
+        self.valid = True
+        self.full_refreshes += 1
+
+    def _incremental_refresh(self):
+        paths = sorted(self.pending)
+        changed, untracked_dirs = self._run_status(paths)
+        self.changed.difference_update(paths)
+        self.changed.update(changed)
+        self.untracked_dirs.update(untracked_dirs)
+        self.pending.clear()
+        self.incremental_refreshes += 1
+
+    def invalidate(self):
+        """Force a full snapshot on the next query."""
+        with self.lock:
+            self.valid = False
+
+    def mark_dirty(self, rel_path):
+        """Record that the working tree copy of rel_path changed."""
+        rel_path = rel_path.replace('\\', '/')
+        with self.lock:
+            if self.valid:
+                self.pending.add(rel_path)
+
+    def _in_untracked_dir(self, rel_path):
+        if not self.untracked_dirs:
+            return False
+        idx = rel_path.find('/')
+        while idx != -1:
+            if rel_path[:idx + 1] in self.untracked_dirs:
+                return True
+            idx = rel_path.find('/', idx + 1)
+        return False
+
+    def is_changed(self, rel_path) -> bool:
+        """True if git reports rel_path as modified, added, renamed, conflicted or untracked."""
+        rel_path = rel_path.replace('\\', '/')
+        with self.lock:
+            if not self.valid or self._git_stamp() != self.git_stamp:
+                self.misses += 1
+                self._full_refresh()
+            elif rel_path in self.pending:
+                self.misses += 1
+                if len(self.pending) > self.MAX_INCREMENTAL_PATHS:
+                    self._full_refresh()
+                else:
+                    self._incremental_refresh()
+            else:
+                self.hits += 1
+            return rel_path in self.changed or self._in_untracked_dir(rel_path)
+
+    def changed_paths(self):
+        """Return (changed paths, untracked dir prefixes) from an up-to-date snapshot."""
+        with self.lock:
+            if not self.valid or self._git_stamp() != self.git_stamp or self.pending:
+                self.misses += 1
+                self._full_refresh()
+            else:
+                self.hits += 1
+            return set(self.changed), set(self.untracked_dirs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "full_refreshes": self.full_refreshes,
+                "incremental_refreshes": self.incremental_refreshes,
+                "tracked_changes": len(self.changed),
+                "pending": len(self.pending)
+            }
+
+
+class HeadCache:
+    """Current branch read straight from HEAD, without running git.
+
+    The parsed value is kept until HEAD's mtime changes or invalidate() is
+    called (e.g. when watchdog reports a write to HEAD).
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.head_path = os.path.join(git_dir, 'HEAD')
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.branch = ""
+        self.detached_oid = None
+        self.valid = False
+
+    def invalidate(self):
+        with self.lock:
+            self.valid = False
+
+    def _read(self):
+        try:
+            with open(self.head_path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+        except OSError:
+            self.branch, self.detached_oid = "", None
+            return
+        if content.startswith('ref:'):
+            ref = content[len('ref:'):].strip()
+            self.branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+            self.detached_oid = None
+        else:
+            # Detached HEAD: the file holds a commit id, no branch is checked out
+            self.branch = ""
+            self.detached_oid = content or None
+
+    def current_branch(self) -> str:
+        """Return the checked out branch name, or "" when HEAD is detached."""
+        with self.lock:
+            stamp = _stamp(self.head_path)
+            if not self.valid or stamp != self.stamp:
+                self._read()
+                self.stamp = stamp
+                self.valid = True
+            return self.branch
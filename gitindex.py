@@ -0,0 +1,405 @@
+"""Working tree status from `.git/index`, read in-process.
+
+Starting git costs 50-200 ms on Windows, which dominates a single save.
+GitIndex memory-maps the index (versions 2-4, including split indexes),
+keeps a path -> stat data and blob id table, and decides whether a file
+changed the way git itself does: unchanged stat data means clean, a
+different size means modified, and anything in between (same size, new
+mtime, racily clean entries) is settled by hashing the file as a blob.
+
+Files not in the index are untracked unless the repo's .gitignore rules
+(ignore.py) cover them. Changes staged in the index but not committed are
+read with one `git diff-index --cached` per index change, not per file.
+
+The table is reloaded only when the index file changes. is_changed()
+returns None when it cannot answer like git would (sparse index, clean or
+smudge filters that changed a hash, an unreadable index); GitChecker then
+asks the `git status` cache instead.
+"""
+import hashlib
+import mmap
+import os
+import re
+import stat
+import struct
+import subprocess
+import threading
+
+import ignore
+from gitcache import resolve_common_dir
+
+_HEADER = struct.Struct(">4sII")
+_EXT_HEADER = struct.Struct(">4sI")
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size
+_STAT = struct.Struct(">10I")
+_FLAG_EXTENDED = 0x4000
+_NAME_MASK = 0x0fff
+_XFLAG_INTENT_TO_ADD = 1 << 13
+_XFLAG_SKIP_WORKTREE = 1 << 14
+
+_MODE_SYMLINK = 0o120000
+_MODE_GITLINK = 0o160000
+_MODE_TYPE = 0o170000
+
+HASH_CHUNK = 1024 * 1024
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class Entry:
+    __slots__ = ("ctime", "ctime_ns", "mtime", "mtime_ns", "ino", "mode", "size", "oid", "stage", "flags")
+
+    def __init__(self, fields, oid, stage, flags):
+        self.ctime, self.ctime_ns, self.mtime, self.mtime_ns = fields[0:4]
+        self.ino, self.mode = fields[5], fields[6]
+        self.size = fields[9]
+        self.oid = oid
+        self.stage = stage
+        self.flags = flags  # Extended flags (version 3+), 0 otherwise
+
+
+def _varint(data, pos):
+    """Decode git's offset varint (index v4 path compression); returns (value, new pos)."""
+    c = data[pos]
+    pos += 1
+    value = c & 0x7f
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+    return value, pos
+
+
+def _ewah_bits(data):
+    """Set bit positions of an EWAH-compressed bitmap (split index extension)."""
+    _, word_count = struct.unpack_from(">II", data, 0)
+    words = struct.unpack_from(">%dQ" % word_count, data, 8)
+    bits = []
+    offset = 0
+    i = 0
+    while i < word_count:
+        marker = words[i]
+        i += 1
+        running_len = (marker >> 1) & 0xffffffff
+        literal_words = marker >> 33
+        if marker & 1:
+            bits.extend(range(offset, offset + running_len * 64))
+        offset += running_len * 64
+        for word in words[i:i + literal_words]:
+            while word:
+                low = word & -word
+                bits.append(offset + low.bit_length() - 1)
+                word ^= low
+            offset += 64
+        i += literal_words
+    return bits
+
+
+def _ewah_size(data, pos):
+    word_count = struct.unpack_from(">I", data, pos + 4)[0]
+    return 8 + word_count * 8 + 4
+
+
+def parse_index(data, hash_size=20):
+    """Parse index bytes; returns (entries as [(path, Entry)], extensions as {signature: bytes})."""
+    if len(data) < _HEADER.size + hash_size:
+        raise IndexFormatError("index too short")
+    signature, version, count = _HEADER.unpack_from(data, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise IndexFormatError(f"unsupported index (signature {signature!r}, version {version})")
+    fixed = _STAT.size + hash_size + 2
+    entries = []
+    pos = _HEADER.size
+    previous = b""
+    for _ in range(count):
+        start = pos
+        fields = _STAT.unpack_from(data, pos)
+        pos += _STAT.size
+        oid = bytes(data[pos:pos + hash_size])
+        pos += hash_size
+        flags = struct.unpack_from(">H", data, pos)[0]
+        pos += 2
+        xflags = 0
+        if flags & _FLAG_EXTENDED:
+            if version < 3:
+                raise IndexFormatError("extended flags in a version 2 index")
+            xflags = struct.unpack_from(">H", data, pos)[0]
+            pos += 2
+        if version == 4:
+            strip, pos = _varint(data, pos)
+            end = data.find(b"\0", pos)
+            name = previous[:len(previous) - strip] + data[pos:end]
+            pos = end + 1
+            previous = name
+        else:
+            length = flags & _NAME_MASK
+            end = pos + length if length < _NAME_MASK else data.find(b"\0", pos)
+            name = bytes(data[pos:end])
+            # Entries are NUL-padded to a multiple of 8 bytes
+            pos = start + ((fixed + (2 if flags & _FLAG_EXTENDED else 0) + len(name) + 8) & ~7)
+        entries.append((name, Entry(fields, oid, (flags >> 12) & 3, xflags)))
+    extensions = {}
+    end = len(data) - hash_size
+    while pos + _EXT_HEADER.size <= end:
+        signature, size = _EXT_HEADER.unpack_from(data, pos)
+        pos += _EXT_HEADER.size
+        extensions[signature] = bytes(data[pos:pos + size])
+        pos += size
+    return entries, extensions
+
+
+def _read_index_file(path, hash_size):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise IndexFormatError("empty index")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_index(data, hash_size)
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+
+# Settings that change how the index is compared with the working tree
+_CONFIG_KEYS = r"^(core\.(autocrlf|filemode|trustctime)|extensions\.objectformat)$"
+
+
+def _git_config(repo_path, git_dir):
+    """Effective {"section.key": value} of _CONFIG_KEYS, lowercased.
+
+    Asks git once, so system, global and XDG config count too (Git for
+    Windows sets core.autocrlf=true system-wide). Without git, only the
+    repo's own config is read.
+    """
+    try:
+        result = subprocess.run(["git", "config", "--get-regexp", _CONFIG_KEYS], cwd=repo_path,
+                                capture_output=True, timeout=10)
+        if result.returncode in (0, 1):  # 1: none of them is set
+            values = {}
+            for line in result.stdout.decode("utf-8", "replace").splitlines():
+                key, _, value = line.partition(" ")
+                values[key.lower()] = value.strip().lower()  # Later (more specific) files win
+            return values
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return _repo_config(git_dir)
+
+
+def _repo_config(git_dir):
+    """Flat {"section.key": value} from the repo's config (enough for core.* and extensions.*)."""
+    values = {}
+    paths = [os.path.join(git_dir, "config")]
+    common_dir = resolve_common_dir(git_dir)
+    if common_dir != git_dir:
+        paths.insert(0, os.path.join(common_dir, "config"))
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        section = ""
+        for line in lines:
+            line = line.split("#", 1)[0].split(";", 1)[0].strip()
+            header = re.match(r'\[\s*([\w.-]+)', line)
+            if header:
+                section = header.group(1).lower()
+                continue
+            if "=" in line:
+                key, value = line.split("=", 1)
+                values[f"{section}.{key.strip().lower()}"] = value.strip().strip('"').lower()
+    return values
+
+
+class GitIndex:
+    def __init__(self, repo_path, git_dir):
+        self.repo_path = repo_path
+        self.git_dir = git_dir
+        self.index_path = os.path.join(git_dir, "index")
+        self.lock = threading.Lock()
+        config = _git_config(repo_path, git_dir)
+        self.sha256 = config.get("extensions.objectformat") == "sha256"
+        self.hash_size = 32 if self.sha256 else 20
+        self.trust_filemode = os.name != "nt" and config.get("core.filemode") not in ("false", "no", "off", "0")
+        self.trust_ctime = os.name != "nt" and config.get("core.trustctime") not in ("false", "no", "off", "0")
+        # Clean/smudge filters and line ending conversion make hashes differ from the blob id
+        self.filters = config.get("core.autocrlf") in ("true", "input") or \
+            os.path.exists(os.path.join(repo_path, ".gitattributes"))
+        self.gitignore = ignore.build(repo_path, use_gitignore=True, git_dir=git_dir)
+        self.entries = {}
+        self.conflicted = set()
+        self.index_stamp = None
+        self.index_mtime_ns = 0
+        self.staged = None
+        self.staged_stamp = None
+        self.usable = True
+        self.loads = 0
+        self.hashed = 0
+        self.answered = 0
+        self.deferred = 0
+
+    def _load(self):
+        """Re-read the index if it changed; caller holds self.lock."""
+        stamp = _stamp(self.index_path)
+        if stamp == self.index_stamp and self.loads:
+            return
+        self.index_stamp = stamp
+        self.loads += 1
+        self.staged = None
+        if stamp is None:
+            # No index yet (nothing ever added): every file is untracked
+            self.entries, self.conflicted, self.usable = {}, set(), True
+            return
+        try:
+            entries, extensions = _read_index_file(self.index_path, self.hash_size)
+            if b"link" in extensions:
+                entries = self._merge_split(entries, extensions[b"link"])
+            if b"sdir" in extensions or any(sig[:1].islower() and sig not in (b"link",) for sig in extensions):
+                raise IndexFormatError("sparse index or unknown required extension")
+        except (OSError, ValueError, struct.error, IndexFormatError) as e:
+            if self.usable:
+                print(f"Reading the git index failed ({e}); using git status instead.")
+            self.entries, self.conflicted, self.usable = {}, set(), False
+            return
+        table = {}
+        conflicted = set()
+        for name, entry in entries:
+            path = name.decode("utf-8", "surrogateescape")
+            if entry.stage:
+                conflicted.add(path)
+            table[path] = entry
+        self.entries, self.conflicted, self.usable = table, conflicted, True
+        self.index_mtime_ns = stamp[0]
+
+    def _merge_split(self, entries, link):
+        """Apply a split index's entries to the shared index it links to."""
+        shared_oid = link[:self.hash_size]
+        if shared_oid == b"\0" * self.hash_size:
+            return entries
+        shared_path = os.path.join(self.git_dir, "sharedindex." + shared_oid.hex())
+        shared, _ = _read_index_file(shared_path, self.hash_size)
+        pos = self.hash_size
+        deleted = replaced = ()
+        if pos < len(link):
+            deleted = _ewah_bits(link[pos:])
+            pos += _ewah_size(link, pos)
+            replaced = _ewah_bits(link[pos:])
+        # The first len(replaced) split entries replace shared entries (their names are left empty)
+        for n, i in enumerate(replaced):
+            shared[i] = (shared[i][0], entries[n][1])
+        for i in deleted:
+            shared[i] = None
+        merged = dict(e for e in shared if e is not None)
+        merged.update(entries[len(replaced):])
+        return list(merged.items())
+
+    def _staged_paths(self):
+        """Paths whose index entry differs from HEAD, refreshed when the index or HEAD changes."""
+        stamp = (self.index_stamp, _stamp(os.path.join(self.git_dir, "HEAD")))
+        if self.staged is not None and stamp == self.staged_stamp:
+            return self.staged
+        result = subprocess.run(["git", "--no-optional-locks", "diff-index", "--cached", "--no-renames",
+                                 "--name-only", "-z", "HEAD", "--"],
+                                cwd=self.repo_path, capture_output=True, timeout=30)
+        if result.returncode == 0:
+            self.staged = set(p for p in result.stdout.decode("utf-8", "surrogateescape").split("\0") if p)
+        else:
+            # No commit yet: everything in the index is a new file
+            self.staged = set(self.entries)
+        self.staged_stamp = stamp
+        return self.staged
+
+    def reload_gitignore(self):
+        self.gitignore = ignore.build(self.repo_path, use_gitignore=True, git_dir=self.git_dir)
+
+    def is_changed(self, rel_path):
+        """True/False like `git status` would report rel_path, or None if git has to decide."""
+        rel_path = rel_path.replace("\\", "/")
+        with self.lock:
+            self._load()
+            if not self.usable:
+                self.deferred += 1
+                return None
+            entry = self.entries.get(rel_path)
+            index_mtime_ns = self.index_mtime_ns
+            if entry is None:
+                self.answered += 1
+                return os.path.lexists(os.path.join(self.repo_path, rel_path)) and not self.gitignore.match(rel_path)
+            if rel_path in self.conflicted or entry.flags & _XFLAG_INTENT_TO_ADD:
+                self.answered += 1
+                return True
+            staged = self._staged_paths()
+        if entry.flags & _XFLAG_SKIP_WORKTREE or entry.mode & _MODE_TYPE == _MODE_GITLINK:
+            changed = False
+        else:
+            changed = self._worktree_changed(rel_path, entry, index_mtime_ns)
+        with self.lock:
+            if changed is None:
+                self.deferred += 1
+                return None
+            self.answered += 1
+        return changed or rel_path in staged
+
+    def _worktree_changed(self, rel_path, entry, index_mtime_ns):
+        path = os.path.join(self.repo_path, rel_path)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return True  # Deleted
+        symlink = entry.mode & _MODE_TYPE == _MODE_SYMLINK
+        if symlink != stat.S_ISLNK(st.st_mode) or not (symlink or stat.S_ISREG(st.st_mode)):
+            return True
+        if self.trust_filemode and not symlink and bool(entry.mode & 0o100) != bool(st.st_mode & 0o100):
+            return True
+        size = st.st_size & 0xffffffff
+        if entry.size != size and entry.size != 0:
+            return True  # A zero size is git's marker for a racily clean entry
+        mtime_s, mtime_ns = divmod(st.st_mtime_ns, 10 ** 9)
+        same = (entry.size == size and entry.mtime == mtime_s & 0xffffffff
+                and (entry.mtime_ns == 0 or entry.mtime_ns == mtime_ns))
+        if same and self.trust_ctime:
+            ctime_s, ctime_ns = divmod(st.st_ctime_ns, 10 ** 9)
+            same = entry.ctime == ctime_s & 0xffffffff and (entry.ctime_ns == 0 or entry.ctime_ns == ctime_ns)
+            same = same and (entry.ino == 0 or entry.ino == st.st_ino & 0xffffffff)
+        # Written in the same instant as the index: stat data cannot tell
+        if same and st.st_mtime_ns < index_mtime_ns:
+            return False
+        try:
+            changed = self._hash(path, symlink, st.st_size) != entry.oid
+        except OSError:
+            return True
+        if changed and self.filters:
+            return None  # The checked-in blob may be a filtered version of the file
+        return changed
+
+    def _hash(self, path, symlink, size):
+        with self.lock:
+            self.hashed += 1
+        digest = hashlib.sha256() if self.sha256 else hashlib.sha1()
+        if symlink:
+            target = os.fsencode(os.readlink(path))
+            digest.update(b"blob %d\0" % len(target))
+            digest.update(target)
+            return digest.digest()
+        digest.update(b"blob %d\0" % size)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+        return digest.digest()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "usable": self.usable,
+                "entries": len(self.entries),
+                "loads": self.loads,
+                "answered": self.answered,
+                "hashed": self.hashed,
+                "deferred_to_git": self.deferred,
+            }
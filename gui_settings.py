@@ -1,10 +1,19 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, scrolledtext
-import os
+import queue
+from collections import deque
 import config
+import ipc
+import logs
+from gitcache import resolve_git_dir
+
+ALL_PROFILES = "All profiles"
+# A standalone GUI looks for a service started later this often, backing off while there is none
+DISCOVER_MIN_MS = 2000
+DISCOVER_MAX_MS = 5000
 
 class SettingsDialog:
-    def __init__(self, root, on_save_callback):
+    def __init__(self, root, on_save_callback, ipc_address=None):
         self.root = root
         self.root.title("Settings - WinLinuxSync")
         self.root.geometry("600x650") # Increased size
@@ -25,6 +34,10 @@ class SettingsDialog:
         # Status Dashboard
         status_frame = tk.LabelFrame(root, text="System Status")
         status_frame.grid(row=0, column=0, columnspan=3, sticky='ew', padx=10, pady=5)
+
+        # One line per running profile, below the indicators
+        self.profiles_status_label = tk.Label(status_frame, text="", fg="gray", anchor='w', justify='left')
+        self.profiles_status_label.pack(side='bottom', fill='x', padx=5)
         
         self.ssh_canvas = tk.Canvas(status_frame, width=20, height=20, highlightthickness=0)
         self.ssh_canvas.pack(side='left', padx=5)
@@ -106,6 +119,16 @@ class SettingsDialog:
         self.user_var = tk.StringVar()
         tk.Entry(details_frame, textvariable=self.user_var, width=40).grid(row=6, column=1, padx=5, pady=5)
 
+        tk.Label(details_frame, text="Blacklist:").grid(row=7, column=0, sticky='w', padx=5, pady=5)
+        self.blacklist_var = tk.StringVar()
+        tk.Entry(details_frame, textvariable=self.blacklist_var, width=40).grid(row=7, column=1, padx=5, pady=5)
+        tk.Label(details_frame, text="comma-separated, e.g. node_modules, dist/, *.log").grid(
+            row=7, column=2, sticky='w', padx=5, pady=5)
+
+        self.enabled_var = tk.BooleanVar()
+        tk.Checkbutton(details_frame, text="Sync this profile (enabled profiles run at the same time)",
+                       variable=self.enabled_var).grid(row=8, column=0, columnspan=3, sticky='w', padx=5, pady=5)
+
 
         # Log Frame
         log_frame = tk.LabelFrame(root, text="Activity Log")
@@ -113,8 +136,28 @@ class SettingsDialog:
         root.grid_rowconfigure(4, weight=1)
         root.grid_columnconfigure(1, weight=1)
 
+        # Filters re-render from the in-memory buffer; the file is never reread
+        filter_frame = tk.Frame(log_frame)
+        filter_frame.pack(fill='x', padx=5, pady=(5, 0))
+        tk.Label(filter_frame, text="Level:").pack(side='left')
+        self.log_level_var = tk.StringVar(value=logs.LEVELS[0])
+        level_combo = ttk.Combobox(filter_frame, textvariable=self.log_level_var, values=logs.LEVELS,
+                                   state="readonly", width=10)
+        level_combo.pack(side='left', padx=5)
+        level_combo.bind("<<ComboboxSelected>>", lambda event: self.render_log())
+        tk.Label(filter_frame, text="Profile:").pack(side='left')
+        self.log_profile_var = tk.StringVar(value=ALL_PROFILES)
+        self.log_profile_combo = ttk.Combobox(filter_frame, textvariable=self.log_profile_var,
+                                              state="readonly", width=25)
+        self.log_profile_combo.pack(side='left', padx=5)
+        self.log_profile_combo.bind("<<ComboboxSelected>>", lambda event: self.render_log())
+
         self.log_text = scrolledtext.ScrolledText(log_frame, height=10, state='disabled', font=('Consolas', 9))
         self.log_text.pack(fill='both', expand=True, padx=5, pady=5)
+        # Ring buffer of (level, profile, line) behind the widget
+        self.log_lines = max(100, int(self.config_data.get("log_lines", 1000)))
+        self.log_records = deque(maxlen=self.log_lines)
+        self.log_tail = logs.LogTail(logs.LOG_FILE)
 
         tk.Button(root, text="Save & Close", command=self.save, bg="#DDDDDD", height=1).grid(row=5, column=1, pady=5)
 
@@ -133,105 +176,176 @@ class SettingsDialog:
             self.profile_combo.current(self.active_index)
             self.on_profile_change(None)
 
-        # Start polling status and logs separately
-        self.poll_status()
+        # Status and log lines are pushed by the sync service over IPC. The
+        # reader thread queues them; the Tk thread drains the queue.
+        self.ipc_address = ipc_address
+        self.ipc_client = None
+        self.events = queue.Queue()
+        self.discover_delay = DISCOVER_MIN_MS
+        self.discover_pending = False
+        if not self.connect_ipc():
+            self.schedule_discovery()
+        self.process_events()
         self.update_logs()
 
-    def manual_connect(self):
-        import json
+    def connect_ipc(self):
+        address = self.ipc_address or ipc.discover()
+        if address is None:
+            return False
         try:
-            with open("control.json", "w") as f:
-                json.dump({"command": "reconnect"}, f)
+            self.ipc_client = ipc.IPCClient(*address, on_message=self.events.put,
+                                            on_disconnect=lambda: self.events.put({"event": "disconnected"}))
+            self.ipc_client.subscribe("status", "log")
+            self.clear_log()
+            return True
         except Exception:
-            pass
+            self.ipc_client = None
+            return False
 
-    def manual_disconnect(self):
-        import json
+    def send_command(self, command):
+        if self.ipc_client is None and not self.connect_ipc():
+            messagebox.showwarning("WinLinuxSync", "The sync service is not running.")
+            return
         try:
-            with open("control.json", "w") as f:
-                json.dump({"command": "stop"}, f)
-        except Exception:
+            self.ipc_client.send(command)
+        except OSError:
+            self.ipc_client = None
+            self.schedule_discovery()
+
+    def process_events(self):
+        try:
+            while True:
+                message = self.events.get_nowait()
+                event = message.get("event")
+                if event == "status":
+                    self.show_status(message["data"])
+                elif event == "log":
+                    data = message["data"]
+                    self.append_log(data["line"], data.get("level", "INFO"), data.get("profile", ""))
+                elif event == "disconnected":
+                    self.ipc_client = None
+                    self.show_status({})
+                    # Follow the file from here on, without repeating what IPC delivered
+                    self.log_tail = logs.LogTail(logs.LOG_FILE, initial_bytes=0)
+                    self.discover_delay = DISCOVER_MIN_MS
+                    self.schedule_discovery()
+                elif message.get("ok") is False:
+                    self.append_log(f"Command failed: {message.get('error')}", "ERROR")
+        except queue.Empty:
             pass
+        self.root.after(100, self.process_events)
+
+    def schedule_discovery(self):
+        # Standalone GUI only; an embedded one is handed the address of its own service
+        if self.ipc_address is None and not self.discover_pending:
+            self.discover_pending = True
+            self.root.after(self.discover_delay, self.discover_service)
+
+    def discover_service(self):
+        """Pick up a service started after the GUI, on a slower timer than the event pump."""
+        self.discover_pending = False
+        if self.ipc_client is not None or self.connect_ipc():
+            self.discover_delay = DISCOVER_MIN_MS
+            return
+        self.discover_delay = min(self.discover_delay * 2, DISCOVER_MAX_MS)
+        self.schedule_discovery()
+
+    def manual_connect(self):
+        self.send_command("reconnect")
+
+    def manual_disconnect(self):
+        self.send_command("stop")
 
     def switch_profile(self):
-        """Save current profile to config and trigger reconnect with new profile."""
-        import json
-        # Save current profile fields first
-        if self.current_display_index != -1:
-            self.update_profile_from_ui(self.current_display_index)
-        
+        """Make the selected profile active and start syncing it; other enabled profiles keep running."""
         # Set active index to selected profile
         active_idx = self.profile_combo.current()
         if active_idx == -1:
             return
+        self.enabled_var.set(True)
+
+        # Save current profile fields first
+        if self.current_display_index != -1:
+            self.update_profile_from_ui(self.current_display_index)
         
         # Save to config file
-        new_config = {
-            "profiles": self.profiles,
-            "active_index": active_idx
-        }
+        new_config = dict(self.config_data, profiles=self.profiles, active_index=active_idx)
         config.save_config(new_config)
+        self.config_data = new_config
         
-        # Trigger reconnect
-        try:
-            with open("control.json", "w") as f:
-                json.dump({"command": "reconnect"}, f)
-        except Exception:
-            pass
+        # Only the profiles that changed are started or stopped
+        self.send_command("apply")
         
         from tkinter import messagebox
         messagebox.showinfo("Profile Switched", f"Switched to: {self.profiles[active_idx].get('name')}")
 
 
-    def poll_status(self):
-        import json
-        import os
-        try:
-            if os.path.exists("status.json"):
-                with open("status.json", "r") as f:
-                    status = json.load(f)
-                    
-                # Update UI
-                ssh_color = "green" if status.get("connected") else "red"
-                mon_color = "green" if status.get("monitoring") else "red"
-                
-                self.ssh_canvas.itemconfig(self.ssh_circle, fill=ssh_color)
-                self.mon_canvas.itemconfig(self.mon_circle, fill=mon_color)
-                    
-        except Exception:
-            pass
-            
-        self.root.after(2000, self.poll_status)  # Slower polling for responsiveness
+    def show_status(self, status):
+        ssh_color = "green" if status.get("connected") else "red"
+        mon_color = "green" if status.get("monitoring") else "red"
+
+        self.ssh_canvas.itemconfig(self.ssh_circle, fill=ssh_color)
+        self.mon_canvas.itemconfig(self.mon_circle, fill=mon_color)
+
+        lines = []
+        for name, profile in sorted((status.get("profiles") or {}).items()):
+            if profile.get("connected"):
+                lines.append(f"{name}: syncing ({profile.get('upload_queue', 0)} queued)")
+            else:
+                lines.append(f"{name}: {profile.get('error') or 'stopped'}")
+        self.profiles_status_label.config(text="\n".join(lines))
+
+    def clear_log(self):
+        self.log_records.clear()
+        self.log_text.config(state='normal')
+        self.log_text.delete(1.0, tk.END)
+        self.log_text.config(state='disabled')
+
+    def log_visible(self, level, profile):
+        min_level = self.log_level_var.get()
+        if min_level in logs.LEVELS and logs.LEVELS.index(level) < logs.LEVELS.index(min_level):
+            return False
+        wanted = self.log_profile_var.get()
+        return wanted == ALL_PROFILES or wanted == profile
+
+    def append_log(self, line, level="INFO", profile=""):
+        self.log_records.append((level, profile, line))
+        if not self.log_visible(level, profile):
+            return
+        self.log_text.config(state='normal')
+        self.log_text.insert(tk.END, line + "\n")
+        lines = int(self.log_text.index('end-1c').split('.')[0])
+        if lines > self.log_lines:
+            self.log_text.delete(1.0, f"{lines - self.log_lines}.0")
+        self.log_text.see(tk.END)
+        self.log_text.config(state='disabled')
+
+    def render_log(self):
+        """Redraw the widget from the buffer after a filter change."""
+        text = "".join(line + "\n" for level, profile, line in self.log_records
+                       if self.log_visible(level, profile))
+        self.log_text.config(state='normal')
+        self.log_text.delete(1.0, tk.END)
+        self.log_text.insert(tk.END, text)
+        self.log_text.see(tk.END)
+        self.log_text.config(state='disabled')
 
     def update_logs(self):
-        import os
-        try:
-            if os.path.exists("sync.log"):
-                with open("sync.log", "r", encoding="utf-8", errors="ignore") as f:
-                    # Only read last 10KB to prevent freezing on large logs
-                    f.seek(0, 2)  # Seek to end
-                    size = f.tell()
-                    max_bytes = 10000
-                    if size > max_bytes:
-                        f.seek(size - max_bytes)
-                        f.readline()  # Skip partial line
-                    else:
-                        f.seek(0)
-                    content = f.read()
-                    
-                    self.log_text.config(state='normal')
-                    self.log_text.delete(1.0, tk.END)
-                    self.log_text.insert(tk.END, content)
-                    self.log_text.see(tk.END)
-                    self.log_text.config(state='disabled')
-        except Exception:
-            pass
-        self.root.after(2000, self.update_logs)  # Slower polling to reduce CPU
+        # Log lines arrive over IPC while the service is reachable; otherwise
+        # follow sync.log, reading only what was appended since last time
+        if self.ipc_client is None:
+            try:
+                for line in self.log_tail.read_new():
+                    self.append_log(line, *logs.parse_line(line))
+            except Exception:
+                pass
+        self.root.after(2000, self.update_logs)
         
 
     def refresh_profile_list(self):
         names = [p.get("name", "Unnamed") for p in self.profiles]
         self.profile_combo['values'] = names
+        self.log_profile_combo['values'] = [ALL_PROFILES] + names
         if 0 <= self.current_display_index < len(names):
              self.profile_combo.current(self.current_display_index)
 
@@ -256,18 +370,24 @@ class SettingsDialog:
         self.host_var.set(p.get("server_host", ""))
         self.port_var.set(p.get("server_port", 22))
         self.user_var.set(p.get("username", ""))
+        self.blacklist_var.set(", ".join(p.get("blacklist", [])))
+        self.enabled_var.set(config.is_profile_enabled(dict(self.config_data, profiles=self.profiles), p))
 
     def update_profile_from_ui(self, idx):
         if 0 <= idx < len(self.profiles):
-            self.profiles[idx] = {
+            # Keep settings that have no field in this dialog (e.g. upload_workers)
+            self.profiles[idx] = dict(self.profiles[idx])
+            self.profiles[idx].update({
                 "name": self.name_var.get(),
                 "local_path": self.local_path_var.get(),
                 "sync_branch": self.sync_branch_var.get(),
                 "remote_path": self.remote_path_var.get(),
                 "server_host": self.host_var.get(),
                 "server_port": self.port_var.get(),
-                "username": self.user_var.get()
-            }
+                "username": self.user_var.get(),
+                "blacklist": [entry.strip() for entry in self.blacklist_var.get().split(",") if entry.strip()],
+                "enabled": self.enabled_var.get()
+            })
 
     def add_profile(self):
         # Save current first
@@ -304,7 +424,7 @@ class SettingsDialog:
     def _on_local_path_change(self, *args):
         """Update the git indicator and inline warning whenever the local path changes."""
         path = self.local_path_var.get()
-        is_git = os.path.isdir(os.path.join(path, '.git')) if path else False
+        is_git = resolve_git_dir(path) is not None if path else False
         color = "green" if is_git else "red"
         self.git_canvas.itemconfig(self.git_circle, fill=color)
         if path and not is_git:
@@ -316,7 +436,7 @@ class SettingsDialog:
         folder = filedialog.askdirectory()
         if folder:
             self.local_path_var.set(folder)
-            if not os.path.isdir(os.path.join(folder, '.git')):
+            if resolve_git_dir(folder) is None:
                 messagebox.showwarning(
                     "Not a Git Repository",
                     f"The selected folder does not contain a .git directory:\n\n{folder}\n\n"
@@ -333,10 +453,7 @@ class SettingsDialog:
         active_idx = self.profile_combo.current()
         if active_idx == -1: active_idx = 0
 
-        new_config = {
-            "profiles": self.profiles,
-            "active_index": active_idx
-        }
+        new_config = dict(self.config_data, profiles=self.profiles, active_index=active_idx)
         
         config.save_config(new_config)
         messagebox.showinfo("Saved", f"Configuration saved.\nActive Profile: {self.profiles[active_idx].get('name')}")
@@ -345,9 +462,9 @@ class SettingsDialog:
             self.on_save_callback(new_config)
         self.root.destroy()
 
-def open_settings(on_save_callback=None):
+def open_settings(on_save_callback=None, ipc_address=None):
     root = tk.Tk()
-    app = SettingsDialog(root, on_save_callback)
+    app = SettingsDialog(root, on_save_callback, ipc_address)
     root.mainloop()
 
 if __name__ == "__main__":
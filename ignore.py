@@ -0,0 +1,220 @@
+"""Blacklist and .gitignore rules compiled into one matcher.
+
+Checked for every filesystem event before any git or network work, so an
+`npm install` or a build into dist/ is dropped at intake instead of
+reaching GitChecker tens of thousands of times.
+
+Rules use .gitignore syntax: `node_modules` matches a file or folder of
+that name at any depth, `dist/` only folders, `/build` only at the top,
+and `*.log`, `docs/**/*.pdf` are globs. A path is checked one folder at a
+time from the top, so a match prunes the whole subtree. Plain names are
+looked up in a set; all other rules are combined into one regex. Only when
+`!` rules are present are rules evaluated one by one, in order.
+"""
+import os
+import re
+import subprocess
+
+_GLOB_CHARS = set("*?[")
+# Remembered results for folders, which repeat across events
+DIR_CACHE_SIZE = 50000
+
+
+class Rule:
+    __slots__ = ("pattern", "regex", "negate", "dir_only", "name")
+
+    def __init__(self, pattern, regex, negate, dir_only, name):
+        self.pattern = pattern
+        self.regex = regex
+        self.negate = negate
+        self.dir_only = dir_only
+        self.name = name  # Set for plain names that match any path segment
+
+
+def _translate(glob):
+    """Regex source for a gitignore glob (without anchors)."""
+    out = []
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        if c == '*':
+            if glob.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if glob.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = glob.find(']', i + 2 if glob.startswith('[!', i) or glob.startswith('[^', i) else i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(glob[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def parse_rule(line, base=""):
+    """A Rule for one .gitignore or blacklist line, or None for blanks and comments.
+
+    base is the folder (relative, with /) of the .gitignore the line came from.
+    """
+    line = line.rstrip('\n\r')
+    # Trailing spaces are ignored unless escaped
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    line = stripped
+    if not line or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith('\\#') or line.startswith('\\!'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    line = line.lstrip('/')
+    prefix = re.escape(base.strip('/') + '/') if base.strip('/') else ''
+    if anchored:
+        regex = prefix + _translate(line)
+    else:
+        regex = prefix + '(?:.*/)?' + _translate(line)
+    name = line if not anchored and not base.strip('/') and not (_GLOB_CHARS & set(line)) \
+        and '\\' not in line else None
+    return Rule(line, regex, negate, dir_only, name)
+
+
+class IgnoreMatcher:
+    def __init__(self, rules=()):
+        self.rules = [r for r in rules if r is not None]
+        self.has_negations = any(r.negate for r in self.rules)
+        self.names = {r.name for r in self.rules if r.name and not r.dir_only}
+        self.dir_names = {r.name for r in self.rules if r.name and r.dir_only}
+        globs = [r for r in self.rules if not r.name]
+        self.combined = self._combine(r for r in globs if not r.dir_only)
+        self.combined_dir = self._combine(r for r in globs if r.dir_only)
+        self.compiled = [(re.compile(r.regex + r'\Z'), r) for r in self.rules] if self.has_negations else None
+        self.dir_cache = {}
+
+    @staticmethod
+    def _combine(rules):
+        sources = ['(?:' + r.regex + ')' for r in rules]
+        return re.compile('(?:' + '|'.join(sources) + r')\Z') if sources else None
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, relative_path, is_dir=False):
+        """True if relative_path, or any folder above it, is ignored."""
+        if not self.rules:
+            return False
+        parts = relative_path.replace('\\', '/').strip('/').split('/')
+        last = len(parts) - 1
+        prefix = ""
+        for i, part in enumerate(parts):
+            prefix = part if i == 0 else prefix + '/' + part
+            folder = i < last or is_dir
+            if i < last:
+                cached = self.dir_cache.get(prefix)
+                if cached is not None:
+                    if cached:
+                        return True
+                    continue
+            result = self._match_one(prefix, part, folder)
+            if i < last:
+                if len(self.dir_cache) >= DIR_CACHE_SIZE:
+                    self.dir_cache.clear()
+                self.dir_cache[prefix] = result
+            if result:
+                return True
+        return False
+
+    def _match_one(self, path, name, folder):
+        if self.compiled is not None:
+            # Last matching rule wins, so "!" can re-include
+            ignored = False
+            for regex, rule in self.compiled:
+                if (folder or not rule.dir_only) and regex.match(path):
+                    ignored = not rule.negate
+            return ignored
+        if name in self.names or (folder and name in self.dir_names):
+            return True
+        if self.combined is not None and self.combined.match(path):
+            return True
+        return folder and self.combined_dir is not None and self.combined_dir.match(path) is not None
+
+
+def _read_rules(path, base=""):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return [parse_rule(line, base) for line in f]
+    except OSError:
+        return []
+
+
+def _gitignore_files(local_base_path, *options):
+    """Relative paths of the .gitignore files `git ls-files` lists with options."""
+    try:
+        result = subprocess.run(["git", "ls-files", "-z", *options, "--", ":(glob)**/.gitignore"],
+                                cwd=local_base_path, capture_output=True, timeout=30)
+        if result.returncode == 0:
+            return {p for p in result.stdout.decode("utf-8", "surrogateescape").split("\0") if p}
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return set()
+
+
+def tracked_gitignores(local_base_path):
+    """The .gitignore files in the index; reads only the index, so it is cheap to repeat."""
+    return frozenset(_gitignore_files(local_base_path))
+
+
+def gitignore_rules(local_base_path, git_dir=None):
+    """Rules from core.excludesFile, .git/info/exclude and every .gitignore git sees, outermost first.
+
+    Untracked .gitignore files count too, unless they are ignored themselves.
+    """
+    rules = []
+    try:
+        result = subprocess.run(["git", "config", "--path", "core.excludesFile"], cwd=local_base_path,
+                                capture_output=True, text=True, timeout=10)
+        excludes = result.stdout.strip() if result.returncode == 0 else ""
+    except (OSError, subprocess.SubprocessError):
+        excludes = ""
+    if not excludes:
+        config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+        excludes = os.path.join(config_home, "git", "ignore")
+    rules.extend(_read_rules(excludes))
+    if git_dir:
+        rules.extend(_read_rules(os.path.join(git_dir, "info", "exclude")))
+    paths = {".gitignore"} | _gitignore_files(local_base_path, "--cached", "--others", "--exclude-standard")
+    for rel in sorted(paths, key=lambda p: (p.count('/'), p)):
+        rules.extend(_read_rules(os.path.join(local_base_path, rel), os.path.dirname(rel)))
+    return rules
+
+
+def build(local_base_path, blacklist=(), use_gitignore=False, git_dir=None):
+    """Matcher for a profile: its .gitignore rules (optional), then its blacklist, which wins."""
+    if isinstance(blacklist, str):
+        blacklist = blacklist.split(",")
+    rules = gitignore_rules(local_base_path, git_dir) if use_gitignore else []
+    rules.extend(parse_rule(entry.strip()) for entry in blacklist if entry.strip())
+    return IgnoreMatcher(rules)
@@ -0,0 +1,58 @@
+"""Single-instance lock for the sync service, on Windows and POSIX.
+
+The lock is an OS-level lock on LOCK_FILE (msvcrt on Windows, flock
+elsewhere), so it is released automatically if the process dies.
+"""
+import os
+import time
+
+LOCK_FILE = "winlinuxsync.lock"
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class InstanceLock:
+    def __init__(self, path=LOCK_FILE):
+        self.path = path
+        self.handle = None
+
+    def acquire(self, timeout=0):
+        """Take the lock, waiting up to timeout seconds; False if another process holds it."""
+        deadline = time.monotonic() + timeout
+        while True:
+            handle = open(self.path, "a+")
+            try:
+                _lock(handle)
+                self.handle = handle
+                return True
+            except OSError:
+                handle.close()
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def release(self):
+        if self.handle:
+            try:
+                _unlock(self.handle)
+            except OSError:
+                pass
+            self.handle.close()
+            self.handle = None
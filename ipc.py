@@ -0,0 +1,282 @@
+"""Local control channel between the sync service and the GUI.
+
+A localhost TCP socket speaking newline-delimited JSON. Each connection
+first sends {"command": "hello", "token": ...} with the token published
+in status.json. After that:
+
+    -> {"id": 1, "command": "reconnect"}
+    <- {"id": 1, "ok": true, "result": ...}
+    -> {"id": 2, "command": "subscribe", "topics": ["status", "log"]}
+    <- {"event": "status", "data": {...}}
+    <- {"event": "log", "data": {"line": "..."}}
+
+Commands run as soon as they arrive, and events are pushed to subscribers
+as they happen, so neither side polls files.
+"""
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+
+HOST = "127.0.0.1"
+# Log lines replayed to a new log subscriber
+LOG_BACKLOG = 500
+# Events queued for a client that stopped reading before it is dropped
+CLIENT_QUEUE_SIZE = 10000
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+
+
+def _lines(sock):
+    """Yield decoded JSON messages until the peer closes the connection."""
+    buf = b''
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buf += data
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            if line.strip():
+                yield json.loads(line)
+
+
+class _Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.topics = set()
+        self.outbox = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.closed = False
+
+    def post(self, message):
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(message)
+        except queue.Full:
+            self.close()
+            print("IPC client stopped reading; disconnected it")
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class IPCServer:
+    """Serve commands to local clients and push events to subscribers.
+
+    handlers maps a command name to handler(message) -> JSON-serialisable
+    result. Handlers run on the connection's thread, one command at a time.
+    """
+
+    def __init__(self, handlers, host=HOST, port=0):
+        self.handlers = dict(handlers)
+        self.token = secrets.token_hex(16)
+        self.lock = threading.Lock()
+        self.clients = []
+        self.log_backlog = deque(maxlen=LOG_BACKLOG)
+        self.last_status = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind((host, port))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept_loop, name="IPCServer", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+    def publish(self, event, data):
+        """Push an event to every client subscribed to it. Never blocks."""
+        message = {"event": event, "data": data}
+        with self.lock:
+            if event == "log":
+                self.log_backlog.append(data)
+            elif event == "status":
+                self.last_status = data
+            clients = [c for c in self.clients if event in c.topics]
+        for client in clients:
+            client.post(message)
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(sock)
+            threading.Thread(target=self._serve, args=(client,), name="IPCClient", daemon=True).start()
+
+    def _writer(self, client):
+        while True:
+            message = client.outbox.get()
+            if message is None or client.closed:
+                return
+            try:
+                _send(client.sock, message)
+            except OSError:
+                client.close()
+                return
+
+    def _serve(self, client):
+        try:
+            messages = _lines(client.sock)
+            hello = next(messages, None)
+            if (not hello or hello.get("command") != "hello"
+                    or not hmac.compare_digest(str(hello.get("token", "")), self.token)):
+                _send(client.sock, {"ok": False, "error": "authentication failed"})
+                return
+            _send(client.sock, {"ok": True, "pid": os.getpid()})
+            threading.Thread(target=self._writer, args=(client,), name="IPCWriter", daemon=True).start()
+            with self.lock:
+                self.clients.append(client)
+            for message in messages:
+                client.post(self._dispatch(client, message))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+            client.close()
+
+    def _dispatch(self, client, message):
+        reply = {"id": message.get("id")}
+        command = message.get("command")
+        if command == "subscribe":
+            topics = set(message.get("topics") or ["status", "log"])
+            with self.lock:
+                # Start a new subscriber with the current state
+                backlog = list(self.log_backlog) if "log" in topics and "log" not in client.topics else []
+                status = self.last_status if "status" in topics else None
+                client.topics |= topics
+            if status is not None:
+                client.post({"event": "status", "data": status})
+            for data in backlog:
+                client.post({"event": "log", "data": data})
+            reply.update(ok=True, result=sorted(client.topics))
+            return reply
+        handler = self.handlers.get(command)
+        if handler is None:
+            reply.update(ok=False, error=f"unknown command: {command}")
+            return reply
+        try:
+            reply.update(ok=True, result=handler(message))
+        except Exception as e:
+            reply.update(ok=False, error=str(e))
+        return reply
+
+
+class IPCClient:
+    """Connection to an IPCServer.
+
+    Replies and events are delivered to on_message(message) on a background
+    thread; a GUI should hand them to its own thread (e.g. via a queue).
+    on_disconnect() is called once the connection is gone.
+    """
+
+    def __init__(self, port, token, on_message=None, on_disconnect=None, host=HOST, timeout=5):
+        self.on_message = on_message or (lambda message: None)
+        self.on_disconnect = on_disconnect or (lambda: None)
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.next_id = 0
+        self.messages = _lines(self.sock)
+        _send(self.sock, {"command": "hello", "token": token})
+        reply = next(self.messages, None)
+        if not reply or not reply.get("ok"):
+            self.sock.close()
+            raise ConnectionRefusedError((reply or {}).get("error", "connection closed"))
+        self.sock.settimeout(None)
+        self.thread = threading.Thread(target=self._read_loop, name="IPCClientReader", daemon=True)
+        self.thread.start()
+
+    def send(self, command, **fields):
+        """Send a command without waiting for the reply; returns its id."""
+        with self.send_lock:
+            self.next_id += 1
+            message = dict(fields, id=self.next_id, command=command)
+            _send(self.sock, message)
+            return self.next_id
+
+    def subscribe(self, *topics):
+        return self.send("subscribe", topics=list(topics))
+
+    def _read_loop(self):
+        try:
+            for message in self.messages:
+                self.on_message(message)
+        except (OSError, ValueError):
+            pass
+        self.on_disconnect()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def request(address, command, timeout=5, **fields):
+    """Send one command to the service at address (port, token) and return its reply.
+
+    Raises OSError if the service cannot be reached and TimeoutError if it
+    does not answer within timeout seconds.
+    """
+    replies = queue.Queue()
+    client = IPCClient(*address, on_message=replies.put, on_disconnect=lambda: replies.put(None), timeout=timeout)
+    try:
+        sent = client.send(command, **fields)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError(f"no reply to {command}") from None
+            if message is None:
+                raise ConnectionError("the service closed the connection")
+            if message.get("id") == sent:
+                return message
+    finally:
+        client.close()
+
+
+def discover(status_path="status.json"):
+    """(port, token) of the running service as published in status.json, or None."""
+    try:
+        with open(status_path, "r") as f:
+            info = json.load(f).get("ipc") or {}
+        return info["port"], info["token"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
@@ -0,0 +1,164 @@
+"""Durable journal of uploads and remote operations that failed.
+
+A failed upload is recorded on disk per profile and path, so it survives
+crashes and restarts. A drain thread hands entries back to the upload
+workers once their backoff has expired. A path has at most one entry;
+retries always read the file as it is now, so only the latest version is sent.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+import logs
+from coalescer import PendingEvent
+
+JOURNAL_FILE = "journal.db"
+
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+# An entry handed to the workers is not handed out again for this long,
+# even if the worker never reports back (e.g. it was stopped)
+LEASE_SECONDS = 120.0
+
+
+def backoff(attempts):
+    """Seconds to wait before attempt number attempts + 1, with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class RetryJournal:
+    def __init__(self, profile, db_path=JOURNAL_FILE):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pending (
+            profile TEXT, rel_path TEXT, local_path TEXT, kind TEXT,
+            src_path TEXT, src_rel_path TEXT,
+            attempts INTEGER, first_failed REAL, next_attempt REAL,
+            PRIMARY KEY (profile, rel_path))""")
+        # Paths with an entry, so successful uploads of other paths cost no query
+        self.keys = {row[0] for row in self.db.execute(
+            "SELECT rel_path FROM pending WHERE profile=?", (profile,))}
+        # Entries from a previous run are due right away
+        self.db.execute("UPDATE pending SET next_attempt=? WHERE profile=?", (time.time(), profile))
+        self.retries = 0
+        self.recovered = 0
+        self.submit = None
+        self.running = False
+        self.thread = None
+        if self.keys:
+            print(f"Retry journal: {len(self.keys)} pending change(s) from a previous run")
+
+    @staticmethod
+    def _key(rel_path):
+        return rel_path.replace('\\', '/')
+
+    def record(self, entry, attempted=True):
+        """Store entry (a PendingEvent) for a later retry; the newest entry per path wins.
+
+        attempted=False records work that was never tried (e.g. dropped on
+        stop); it is due immediately and does not count as a failure.
+        """
+        key = self._key(entry.relative_path)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT attempts, first_failed FROM pending WHERE profile=? AND rel_path=?",
+                                  (self.profile, key)).fetchone()
+            attempts, first_failed = row if row else (0, now)
+            if attempted:
+                attempts += 1
+            next_attempt = now + backoff(attempts) if attempted else now
+            self.db.execute(
+                "INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.profile, key, entry.path, entry.kind, entry.src_path, entry.src_relative_path,
+                 attempts, first_failed, next_attempt))
+            self.keys.add(key)
+        if attempted:
+            print(f"Queued {entry.relative_path} for retry #{attempts} in {next_attempt - now:.0f}s")
+        self.wakeup.set()
+
+    def done(self, rel_path):
+        """The path was synced; forget any pending retry for it."""
+        key = self._key(rel_path)
+        with self.lock:
+            if key not in self.keys:
+                return
+            self.keys.discard(key)
+            self.db.execute("DELETE FROM pending WHERE profile=? AND rel_path=?", (self.profile, key))
+            self.recovered += 1
+
+    def take_due(self, limit=500):
+        """Lease and return the PendingEvents whose backoff has expired."""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT rel_path, local_path, kind, src_path, src_rel_path FROM pending "
+                "WHERE profile=? AND next_attempt<=? ORDER BY next_attempt LIMIT ?",
+                (self.profile, now, limit)).fetchall()
+            if rows:
+                self.db.executemany("UPDATE pending SET next_attempt=? WHERE profile=? AND rel_path=?",
+                                    [(now + LEASE_SECONDS, self.profile, row[0]) for row in rows])
+                self.retries += len(rows)
+        monotonic = time.monotonic()
+        return [PendingEvent(local_path, rel_path, kind, monotonic, src_path, src_rel_path)
+                for rel_path, local_path, kind, src_path, src_rel_path in rows]
+
+    def _next_due(self):
+        with self.lock:
+            row = self.db.execute("SELECT MIN(next_attempt) FROM pending WHERE profile=?",
+                                  (self.profile,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, submit):
+        """Drain due entries into submit(list_of_pending_events) on a background thread."""
+        self.submit = submit
+        self.running = True
+        self.thread = threading.Thread(target=logs.inherit_profile(self._run), name="RetryJournal", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _run(self):
+        while self.running:
+            try:
+                due = self.take_due()
+                if due:
+                    print(f"Retrying {len(due)} failed change(s)")
+                    self.submit(due)
+                    continue
+                next_due = self._next_due()
+            except Exception as e:
+                print(f"Retry journal error: {e}")
+                next_due = None
+            timeout = 5.0 if next_due is None else min(5.0, max(0.1, next_due - time.time()))
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def stats(self):
+        with self.lock:
+            depth, oldest, attempts = self.db.execute(
+                "SELECT COUNT(*), MIN(first_failed), COALESCE(SUM(attempts), 0) FROM pending WHERE profile=?",
+                (self.profile,)).fetchone()
+            retries, recovered = self.retries, self.recovered
+        return {
+            "depth": depth,
+            "oldest_age_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "failed_attempts": attempts,
+            "retries": retries,
+            "recovered": recovered
+        }
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.db.close()
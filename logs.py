@@ -0,0 +1,234 @@
+"""sync.log writing, rotation and incremental reading.
+
+Every line the service prints is stamped with time, level and profile:
+
+    2026-02-18 14:03:11 ERROR   [Work] Failed to upload C:\\repo\\a.py: ...
+
+so the GUI can filter by level or profile without rereading the file.
+The level is inferred from the message, since the code base logs with print.
+Several profiles sync at once, so the profile is tracked per thread: a
+profile's threads run inside profile_scope(), and threads they start
+inherit it through inherit_profile().
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_FILE = "sync.log"
+LEVELS = ("INFO", "WARNING", "ERROR")
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUPS = 2
+# How much of an existing log the GUI shows when it starts tailing
+INITIAL_BYTES = 64 * 1024
+
+_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (INFO|WARNING|ERROR) +\[([^\]]*)\] ?(.*)$')
+
+
+_context = threading.local()
+
+
+def current_profile(default=""):
+    return getattr(_context, "profile", default)
+
+
+@contextmanager
+def profile_scope(profile):
+    """Stamp lines printed by this thread with profile until the block exits."""
+    previous = getattr(_context, "profile", None)
+    _context.profile = profile
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _context.profile
+        else:
+            _context.profile = previous
+
+
+def inherit_profile(target):
+    """Wrap a thread target so the new thread logs under the current thread's profile."""
+    profile = getattr(_context, "profile", None)
+    if profile is None:
+        return target
+
+    def run(*args, **kwargs):
+        with profile_scope(profile):
+            return target(*args, **kwargs)
+    return run
+
+
+def level_of(message):
+    lowered = message.lower()
+    if "failed" in lowered or "error" in lowered:
+        return "ERROR"
+    if "warning" in lowered:
+        return "WARNING"
+    return "INFO"
+
+
+def format_line(message, profile="", level=None, now=None):
+    level = level or level_of(message)
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+    return f"{stamp} {level:<7} [{profile}] {message}"
+
+
+def parse_line(line):
+    """(level, profile) of a formatted line; unstamped lines count as INFO."""
+    match = _LINE.match(line)
+    if match is None:
+        return level_of(line), ""
+    return match.group(2), match.group(3)
+
+
+class RotatingLogFile:
+    """Append-only log that is renamed to path.1 (path.2, ...) once it reaches max_bytes."""
+
+    def __init__(self, path=LOG_FILE, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+        self.size = self.file.tell()
+
+    def write_line(self, line):
+        data = line + "\n"
+        if self.max_bytes and self.size + len(data) > self.max_bytes and self.size:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data.encode("utf-8"))
+
+    def rotate(self):
+        # Windows cannot rename an open file, so close it first
+        self.file.close()
+        try:
+            for i in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{i}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{i + 1}")
+            if self.backups:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        except OSError:
+            pass  # e.g. a reader holds the file open; keep appending to it
+        self.file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self.size = self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LogTee:
+    """stdout replacement: stamps each printed line, writes it to the log and publishes it.
+
+    publish(data) receives {"line", "level", "profile"} for every line,
+    e.g. to push it to IPC subscribers. Lines are stamped with the printing
+    thread's profile, or with self.profile outside any profile_scope().
+    With echo (e.g. the real stdout of a headless service), stamped lines
+    are written there as well.
+    """
+
+    def __init__(self, logfile, publish=None, profile="", echo=None):
+        self.logfile = logfile
+        self.publish = publish
+        self.profile = profile
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.partial = ""
+
+    def write(self, text):
+        records = []
+        profile = current_profile(self.profile)
+        with self.lock:
+            lines = (self.partial + text).split("\n")
+            self.partial = lines.pop()
+            for message in lines:
+                level = level_of(message)
+                line = format_line(message, profile, level)
+                self.logfile.write_line(line)
+                if self.echo:
+                    try:
+                        self.echo.write(line + "\n")
+                    except (OSError, ValueError):
+                        self.echo = None  # Console went away; keep logging to the file
+                records.append({"line": line, "level": level, "profile": profile})
+        # Published outside the lock: a print from a subscriber path must not deadlock
+        if self.publish:
+            for record in records:
+                self.publish(record)
+        return len(text)
+
+    def flush(self):
+        self.logfile.flush()
+        if self.echo:
+            self.echo.flush()
+
+
+class LogTail:
+    """Reads lines appended to a log file since the last call.
+
+    Tracks the byte offset and the file's identity. A truncated file is read
+    again from the start; after a rotation, the rest of the old file (now
+    path.1) is read before the new one. The file is not kept open between
+    calls, so the writer can rotate it on Windows.
+    """
+
+    def __init__(self, path=LOG_FILE, initial_bytes=INITIAL_BYTES):
+        self.path = path
+        self.identity = None
+        self.offset = None
+        self.initial_bytes = initial_bytes
+
+    @staticmethod
+    def _identity(st):
+        return (st.st_dev, st.st_ino)
+
+    def _read_from(self, path, offset):
+        """(complete lines from offset, offset after the last newline)."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n")
+        if end == -1:
+            return [], offset
+        text = data[:end].decode("utf-8", "replace")
+        return text.split("\n"), offset + end + 1
+
+    def read_new(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        lines = []
+        identity = self._identity(st)
+        if self.offset is None:
+            # First read: show the tail of the existing log, from a line start
+            self.offset = max(0, st.st_size - self.initial_bytes)
+            if self.offset:
+                with open(self.path, "rb") as f:
+                    f.seek(self.offset)
+                    self.offset += len(f.readline())
+        elif identity != self.identity:
+            # Rotated: finish the previous file if it is still around as path.1
+            try:
+                rotated = self.path + ".1"
+                if self._identity(os.stat(rotated)) == self.identity:
+                    lines, _ = self._read_from(rotated, self.offset)
+            except OSError:
+                pass
+            self.offset = 0
+        elif st.st_size < self.offset:
+            self.offset = 0  # Truncated
+        self.identity = identity
+        if st.st_size > self.offset:
+            try:
+                new_lines, self.offset = self._read_from(self.path, self.offset)
+                lines.extend(new_lines)
+            except OSError:
+                pass
+        return lines
@@ -4,137 +4,405 @@ import os
 import json
 
 import config
-import monitor
-import uploader
+import ipc
+import logs
+import metrics
 
-def update_status_file(connected=False, monitoring=False, error=None):
+# paramiko and watchdog (via connpool, monitor and uploader) take a few
+# hundred ms to import, so the sync engine is imported when a profile starts.
+
+def update_status_file(connected=False, monitoring=False, error=None, stats=None, ipc_info=None):
     status = {
         "connected": connected,
         "monitoring": monitoring,
         "error": error,
         "pid": os.getpid()
     }
+    if ipc_info:
+        status["ipc"] = ipc_info
+    if stats:
+        status.update(stats)
     try:
         with open("status.json", "w") as f:
             json.dump(status, f)
     except Exception:
         pass
+    return status
 
-class App:
-    def __init__(self):
-        self.monitor = None
+class ProfileSync:
+    """One profile's uploader, retry journal and monitor, started and stopped together."""
+
+    def __init__(self, cfg, observer=None, budget=None):
+        self.cfg = cfg
+        self.name = cfg.get("name", "")
+        self.observer = observer
+        self.budget = budget
         self.upl = None
-        self.config_data = config.load_config()
+        self.journal = None
+        self.monitor = None
         self.connected = False
+        self.error = None
+
+    def start(self):
+        # Lines printed here and by the threads started here carry the profile name
+        with logs.profile_scope(self.name):
+            self._start(watch=True)
+
+    def _start(self, watch):
+        import connpool
+        import journal
+        import manifest
+        import monitor
+        import resumable
+        import scheduler
+        import uploader
+
+        cfg = self.cfg
+        print(f"Starting sync service for profile: {self.name}...")
+        upload_manifest = None
+        if cfg.get("skip_unchanged", True):
+            upload_manifest = manifest.UploadManifest(self.name, cfg["remote_path"])
+        resumable_min_mb = cfg.get("resumable_min_mb", config.DEFAULT_PROFILE["resumable_min_mb"])
+        upload_workers = cfg.get("upload_workers", config.DEFAULT_PROFILE["upload_workers"])
+        self.upl = uploader.Uploader(cfg["server_host"], cfg["server_port"], cfg["username"], cfg["remote_path"],
+                                     delta_transfer=cfg.get("delta_transfer", True),
+                                     max_outstanding_writes=cfg.get("max_outstanding_writes", 64),
+                                     key_filename=cfg.get("key_filename") or None,
+                                     bulk_compress=cfg.get("bulk_compress", True),
+                                     manifest=upload_manifest,
+                                     compression_mode=cfg.get("compression", "auto"),
+                                     pool=connpool.POOL,
+                                     resume_store=resumable.ResumeStore(self.name) if resumable_min_mb else None,
+                                     resumable_min_size=int(resumable_min_mb * 1024 * 1024),
+                                     limiter=scheduler.LIMITER,
+                                     channels=uploader.Uploader.channels_needed(upload_workers))
+
+        sync_branch = cfg.get("sync_branch", "")
+        bulk_threshold = cfg.get("bulk_threshold", config.DEFAULT_PROFILE["bulk_threshold"])
+        background_min_mb = cfg.get("background_min_mb", config.DEFAULT_PROFILE["background_min_mb"])
+        # Failed changes are kept on disk and retried with backoff, also across restarts
+        self.journal = journal.RetryJournal(self.name)
+        self.monitor = monitor.Monitor(cfg["local_path"], self.upl, sync_branch, upload_workers, bulk_threshold,
+                                       self.journal, observer=self.observer, budget=self.budget,
+                                       profile=self.name, blacklist=cfg.get("blacklist", []),
+                                       use_gitignore=cfg.get("use_gitignore", False),
+                                       git_index=cfg.get("git_index", True),
+                                       priority_rules=cfg.get("priority_rules") or {},
+                                       background_min_size=int(background_min_mb * 1024 * 1024))
+        if watch:
+            # Collect changes while the SSH login is still in progress
+            self.monitor.start_watching()
+
+        # Test connection first
+        if not self.upl.connect():
+            print("Could not connect on startup")
+            self.stop()
+            self.error = "Connection Failed"
+            return False
+
+        self.monitor.start(watch)
+        if cfg.get("reconcile_on_connect", True) or not watch:
+            # Catch up on changes made while we were stopped, alongside live monitoring
+            self.monitor.reconcile()
+
+        self.connected = True
+        self.error = None
+        print(f"Connected to {cfg['server_host']}, monitoring {cfg['local_path']}")
+        return True
+
+    def sync_once(self):
+        """Upload what changed while nothing was watching, wait for it, then stop.
+
+        Returns the number of changes left in the retry journal, or None if
+        the server could not be reached.
+        """
+        with logs.profile_scope(self.name):
+            if not self._start(watch=False):
+                return None
+            self.monitor.wait_idle()
+            left = self.journal.stats().get("depth", 0)
+            self.stop()
+            self.error = None
+            return left
+
+    def stop(self):
+        with logs.profile_scope(self.name):
+            if self.monitor:
+                print("Stopping sync service...")
+                self.monitor.stop()
+                self.monitor = None
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+            if self.upl:
+                self.upl.close()
+                self.upl = None
+        self.connected = False
+        self.error = "Stopped"
+
+    def status(self):
+        status = {"connected": self.connected, "monitoring": self.monitor is not None, "error": self.error}
+        if self.monitor:
+            status.update(self.monitor.stats())
+        return status
+
+
+class App:
+    def __init__(self, echo=False):
+        self.config_data = config.load_config()
+        # Profile name -> ProfileSync for every profile started (running or failed)
+        self.sessions = {}
+        # Serialises starting and stopping profiles
+        self.sessions_lock = threading.Lock()
+        # All profiles share one watchdog observer and one upload worker
+        # budget, created with the sync engine when the first profile starts
+        self.observer = None
+        self.budget = None
+        self.stop_requested = threading.Event()
         self.running = True
+        self.last_error = None
+        self.status_event = threading.Event()
+
+        # Commands from the GUI arrive over a local socket and run immediately;
+        # status and log lines are pushed back the same way. reconnect and stop
+        # take an optional "profile"; without one they act on every profile.
+        self.ipc = ipc.IPCServer({
+            "reconnect": lambda message: self.run_command("reconnect", message.get("profile")),
+            "stop": lambda message: self.run_command("stop", message.get("profile")),
+            "apply": lambda message: self.run_command("apply"),
+            "status": lambda message: self.write_status(),
+        })
+        self.ipc.start()
         # Init status as disconnected
         self.update_status()
         
-        # Redirect logs to file for GUI
-        self.logfile = open("sync.log", "a", buffering=1)
-        sys.stdout = self.logfile
-        sys.stderr = self.logfile
+        # Redirect logs to file for GUI; lines are stamped with time, level and profile
+        self.logfile = logs.RotatingLogFile(logs.LOG_FILE,
+                                            self.config_data.get("log_max_bytes", logs.DEFAULT_MAX_BYTES))
+        self.log = logs.LogTee(self.logfile, lambda record: self.ipc.publish("log", record),
+                               echo=sys.__stdout__ if echo else None)
+        sys.stdout = self.log
+        sys.stderr = self.log
+
+        # Optional Prometheus endpoint on localhost
+        self.metrics_server = None
+        metrics_port = self.config_data.get("metrics_port", 0)
+        if metrics_port:
+            try:
+                self.metrics_server = metrics.MetricsServer(metrics_port)
+                self.metrics_server.start()
+            except OSError as e:
+                print(f"Could not start metrics endpoint on port {metrics_port}: {e}")
+
+        # Refreshes status while syncing so counters stay current
+        threading.Thread(target=self.status_loop, daemon=True).start()
 
-        # Start command listener
-        threading.Thread(target=self.command_loop, daemon=True).start()
+    @property
+    def connected(self):
+        return any(s.connected for s in list(self.sessions.values()))
+
+    @property
+    def monitoring(self):
+        return any(s.monitor is not None for s in list(self.sessions.values()))
 
     def update_status(self, error=None):
-        monitoring = (self.monitor is not None)
-        update_status_file(self.connected, monitoring, error)
+        self.last_error = error
+        self.write_status()
+
+    def write_status(self):
+        sessions = dict(self.sessions)
+        stats = {
+            "profiles": {name: session.status() for name, session in sessions.items()},
+            "upload_budget": self.budget.stats() if self.budget else {},
+            "background_limit": {},
+            "connections": {},
+            "metrics": metrics.snapshot(),
+        }
+        if self.budget:
+            import connpool
+            import scheduler
+            stats["connections"] = connpool.POOL.stats()
+            stats["background_limit"] = scheduler.LIMITER.stats()
+        error = self.last_error or next((s.error for s in sessions.values() if s.error), None)
+        status = update_status_file(self.connected, self.monitoring, error, stats,
+                                    {"port": self.ipc.port, "token": self.ipc.token})
+        self.ipc.publish("status", status)
+        return status
+
+    def run_command(self, command, profile=None):
+        if command == "reconnect":
+            print("Reconnect triggered via command.")
+            self.start_sync(profile)
+        elif command == "stop":
+            print("Stop triggered via command.")
+            self.stop_sync(profile)
+        elif command == "apply":
+            self.apply_profiles()
+        self.write_status()
+        return {"connected": self.connected}
 
-    def command_loop(self):
-        import time
+    def status_loop(self):
+        # Only wakes up while a sync is running; idle, nothing is written
         while self.running:
-            try:
-                if os.path.exists("control.json"):
-                    with open("control.json", "r") as f:
-                        cmd = json.load(f)
-                    os.remove("control.json") # Consume command
-                    
-                    if cmd.get("command") == "reconnect":
-                        print("Reconnect triggered via command.")
-                        self.start_sync()
-                    elif cmd.get("command") == "stop":
-                        print("Stop triggered via command.")
-                        self.stop_sync()
-                    
-                    self.update_status()
-            except Exception:
-                pass
-            time.sleep(0.5)
-
-    def start_sync(self):
-        if self.monitor:
-            self.stop_sync()
-        
-        # Reload config in case it changed
-        self.config_data = config.load_config()
-        cfg = config.get_active_profile(self.config_data)
-        
-        if not cfg or not cfg.get("local_path") or not cfg.get("server_host"):
+            self.status_event.wait(5 if self.sessions else None)
+            self.status_event.clear()
+            if self.running and self.sessions:
+                self.write_status()
+
+    def apply_profiles(self, restart=()):
+        """Bring the running profiles in line with config.json.
+
+        Newly enabled profiles are started and disabled or removed ones are
+        stopped; profiles whose settings did not change keep running. Names in
+        restart (or every profile, if restart is True) are restarted anyway.
+        """
+        with self.sessions_lock:
+            # Reload config in case it changed
+            self.config_data = config.load_config()
+            if self.budget is None:
+                import monitor
+                import uploader
+                self.observer = monitor.SharedObserver()
+                self.budget = uploader.WorkerBudget()
+            self.budget.resize(self.config_data.get("upload_workers_total", 8))
+            import connpool
+            import scheduler
+            scheduler.LIMITER.set_mbit(self.config_data.get("background_limit_mbit", 0))
+            connpool.POOL.max_channels = self.config_data.get("ssh_max_sessions", connpool.MAX_CHANNELS)
+            wanted = {}
+            for cfg in config.get_enabled_profiles(self.config_data):
+                name = cfg.get("name", "")
+                if not cfg.get("local_path") or not cfg.get("server_host"):
+                    print(f"Profile {name} has no local path or server; not syncing it.")
+                elif name in wanted:
+                    print(f"More than one profile is named {name}; only the first one is synced.")
+                else:
+                    wanted[name] = cfg
+
+            for name, session in list(self.sessions.items()):
+                if (restart is True or name in restart or name not in wanted
+                        or wanted[name] != session.cfg or not session.connected):
+                    session.stop()
+                    del self.sessions[name]
+
+            # Profiles connect in parallel, so one unreachable server does not hold up the rest
+            starting = [ProfileSync(cfg, self.observer, self.budget)
+                        for name, cfg in wanted.items() if name not in self.sessions]
+            threads = [threading.Thread(target=s.start, name=f"Start-{s.name}") for s in starting]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for session in starting:
+                self.sessions[session.name] = session
+
+        if not wanted:
             print("Config missing or invalid active profile.")
             self.update_status("Config missing")
-            return
+        else:
+            self.update_status()
+        self.status_event.set()
 
-        print(f"Starting sync service for profile: {cfg.get('name')}...")
-        self.upl = uploader.Uploader(cfg["server_host"], cfg["server_port"], cfg["username"], cfg["remote_path"])
-        
-        # Test connection first
-        if not self.upl.connect():
-            print("Could not connect on startup")
-            self.update_status("Connection Failed")
-            return
-            
-        sync_branch = cfg.get("sync_branch", "")
-        self.monitor = monitor.Monitor(cfg["local_path"], self.upl, sync_branch)
-        self.monitor.start()
-
-        self.connected = True
-        self.update_status()
-        print(f"Connected to {cfg['server_host']}, monitoring {cfg['local_path']}")
+    def start_sync(self, profile=None):
+        """(Re)start every enabled profile, or only the named one."""
+        self.apply_profiles(restart=True if profile is None else (profile,))
 
-    def stop_sync(self):
-        if self.monitor:
-            print("Stopping sync service...")
-            self.monitor.stop()
-            self.monitor = None
-        if self.upl:
-            self.upl.close()
-            self.upl = None
-            
-        self.connected = False
-        self.update_status("Stopped")
+    def stop_sync(self, profile=None):
+        with self.sessions_lock:
+            names = list(self.sessions) if profile is None else [n for n in self.sessions if n == profile]
+            for name in names:
+                self.sessions.pop(name).stop()
+        self.update_status("Stopped" if not self.sessions else None)
 
     def shutdown(self):
         self.running = False
+        self.status_event.set()
         self.stop_sync()
+        if self.observer:
+            import connpool
+            self.observer.stop()
+            connpool.POOL.close_all()
+        self.ipc.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
         print("Application shutdown.")
 
+    def run_headless(self):
+        """Sync every enabled profile without a window until asked to stop.
+
+        Stops on the IPC "shutdown" command (python cli.py stop), SIGTERM or Ctrl+C.
+        """
+        import signal
+
+        def request_stop(*args):
+            self.stop_requested.set()
+            return {"stopping": True}
+
+        self.ipc.handlers["shutdown"] = request_stop
+        signal.signal(signal.SIGINT, request_stop)
+        if hasattr(signal, "SIGTERM"):
+            signal.signal(signal.SIGTERM, request_stop)
+        print(f"Sync service running headless (pid {os.getpid()})")
+        self.apply_profiles()
+        # Wake up regularly so signals are handled on Windows too
+        while not self.stop_requested.wait(1):
+            pass
+        self.shutdown()
+
     def main(self):
         import gui_settings
         
         # Auto-start sync if configured
-        active_p = config.get_active_profile(self.config_data)
-        if active_p and active_p.get("server_host"):
-            self.start_sync()
+        if any(p.get("server_host") for p in config.get_enabled_profiles(self.config_data)):
+            self.apply_profiles()
 
-        # Run settings as the main window (blocking)
-        gui_settings.open_settings(on_save_callback=lambda cfg: self.start_sync())
+        # Run settings as the main window (blocking); saving only starts or
+        # stops the profiles that changed
+        gui_settings.open_settings(on_save_callback=lambda cfg: self.apply_profiles(),
+                                   ipc_address=(self.ipc.port, self.ipc.token))
         
         # When settings window is closed, shutdown
         self.shutdown()
 
+def sync_once(names=None):
+    """Sync each enabled profile (or the named ones) once, without watching.
+
+    Returns a process exit code: 0 when everything is on the server.
+    """
+    cfg_data = config.load_config()
+    if names:
+        # Named profiles are synced even if they are not enabled
+        profiles = [p for p in cfg_data.get("profiles", []) if p.get("name") in names]
+    else:
+        profiles = config.get_enabled_profiles(cfg_data)
+    if not profiles:
+        print("No matching profile to sync.")
+        return 2
+    import connpool
+    import scheduler
+    scheduler.LIMITER.set_mbit(cfg_data.get("background_limit_mbit", 0))
+    connpool.POOL.max_channels = cfg_data.get("ssh_max_sessions", connpool.MAX_CHANNELS)
+    code = 0
+    for cfg in profiles:
+        if not cfg.get("local_path") or not cfg.get("server_host"):
+            print(f"Profile {cfg.get('name')} has no local path or server; skipped.")
+            code = 2
+            continue
+        left = ProfileSync(cfg).sync_once()
+        if left is None:
+            code = 1
+        elif left:
+            print(f"{cfg.get('name')}: {left} change(s) failed and are kept for retry")
+            code = 1
+    return code
+
 if __name__ == "__main__":
-    import msvcrt
+    import instancelock
     import tkinter as tk
     
-    LOCK_FILE = "winlinuxsync.lock"
-    
     # Try to acquire exclusive lock
-    try:
-        lock_handle = open(LOCK_FILE, "w")
-        msvcrt.locking(lock_handle.fileno(), msvcrt.LK_NBLCK, 1)
-    except (IOError, OSError):
+    lock = instancelock.InstanceLock()
+    if not lock.acquire():
         # Another instance is running
         import tkinter.messagebox
         root = tk.Tk()
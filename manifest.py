@@ -0,0 +1,116 @@
+"""Persistent record of what was last uploaded, used to skip no-op uploads.
+
+Editors and formatters often rewrite files without changing their content.
+For every file we upload we remember size, mtime and SHA-1 per profile and
+remote path; an upload whose content hash matches the record is skipped.
+"""
+import sqlite3
+import threading
+import time
+
+MANIFEST_FILE = "manifest.db"
+
+
+class ManifestEntry:
+    __slots__ = ("size", "mtime_ns", "sha1")
+
+    def __init__(self, size, mtime_ns, sha1):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha1 = sha1
+
+
+class UploadManifest:
+    def __init__(self, profile, remote_base, db_path=MANIFEST_FILE):
+        self.profile = profile
+        self.remote_base = remote_base
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+            profile TEXT, remote_base TEXT, rel_path TEXT,
+            size INTEGER, mtime_ns INTEGER, sha1 TEXT, uploaded_at REAL,
+            PRIMARY KEY (profile, remote_base, rel_path))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS savings (
+            profile TEXT, remote_base TEXT, skipped_files INTEGER, skipped_bytes INTEGER,
+            PRIMARY KEY (profile, remote_base))""")
+
+    @staticmethod
+    def _key(rel_path):
+        return rel_path.replace('\\', '/')
+
+    def lookup(self, rel_path):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, sha1 FROM files WHERE profile=? AND remote_base=? AND rel_path=?",
+                (self.profile, self.remote_base, self._key(rel_path))).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def record(self, rel_path, size, mtime_ns, sha1):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.profile, self.remote_base, self._key(rel_path), size, mtime_ns, sha1, time.time()))
+
+    def forget(self, rel_path):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM files WHERE profile=? AND remote_base=? AND rel_path=?",
+                (self.profile, self.remote_base, self._key(rel_path)))
+
+    def paths_under(self, prefix):
+        """Recorded paths inside the directory prefix."""
+        prefix = self._key(prefix).rstrip('/') + '/'
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT rel_path FROM files WHERE profile=? AND remote_base=? AND substr(rel_path, 1, ?)=?",
+                (self.profile, self.remote_base, len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def forget_tree(self, prefix):
+        prefix = self._key(prefix).rstrip('/')
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM files WHERE profile=? AND remote_base=? AND (rel_path=? OR substr(rel_path, 1, ?)=?)",
+                (self.profile, self.remote_base, prefix, len(prefix) + 1, prefix + '/'))
+
+    def rename(self, old_path, new_path):
+        """Move the records of a renamed file or directory to its new path."""
+        old, new = self._key(old_path).rstrip('/'), self._key(new_path).rstrip('/')
+        match = "profile=? AND remote_base=? AND (rel_path=? OR substr(rel_path, 1, ?)=?)"
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                # Whatever the rename replaced on the server is gone
+                self.db.execute("DELETE FROM files WHERE " + match,
+                                (self.profile, self.remote_base, new, len(new) + 1, new + '/'))
+                self.db.execute("UPDATE files SET rel_path = ? || substr(rel_path, ?) WHERE " + match,
+                                (new, len(old) + 1, self.profile, self.remote_base, old, len(old) + 1, old + '/'))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def note_skipped(self, nbytes):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR IGNORE INTO savings VALUES (?, ?, 0, 0)", (self.profile, self.remote_base))
+            self.db.execute(
+                "UPDATE savings SET skipped_files = skipped_files + 1, skipped_bytes = skipped_bytes + ? "
+                "WHERE profile=? AND remote_base=?", (nbytes, self.profile, self.remote_base))
+
+    def stats(self):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT skipped_files, skipped_bytes FROM savings WHERE profile=? AND remote_base=?",
+                (self.profile, self.remote_base)).fetchone()
+            tracked = self.db.execute(
+                "SELECT COUNT(*) FROM files WHERE profile=? AND remote_base=?",
+                (self.profile, self.remote_base)).fetchone()[0]
+        skipped_files, skipped_bytes = row if row else (0, 0)
+        return {"tracked_files": tracked, "skipped_uploads": skipped_files, "skipped_bytes": skipped_bytes}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,15 +1,31 @@
-import time
 import os
+import time
 import threading
 import subprocess
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+import ignore
+import logs
+import metrics
+from checkout import CheckoutTracker, diff_name_status
+from coalescer import EventCoalescer, PendingEvent
+from gitcache import GitStatusCache, HeadCache, resolve_common_dir, resolve_git_dir
+from gitindex import GitIndex
+from reconcile import Reconciler
+from scheduler import PriorityRules
+from uploader import UploadPool
+
 class GitChecker:
-    def __init__(self, local_base_path, sync_branch=""):
+    def __init__(self, local_base_path, sync_branch="", use_index=True):
         self.local_base_path = local_base_path
         self.sync_branch = sync_branch
-        self.is_git_repo = os.path.isdir(os.path.join(local_base_path, '.git'))
+        self.git_dir = resolve_git_dir(local_base_path)
+        self.is_git_repo = self.git_dir is not None
+        self.status_cache = GitStatusCache(local_base_path, self.git_dir)
+        # Answers most checks from .git/index without starting git; the status cache covers the rest
+        self.index = GitIndex(local_base_path, self.git_dir) if self.is_git_repo and use_index else None
+        self.head_cache = HeadCache(self.git_dir) if self.is_git_repo else None
         if self.is_git_repo:
             print(f"Git repo detected at {local_base_path}. Git-aware filtering enabled.")
             if self.sync_branch:
@@ -20,37 +36,10 @@ class GitChecker:
     def get_current_branch(self) -> str:
         if not self.is_git_repo:
             return ""
-        try:
-            # Try git branch --show-current first (git >= 2.22)
-            result = subprocess.run(
-                ['git', 'branch', '--show-current'],
-                cwd=self.local_base_path,
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0 and result.stdout.strip():
-                return result.stdout.strip()
-            # Fallback: git rev-parse --abbrev-ref HEAD
-            result = subprocess.run(
-                ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
-                cwd=self.local_base_path,
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                branch = result.stdout.strip()
-                if branch != 'HEAD':  # HEAD means detached
-                    return branch
-        except Exception:
-            pass
-        return ""
-
-    def is_file_changed(self, file_path) -> bool:
-        """Returns True if git sees changes for this file (modified, added, or untracked).
-        Returns False if the file is clean, gitignored, or if git is unavailable.
-        """
+        return self.head_cache.current_branch()
+
+    def sync_allowed(self) -> bool:
+        """False if this is not a git repo or another branch than sync_branch is checked out."""
         if not self.is_git_repo:
             return False
 
@@ -58,7 +47,16 @@ class GitChecker:
             current_branch = self.get_current_branch()
             if current_branch != self.sync_branch:
                 print(f"Branch mismatch: current '{current_branch}' != sync '{self.sync_branch}'")
+                metrics.inc("events_filtered_total", filter="branch")
                 return False
+        return True
+
+    def is_file_changed(self, file_path, quiet=False) -> bool:
+        """Returns True if git sees changes for this file (modified, added, deleted or untracked).
+        Returns False if the file is clean, gitignored, or if git is unavailable.
+        """
+        if not self.sync_allowed():
+            return False
 
         # Use relative path for git status to avoid Windows path casing issues
         try:
@@ -67,119 +65,663 @@ class GitChecker:
             rel_path = file_path  # fallback for cross-drive paths
 
         try:
-            result = subprocess.run(
-                ['git', 'status', '--porcelain', rel_path],
-                cwd=self.local_base_path,
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode != 0:
-                print(f"Warning: git status returned non-zero for {rel_path}")
-                return False
-            is_changed = bool(result.stdout.strip())
-            if not is_changed:
+            with metrics.timer("stage_seconds", stage="git_check"):
+                is_changed = self.index.is_changed(rel_path) if self.index else None
+                if is_changed is None:
+                    is_changed = self.status_cache.is_changed(rel_path)
+            if not is_changed and not quiet:
                 print(f"Git says file is clean (no pending changes): {rel_path}")
+                metrics.inc("events_filtered_total", filter="git_clean")
             return is_changed
         except FileNotFoundError:
             print("Warning: git not found on PATH. File upload suppressed.")
-            return False
         except subprocess.TimeoutExpired:
             print(f"Warning: git status timed out for {file_path}.")
-            return False
         except Exception as e:
             print(f"Warning: git check failed: {e}")
-            return False
+        metrics.inc("errors_total", stage="git")
+        return False
+
+    def on_git_internal_change(self, relative_path):
+        """Called for watchdog events inside .git; keeps the HEAD cache fresh."""
+        if self.head_cache and relative_path.replace('\\', '/') == '.git/HEAD':
+            self.head_cache.invalidate()
+
+    def reload_gitignore(self):
+        if self.index:
+            self.index.reload_gitignore()
+
+    def mark_tree_dirty(self):
+        """A directory moved or vanished; its children's status is unknown."""
+        if self.is_git_repo:
+            self.status_cache.invalidate()
+
+    def changed_paths_under(self, relative_path):
+        """Paths git reports as changed (including deleted) inside a directory."""
+        if not self.is_git_repo:
+            return []
+        prefix = relative_path.replace('\\', '/').rstrip('/') + '/'
+        try:
+            changed, _ = self.status_cache.changed_paths()
+        except Exception as e:
+            print(f"Warning: git check failed: {e}")
+            return []
+        return [p for p in changed if p.startswith(prefix)]
+
+    def mark_dirty(self, file_path):
+        """Tell the status cache that file_path changed on disk."""
+        if not self.is_git_repo:
+            return
+        try:
+            rel_path = os.path.relpath(file_path, self.local_base_path)
+        except ValueError:
+            return
+        self.status_cache.mark_dirty(rel_path)
 
 
 class SyncHandler(FileSystemEventHandler):
-    def __init__(self, uploader, local_base_path, sync_branch=""):
+    # Pending kinds that are remote operations rather than uploads
+    OPERATION_KINDS = ("deleted", "dir_deleted", "renamed", "dir_moved", "checkout_deleted")
+    # Local mtimes this close to the last known HEAD still count as written by the checkout
+    CHECKOUT_MTIME_SLACK = 2
+
+    def __init__(self, uploader, local_base_path, sync_branch="", upload_workers=4, bulk_threshold=200,
+                 journal=None, budget=None, profile="", blacklist=(), use_gitignore=False, git_index=True,
+                 priority_rules=None, background_min_size=8 * 1024 * 1024):
         self.uploader = uploader
         self.local_base_path = local_base_path
         self.paused = False
+        # Name stamped on log lines printed while handling this handler's events
+        self.profile = profile
+        # Optional RetryJournal: failed changes are kept on disk and retried
+        self.journal = journal
 
-        # Debouncing: track last upload time per file
-        self.last_upload = {}
-        self.debounce_seconds = 2  # Ignore duplicate events within 2 seconds
-        self.lock = threading.Lock()
+        # Trailing-edge debounce: bursts of events per file are collapsed and
+        # only handed on once the file has been quiet for quiet_seconds.
+        self.quiet_seconds = 1.0
+        self.coalescer = EventCoalescer(self.enqueue_uploads, quiet_seconds=self.quiet_seconds,
+                                        on_failed=self.record_failure)
+
+        # Above this many files going quiet at once, send them as one tar stream
+        self.bulk_threshold = bulk_threshold
+
+        # Bounded hand-off to a pool of upload workers so the observer thread
+        # never waits on git or network I/O. Small and recently edited files go first.
+        self.priorities = PriorityRules(priority_rules, background_min_size)
+        self.upload_pool = UploadPool(uploader, self.handle_pending, workers=upload_workers,
+                                      on_failed=self.record_failure, budget=budget, owner=profile,
+                                      classify=self.classify)
 
         # Git-aware filtering: check once at startup if this is a git repo
-        self.git_checker = GitChecker(local_base_path, sync_branch)
+        self.git_checker = GitChecker(local_base_path, sync_branch, git_index)
 
-    def should_upload(self, file_path):
-        """Check if enough time has passed since last upload of this file."""
-        with self.lock:
-            now = time.time()
-            last = self.last_upload.get(file_path, 0)
-            if now - last < self.debounce_seconds:
-                return False
-            self.last_upload[file_path] = now
+        # Blacklist (and optionally .gitignore) rules, checked before anything else
+        self.blacklist = blacklist
+        self.use_gitignore = use_gitignore
+        self.ignore = ignore.build(local_base_path, blacklist, use_gitignore, self.git_checker.git_dir)
+        # `git add -f` or `git rm --cached` of a .gitignore changes the rules
+        # without an event for the file itself; the index is checked instead
+        self.tracked_gitignores = None
+        self.index_stamp = None
+        if self.git_checker.is_git_repo:
+            self.tracked_gitignores = ignore.tracked_gitignores(local_base_path)
+            self.index_stamp = self._index_stamp()
+
+        # Branch switches, rebases and resets are held back and applied as one batch
+        self.checkout = None
+        self.synced_head = None
+        if self.git_checker.is_git_repo:
+            git_dir = self.git_checker.git_dir
+            self.checkout = CheckoutTracker(git_dir, resolve_common_dir(git_dir), self.apply_checkout,
+                                            self.enqueue_uploads, busy=lambda: len(self.coalescer) > 0)
+            self.synced_head = self.checkout.head
+
+        # Recent directory renames (src -> (dest, time)); watchdog follows each
+        # with a moved event per child, which the single remote rename covers.
+        self.moved_dirs = {}
+
+    def start(self):
+        self.coalescer.start()
+        self.upload_pool.start()
+        if self.checkout:
+            self.checkout.start()
+        if self.journal:
+            self.journal.start(self.retry_failed)
+
+    def stop(self):
+        # Debounced changes not handed on yet are kept for the next start, like queued uploads
+        dropped = self.coalescer.stop()
+        for entry in dropped:
+            self.record_failure(entry, attempted=False)
+        if dropped:
+            print(f"Kept {len(dropped)} pending change(s) for the next start" if self.journal
+                  else f"Discarded {len(dropped)} pending change(s) on stop")
+        if self.journal:
+            self.journal.stop()
+        if self.checkout:
+            self.checkout.stop()
+        self.upload_pool.stop()
+
+    def classify(self, entry):
+        """(priority class, sort key) of a pending entry for the upload scheduler."""
+        size = 0
+        if entry.kind not in self.OPERATION_KINDS:
+            try:
+                size = os.stat(entry.path).st_size
+            except OSError:
+                pass
+        return self.priorities.key(entry.relative_path.replace('\\', '/'), size, entry.last_seen,
+                                   background=entry.kind == "reconcile")
+
+    def record_failure(self, entry, attempted=True):
+        if self.journal:
+            self.journal.record(entry, attempted=attempted)
+
+    def retry_failed(self, entries):
+        """Called by the retry journal with entries whose backoff expired."""
+        for entry in entries:
+            self.upload_pool.submit(entry.path, entry)
+
+    def enqueue_uploads(self, entries):
+        """Called by the coalescer with the paths that have gone quiet."""
+        if self.checkout and self.checkout.hold(entries):
+            return
+        self.submit_entries(entries)
+
+    def submit_entries(self, entries):
+        if self.bulk_threshold and len(entries) >= self.bulk_threshold:
+            operations = [e for e in entries if e.kind in self.OPERATION_KINDS]
+            entries = operations + self.upload_bulk([e for e in entries if e.kind not in self.OPERATION_KINDS])
+        for entry in entries:
+            self.upload_pool.submit(entry.path, entry)
+
+    def upload_bulk(self, entries):
+        """Send a large change set as one tar stream.
+
+        Runs on the thread that handed the entries over (coalescer, checkout
+        or reconciler), so further flushes wait until the batch is done. Only
+        the reconciler's batches are throttled to background_limit_mbit.
+        Returns the entries that still need a per-file upload.
+        """
+        selected = [e for e in entries if not self.paused and os.path.isfile(e.path) and (
+            self.git_checker.is_file_changed(e.path) if e.kind != "checkout" else self.git_checker.sync_allowed())]
+        if len(selected) < self.bulk_threshold:
+            return selected
+        catch_up = all(e.kind == "reconcile" for e in selected)
+        failed = self.uploader.upload_bulk([(e.path, e.relative_path) for e in selected], force=catch_up,
+                                           background=catch_up)
+        if failed is None:
+            return selected
+        failed = set(failed)
+        now = time.monotonic()
+        for e in selected:
+            if e.relative_path not in failed:
+                metrics.observe("sync_latency_seconds", now - e.first_seen)
+        return [e for e in selected if e.relative_path in failed]
+
+    def apply_checkout(self, old_head, new_head, held, since):
+        """Called by the checkout tracker once HEAD moved and the working tree settled.
+
+        Files the commits differ in are uploaded (or removed) even though git
+        now calls them clean, but only if the checkout rewrote them; a commit
+        or `git reset --soft` leaves them alone. Other changes held during
+        the checkout go the usual way.
+        """
+        if not self.git_checker.sync_allowed():
+            print(f"HEAD moved to {(new_head or '')[:10]} on a branch that is not synced; "
+                  f"dropping {len(held)} changes")
+            return {"uploads": 0, "deletes": 0}
+        old_head = self.synced_head or old_head
+        self.synced_head = new_head
+        held_by_path = {e.relative_path: e for e in held}
+        # Without a diff, upload whatever changed on disk during the checkout
+        changes = [("M", e.relative_path) for e in held if e.kind not in self.OPERATION_KINDS]
+        if old_head and new_head:
+            try:
+                changes = diff_name_status(self.local_base_path, old_head, new_head)
+            except Exception as e:
+                print(f"git diff {old_head[:10]}..{new_head[:10]} failed ({e}); uploading what changed on disk")
+        entries = []
+        threshold = since - self.CHECKOUT_MTIME_SLACK
+        now = time.monotonic()
+        for status, rel in changes:
+            relative_path = os.path.normpath(rel)
+            path = os.path.join(self.local_base_path, relative_path)
+            if self.is_temp_file(path) or self.ignore.match(relative_path):
+                continue
+            if status == "D":
+                if not os.path.lexists(path):
+                    entries.append(PendingEvent(path, relative_path, "checkout_deleted", now))
+                    held_by_path.pop(relative_path, None)
+                continue
+            try:
+                rewritten = os.stat(path).st_mtime >= threshold
+            except OSError:
+                continue
+            if rewritten or relative_path in held_by_path:
+                entries.append(PendingEvent(path, relative_path, "checkout", now))
+                held_by_path.pop(relative_path, None)
+        uploads = len(entries) - sum(e.kind == "checkout_deleted" for e in entries)
+        print(f"HEAD moved {(old_head or 'none')[:10]} -> {(new_head or 'none')[:10]}: {uploads} files to upload, "
+              f"{len(entries) - uploads} to remove, {len(held_by_path)} other changes")
+        metrics.inc("checkout_batches_total")
+        self.submit_entries(entries + list(held_by_path.values()))
+        return {"uploads": uploads, "deletes": len(entries) - uploads, "other": len(held_by_path)}
+
+    def handle_pending(self, entry, sftp):
+        if self.paused:
+            metrics.inc("events_filtered_total", filter="paused")
+            return
+        result = self.sync_entry(entry, sftp)
+        if result is False:
+            self.record_failure(entry)
+            return
+        if result:
+            # From the first filesystem event until the change is on the server
+            metrics.observe("sync_latency_seconds", time.monotonic() - entry.first_seen)
+        if self.journal:
+            self.journal.done(entry.relative_path)
+
+    def sync_entry(self, entry, sftp):
+        """Apply one pending change; returns False if it failed and should be retried."""
+        if entry.kind == "deleted":
+            return self.handle_delete(entry, sftp)
+        if entry.kind == "dir_deleted":
+            return self.handle_dir_delete(entry, sftp)
+        if entry.kind == "renamed":
+            return self.handle_rename(entry, sftp)
+        if entry.kind == "dir_moved":
+            return self.handle_dir_move(entry, sftp)
+        if entry.kind == "checkout_deleted":
+            return self.handle_checkout_delete(entry, sftp)
+        if not os.path.isfile(entry.path):
+            return
+
+        if entry.kind == "checkout":
+            # Clean as far as git goes, but the checkout changed it
+            if not self.git_checker.sync_allowed():
+                return
+            print(f"Checked out: {entry.relative_path}")
+            return self.uploader.upload_file(entry.path, entry.relative_path, sftp)
+
+        # Git-aware filter: only upload if git sees changes for this file
+        if not self.git_checker.is_file_changed(entry.path):
+            return
+
+        if entry.kind == "moved":
+            print(f"File moved to: {entry.relative_path}")
+        else:
+            print(f"Detected change in: {entry.relative_path}")
+        # Reconciliation already established that the server copy differs
+        return self.uploader.upload_file(entry.path, entry.relative_path, sftp, force=entry.kind == "reconcile")
+
+    def remove_if_synced(self, path, relative_path, sftp):
+        """Remove a deleted file remotely, but only if git tracked it or we uploaded it."""
+        if not (self.git_checker.is_file_changed(path, quiet=True) or self.uploader.was_uploaded(relative_path)):
+            return
+        print(f"Detected deletion of: {relative_path}")
+        return self.uploader.remove_remote(relative_path, sftp)
+
+    def handle_delete(self, entry, sftp):
+        if os.path.exists(entry.path) or not self.git_checker.sync_allowed():
+            return
+        results = [self.remove_if_synced(entry.path, entry.relative_path, sftp)]
+        if entry.src_path is not None and not os.path.exists(entry.src_path):
+            # Renamed and then deleted before either was handled
+            results.append(self.remove_if_synced(entry.src_path, entry.src_relative_path, sftp))
+        return False not in results
+
+    def handle_checkout_delete(self, entry, sftp):
+        # The old commit had the file, so the server has it too
+        if os.path.lexists(entry.path) or not self.git_checker.sync_allowed():
+            return
+        print(f"Removed by checkout: {entry.relative_path}")
+        return self.uploader.remove_remote(entry.relative_path, sftp)
+
+    def handle_dir_delete(self, entry, sftp):
+        if os.path.exists(entry.path) or not self.git_checker.sync_allowed():
+            return
+        paths = set(self.git_checker.changed_paths_under(entry.relative_path))
+        if self.uploader.manifest:
+            paths.update(self.uploader.manifest.paths_under(entry.relative_path))
+        paths = sorted(p for p in paths if not os.path.exists(os.path.join(self.local_base_path, p)))
+        print(f"Detected deletion of directory: {entry.relative_path}")
+        return self.uploader.remove_remote_dir(entry.relative_path, paths, sftp)
+
+    def handle_rename(self, entry, sftp):
+        if not os.path.isfile(entry.path) or not self.git_checker.sync_allowed():
+            return
+        if not self.git_checker.is_file_changed(entry.path):
+            # Moved to a path we do not sync: as far as the server goes, it was deleted
+            if not os.path.exists(entry.src_path):
+                return self.remove_if_synced(entry.src_path, entry.src_relative_path, sftp)
+            return
+
+        print(f"File moved: {entry.src_relative_path} -> {entry.relative_path}")
+        if self.uploader.rename_remote(entry.src_relative_path, entry.relative_path, sftp) and not entry.edited:
             return True
+        # The server had no copy to rename, or the file was edited around the rename
+        return self.uploader.upload_file(entry.path, entry.relative_path, sftp)
+
+    def handle_dir_move(self, entry, sftp):
+        if not os.path.isdir(entry.path) or not self.git_checker.sync_allowed():
+            return
+        print(f"Directory moved: {entry.src_relative_path or '(ignored)'} -> {entry.relative_path}")
+        try:
+            if entry.src_relative_path is not None and self.uploader.rename_remote(
+                    entry.src_relative_path, entry.relative_path, sftp, is_dir=True):
+                return
+            # Nothing to rename on the server: upload the contents like new files
+            for root, dirs, names in os.walk(entry.path):
+                rel_root = os.path.relpath(root, self.local_base_path)
+                dirs[:] = [d for d in dirs if not self.ignore.match(os.path.join(rel_root, d), True)]
+                for name in names:
+                    path = os.path.join(root, name)
+                    relative_path = os.path.join(rel_root, name)
+                    if not self.is_temp_file(path) and not self.ignore.match(relative_path):
+                        self.coalescer.add(path, relative_path, "created")
+        finally:
+            # Changes to its files that were still pending when the directory moved
+            if entry.children:
+                self.coalescer.requeue(entry.children)
+
+    def dispatch(self, event):
+        start = time.perf_counter()
+        metrics.inc("events_total", kind=event.event_type)
+        # The observer thread is shared by all profiles
+        with logs.profile_scope(self.profile):
+            super().dispatch(event)
+        metrics.observe("stage_seconds", time.perf_counter() - start, stage="event_intake")
+
+    def on_git_internal(self, relative_path):
+        self.git_checker.on_git_internal_change(relative_path)
+        if relative_path.replace('\\', '/') == '.git/index':
+            self.check_tracked_gitignores()
+        if self.checkout:
+            self.checkout.notify(relative_path.replace('\\', '/').split('/', 1)[-1])
+
+    @staticmethod
+    def is_git_internal(relative_path):
+        """True for paths inside the repository's .git directory."""
+        first = relative_path.replace('\\', '/').split('/', 1)[0]
+        return first == '.git'
+
+    @staticmethod
+    def is_temp_file(path):
+        basename = os.path.basename(path)
+        return basename.startswith('.') or basename.endswith('.tmp') or basename.endswith('~')
+
+    def is_ignored(self, relative_path, is_dir=False):
+        """True for blacklisted (or .gitignore'd) paths, counting the filtered event."""
+        if self.ignore.match(relative_path, is_dir):
+            metrics.inc("events_filtered_total", filter="ignored")
+            return True
+        return False
+
+    def _index_stamp(self):
+        try:
+            st = os.stat(os.path.join(self.git_checker.git_dir, 'index'))
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def check_tracked_gitignores(self):
+        """Reload the rules if the index changed which .gitignore files are tracked."""
+        if self.tracked_gitignores is None:
+            return
+        stamp = self._index_stamp()
+        if stamp == self.index_stamp:
+            return
+        self.index_stamp = stamp
+        tracked = ignore.tracked_gitignores(self.local_base_path)
+        if tracked != self.tracked_gitignores:
+            self.tracked_gitignores = tracked
+            self.reload_ignore()
+
+    def reload_ignore(self):
+        """Recompile the rules after a .gitignore changed."""
+        if self.use_gitignore:
+            self.ignore = ignore.build(self.local_base_path, self.blacklist, self.use_gitignore,
+                                       self.git_checker.git_dir)
+        self.git_checker.reload_gitignore()
+        print("Reloaded ignore rules")
 
-    def process_event(self, event):
+    def process_event(self, event, kind="modified"):
         if self.paused or event.is_directory:
+            metrics.inc("events_filtered_total", filter="paused" if self.paused else "directory")
             return
 
         # Calculate relative path
         relative_path = os.path.relpath(event.src_path, self.local_base_path)
-
-        # Skip temp/swap files
-        basename = os.path.basename(event.src_path)
-        if basename.startswith('.') or basename.endswith('.tmp') or basename.endswith('~'):
+        if self.is_git_internal(relative_path):
+            self.on_git_internal(relative_path)
+            metrics.inc("events_filtered_total", filter="git_internal")
             return
-
-        # Debounce check
-        if not self.should_upload(event.src_path):
+        if os.path.basename(relative_path) == ".gitignore":
+            self.reload_ignore()
+        if self.is_ignored(relative_path):
             return
 
-        # Git-aware filter: only upload if git sees changes for this file
-        if not self.git_checker.is_file_changed(event.src_path):
+        # Let the git status cache know this path needs re-checking
+        self.git_checker.mark_dirty(event.src_path)
+
+        # Skip temp/swap files
+        if self.is_temp_file(event.src_path):
+            metrics.inc("events_filtered_total", filter="temp")
             return
 
-        print(f"Detected change in: {relative_path}")
-        self.uploader.upload_file(event.src_path, relative_path)
+        self.coalescer.add(event.src_path, relative_path, kind)
 
     def on_modified(self, event):
         self.process_event(event)
 
     def on_created(self, event):
-        self.process_event(event)
+        self.process_event(event, "created")
         
+    def on_deleted(self, event):
+        if self.paused:
+            metrics.inc("events_filtered_total", filter="paused")
+            return
+
+        relative_path = os.path.relpath(event.src_path, self.local_base_path)
+        if self.is_git_internal(relative_path):
+            self.on_git_internal(relative_path)
+            metrics.inc("events_filtered_total", filter="git_internal")
+            return
+        if self.is_ignored(relative_path, event.is_directory):
+            return
+
+        if event.is_directory:
+            self.git_checker.mark_tree_dirty()
+            self.coalescer.add(event.src_path, relative_path, "dir_deleted")
+            return
+
+        self.git_checker.mark_dirty(event.src_path)
+        if self.is_temp_file(event.src_path):
+            metrics.inc("events_filtered_total", filter="temp")
+            return
+        self.coalescer.add(event.src_path, relative_path, "deleted")
+
+    def _under_moved_dir(self, src_relative_path, relative_path):
+        """True for the per-child events that follow a directory rename."""
+        now = time.monotonic()
+        for src, (dest, seen) in list(self.moved_dirs.items()):
+            if now - seen > 30:
+                del self.moved_dirs[src]
+            elif src_relative_path.startswith(src + os.sep) and relative_path.startswith(dest + os.sep):
+                return True
+        return False
+
     def on_moved(self, event):
-        if not event.is_directory:
-            relative_path = os.path.relpath(event.dest_path, self.local_base_path)
-            
-            # Skip temp files
-            basename = os.path.basename(event.dest_path)
-            if basename.startswith('.') or basename.endswith('.tmp') or basename.endswith('~'):
-                return
-            
-            if not self.should_upload(event.dest_path):
-                return
+        if self.paused:
+            metrics.inc("events_filtered_total", filter="paused")
+            return
+
+        src_relative_path = os.path.relpath(event.src_path, self.local_base_path)
+        relative_path = os.path.relpath(event.dest_path, self.local_base_path)
+        if self.is_git_internal(relative_path):
+            self.on_git_internal(relative_path)
+            metrics.inc("events_filtered_total", filter="git_internal")
+            return
+        if self._under_moved_dir(src_relative_path, relative_path):
+            metrics.inc("events_filtered_total", filter="moved_with_dir")
+            return
+
+        # Moving into an ignored folder is a delete; moving out of one, a create
+        src_ignored = self.ignore.match(src_relative_path, event.is_directory)
+        if self.is_ignored(relative_path, event.is_directory):
+            if not src_ignored:
+                self.git_checker.mark_tree_dirty()
+                kind = "dir_deleted" if event.is_directory else "deleted"
+                self.coalescer.add(event.src_path, src_relative_path, kind)
+            return
+        if src_ignored:
+            self.git_checker.mark_tree_dirty()
+            self.coalescer.add(event.dest_path, relative_path, "dir_moved" if event.is_directory else "moved")
+            return
+
+        if event.is_directory:
+            # One rename on the server moves the whole tree
+            self.git_checker.mark_tree_dirty()
+            self.moved_dirs[src_relative_path] = (relative_path, time.monotonic())
+            self.coalescer.add(event.dest_path, relative_path, "dir_moved", event.src_path, src_relative_path)
+            return
+
+        self.git_checker.mark_dirty(event.src_path)
+        self.git_checker.mark_dirty(event.dest_path)
+
+        if self.is_temp_file(event.dest_path):
+            # e.g. an editor moving the original aside as a backup; if nothing
+            # takes its place, the file is gone
+            if not self.is_temp_file(event.src_path):
+                self.coalescer.add(event.src_path, src_relative_path, "deleted")
+            return
+
+        if self.is_temp_file(event.src_path):
+            # Atomic save: the temp file was never uploaded, send the result
+            self.coalescer.add(event.dest_path, relative_path, "moved")
+        else:
+            self.coalescer.add(event.dest_path, relative_path, "renamed", event.src_path, src_relative_path)
+
+class SharedObserver:
+    """One watchdog observer (and event thread) for every running profile.
+
+    Watches are counted per path, so two profiles on the same folder can be
+    removed independently.
+    """
+
+    def __init__(self):
+        self.observer = Observer()
+        self.lock = threading.Lock()
+        self.counts = {}  # ObservedWatch -> number of handlers
+
+    def schedule(self, handler, path):
+        with self.lock:
+            if not self.observer.is_alive():
+                self.observer.start()
+            watch = self.observer.schedule(handler, path, recursive=True)
+            self.counts[watch] = self.counts.get(watch, 0) + 1
+            return watch
 
-            # Git-aware filter: only upload if git sees changes for this file
-            if not self.git_checker.is_file_changed(event.dest_path):
+    def unschedule(self, handler, watch):
+        with self.lock:
+            count = self.counts.get(watch, 0) - 1
+            if count > 0:
+                self.counts[watch] = count
+                self.observer.remove_handler_for_watch(handler, watch)
                 return
+            self.counts.pop(watch, None)
+            try:
+                self.observer.unschedule(watch)
+            except KeyError:
+                pass
+
+    def stop(self):
+        with self.lock:
+            if self.observer.is_alive():
+                self.observer.stop()
+                self.observer.join()
+            self.counts.clear()
 
-            print(f"File moved to: {relative_path}")
-            self.uploader.upload_file(event.dest_path, relative_path)
 
 class Monitor:
-    def __init__(self, local_path, uploader, sync_branch=""):
+    def __init__(self, local_path, uploader, sync_branch="", upload_workers=4, bulk_threshold=200, journal=None,
+                 observer=None, budget=None, profile="", blacklist=(), use_gitignore=False, git_index=True,
+                 priority_rules=None, background_min_size=8 * 1024 * 1024):
         self.local_path = local_path
         self.uploader = uploader
-        self.observer = Observer()
-        self.handler = SyncHandler(uploader, local_path, sync_branch)
+        # With a SharedObserver, this monitor only adds and removes its watch
+        self.shared_observer = observer
+        self.observer = None if observer else Observer()
+        self.watch = None
+        self.handler = SyncHandler(uploader, local_path, sync_branch, upload_workers, bulk_threshold, journal,
+                                   budget, profile, blacklist, use_gitignore, git_index, priority_rules,
+                                   background_min_size)
+        self.reconciler = None
 
     def set_paused(self, paused):
         self.handler.paused = paused
         print(f"Monitor paused: {paused}")
 
-    def start(self):
-        self.observer.schedule(self.handler, self.local_path, recursive=True)
-        self.observer.start()
+    def start(self, watch=True):
+        """Start handling changes; with watch=False, only queued and reconciled ones."""
+        self.handler.start()
+        if watch:
+            self.start_watching()
+
+    def start_watching(self):
+        """Start collecting filesystem events.
+
+        May be called before start(): events are held by the coalescer until
+        the handler starts, so watching need not wait for the SSH login.
+        """
+        if self.watch is not None:
+            return
+        if self.shared_observer:
+            self.watch = self.shared_observer.schedule(self.handler, self.local_path)
+        else:
+            self.watch = self.observer.schedule(self.handler, self.local_path, recursive=True)
+            self.observer.start()
         print(f"Monitoring started on {self.local_path}")
 
     def stop(self):
-        self.observer.stop()
-        self.observer.join()
+        if self.watch is not None:
+            if self.shared_observer:
+                self.shared_observer.unschedule(self.handler, self.watch)
+            else:
+                self.observer.stop()
+                self.observer.join()
+            self.watch = None
+        self.handler.stop()
+
+    def wait_idle(self):
+        """Block until the reconciliation pass and all queued uploads are done."""
+        if self.reconciler and self.reconciler.thread:
+            self.reconciler.thread.join()
+        self.handler.upload_pool.join()
+
+    def reconcile(self):
+        """Upload files that changed while we were not monitoring, in the background."""
+        if not self.handler.git_checker.is_git_repo:
+            return
+        handler = self.handler
+        self.reconciler = Reconciler(self.local_path, self.uploader, handler.git_checker, self._submit_reconciled,
+                                     lambda rel: handler.is_temp_file(rel) or handler.ignore.match(rel))
+        self.reconciler.start()
+
+    def _submit_reconciled(self, items):
+        now = time.monotonic()
+        self.handler.enqueue_uploads([PendingEvent(path, rel, "reconcile", now) for path, rel in items])
+
+    def stats(self):
+        return {
+            **self.uploader.stats(),
+            "git_cache": self.handler.git_checker.status_cache.stats(),
+            "git_index": self.handler.git_checker.index.stats() if self.handler.git_checker.index else {},
+            "checkout": self.handler.checkout.stats() if self.handler.checkout else {},
+            "pending_events": len(self.handler.coalescer),
+            "upload_queue": self.handler.upload_pool.qsize(),
+            "upload_scheduler": self.handler.upload_pool.stats(),
+            "retry_journal": self.handler.journal.stats() if self.handler.journal else {},
+            "reconcile": self.reconciler.result if self.reconciler else {}
+        }
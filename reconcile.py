@@ -0,0 +1,161 @@
+"""Startup reconciliation: upload files that became dirty while we were not watching.
+
+git tells us which files are dirty or untracked; the server's copies are
+compared by size and mtime (one listdir_attr per directory) and, where that
+is inconclusive, by a batched sha1sum. Only files that differ are handed to
+the normal upload path.
+"""
+import hashlib
+import os
+import shlex
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import logs
+import remote
+
+# Remote mtimes within this many seconds of the local mtime are inconclusive
+MTIME_SLACK = 2
+
+
+def local_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Reconciler:
+    def __init__(self, local_base_path, uploader, git_checker, submit, is_ignored=None):
+        self.local_base_path = local_base_path
+        self.uploader = uploader
+        self.git_checker = git_checker
+        self.submit = submit  # submit([(local_path, relative_path), ...])
+        self.is_ignored = is_ignored or (lambda relative_path: False)
+        self.thread = None
+        self.result = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=logs.inherit_profile(self._run_safe), name="Reconciler", daemon=True)
+        self.thread.start()
+
+    def _run_safe(self):
+        try:
+            self.run()
+        except Exception as e:
+            print(f"Startup reconciliation failed: {e}")
+
+    def dirty_files(self):
+        """Relative paths ('/' separated) of dirty and untracked files that exist locally."""
+        changed, untracked_dirs = self.git_checker.status_cache.changed_paths()
+        files = {p for p in changed if os.path.isfile(os.path.join(self.local_base_path, p))}
+        for prefix in untracked_dirs:
+            top = os.path.join(self.local_base_path, prefix)
+            for root, dirs, names in os.walk(top):
+                for name in names:
+                    rel = os.path.relpath(os.path.join(root, name), self.local_base_path).replace(os.sep, '/')
+                    files.add(rel)
+        return sorted(p for p in files if not self.is_ignored(p))
+
+    def clock_skew(self, sftp):
+        """Seconds the server clock is ahead of ours, measured with a scratch file."""
+        probe = self.uploader.remote_base_path.rstrip('/') + f'/.wlsync-clock-{uuid.uuid4().hex}'
+        try:
+            before = time.time()
+            with sftp.open(probe, 'wb') as f:
+                f.write(b'')
+            remote_mtime = sftp.stat(probe).st_mtime
+            sftp.remove(probe)
+            return remote_mtime - before
+        except OSError:
+            return 0
+
+    def remote_attrs(self, sftp, rel_paths):
+        """{relative_path: (size, mtime)} for files that exist remotely, one listing per directory."""
+        by_dir = defaultdict(list)
+        for rel in rel_paths:
+            by_dir[os.path.dirname(rel)].append(rel)
+        base = self.uploader.remote_base_path.rstrip('/')
+        attrs = {}
+        for rel_dir, rels in by_dir.items():
+            remote_dir = base + '/' + rel_dir if rel_dir else base
+            try:
+                listing = {a.filename: a for a in sftp.listdir_attr(remote_dir)}
+            except OSError:
+                continue  # Directory does not exist remotely; every file in it differs
+            for rel in rels:
+                a = listing.get(os.path.basename(rel))
+                if a is not None:
+                    attrs[rel] = (a.st_size, a.st_mtime)
+        return attrs
+
+    def remote_sha1(self, rel_paths):
+        """{relative_path: sha1} via one `sha1sum` on the server, or {} if exec is unavailable."""
+        if not rel_paths:
+            return {}
+        base = self.uploader.remote_base_path.rstrip('/')
+        payload = [b'\0'.join(p.encode('utf-8') for p in rel_paths) + b'\0']
+        command = f'cd {shlex.quote(base)} && xargs -0 sha1sum --'
+        try:
+            _, out, _ = remote.run(self.uploader.ssh.get_transport(), command, payload)
+        except Exception as e:
+            print(f"Remote hashing unavailable, re-uploading ambiguous files: {e}")
+            return {}
+        hashes = {}
+        for line in out.decode('utf-8', 'replace').splitlines():
+            digest, _, name = line.partition('  ')
+            if name:
+                hashes[name] = digest
+        return hashes
+
+    def run(self):
+        start = time.time()
+        files = self.dirty_files()
+        if not files:
+            print("Startup reconciliation: no dirty files")
+            self.result = {"checked": 0, "uploaded": 0, "seconds": round(time.time() - start, 2)}
+            return
+
+        print(f"Startup reconciliation: comparing {len(files)} dirty file(s) with the server")
+        sftp = self.uploader.open_channel()
+        try:
+            skew = self.clock_skew(sftp)
+            remote_attrs = self.remote_attrs(sftp, files)
+        finally:
+            sftp.close()
+
+        differ, unclear = [], []
+        for rel in files:
+            try:
+                st = os.stat(os.path.join(self.local_base_path, rel))
+            except OSError:
+                continue
+            attrs = remote_attrs.get(rel)
+            if attrs is None or attrs[0] != st.st_size:
+                differ.append(rel)
+            elif attrs[1] - skew >= st.st_mtime + MTIME_SLACK:
+                continue  # Remote copy was written after the local change
+            else:
+                unclear.append(rel)
+
+        if unclear:
+            hashes = self.remote_sha1(unclear)
+            for rel in unclear:
+                local_hash = local_sha1(os.path.join(self.local_base_path, rel))
+                if hashes.get(rel) != local_hash:
+                    differ.append(rel)
+
+        self.result = {
+            "checked": len(files),
+            "hashed": len(unclear),
+            "uploaded": len(differ),
+            "seconds": round(time.time() - start, 2)
+        }
+        print(f"Startup reconciliation: {len(differ)} of {len(files)} file(s) differ "
+              f"({len(unclear)} hashed, clock skew {skew:+.0f}s)")
+        if differ:
+            self.submit([(os.path.join(self.local_base_path, rel.replace('/', os.sep)), rel.replace('/', os.sep))
+                         for rel in differ])
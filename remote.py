@@ -0,0 +1,37 @@
+"""Helpers for running commands on the server over an SSH exec channel."""
+import paramiko
+
+
+def run(transport, command, payload=None, timeout=60):
+    """Run command on the server; returns (exit_status, stdout bytes, stderr bytes).
+
+    payload, if given, is an iterable of bytes chunks written to stdin.
+    """
+    chan = transport.open_session()
+    try:
+        chan.settimeout(timeout)
+        chan.exec_command(command)
+        if payload is not None:
+            for chunk in payload:
+                chan.sendall(chunk)
+            chan.shutdown_write()
+        stdout = b''.join(iter(lambda: chan.recv(65536), b''))
+        stderr = b''.join(iter(lambda: chan.recv_stderr(65536), b''))
+        return chan.recv_exit_status(), stdout, stderr
+    finally:
+        chan.close()
+
+
+def has_command(transport, name):
+    """True if exec is allowed and name is on the server's PATH.
+
+    None if the server refused the channel (e.g. at MaxSessions), which says
+    nothing about the command; ask again later.
+    """
+    try:
+        status, _, _ = run(transport, f'command -v {name} >/dev/null 2>&1', timeout=15)
+        return status == 0
+    except paramiko.ChannelException:
+        return None
+    except Exception:
+        return False
@@ -0,0 +1,111 @@
+"""Resumable uploads for large files over unreliable links.
+
+Files of at least the profile's `resumable_min_mb` are written to a hidden
+temporary name next to the target (`.<name>.wlsync-part`), CHUNK_SIZE at a
+time. Once every WRITE of a chunk has been acknowledged, the chunk's offset
+and SHA-1 are stored in resume.db. An upload that breaks off (dropped
+Wi-Fi, server restart, app restart) continues from the last confirmed
+chunk instead of from byte zero. Before continuing, the temporary file's
+size is checked and, if the server allows exec, the last confirmed chunk
+is compared by checksum. The finished file is moved over the target with
+one posix-rename, so nobody sees it half-written. Temporary files are
+removed from the server when their file is deleted, changed or uploaded
+another way, and once nobody came back for them within MAX_AGE_SECONDS.
+"""
+import posixpath
+import shlex
+import sqlite3
+import threading
+import time
+
+import remote
+
+RESUME_FILE = "resume.db"
+CHUNK_SIZE = 8 * 1024 * 1024
+TEMP_SUFFIX = ".wlsync-part"
+# Give up on partial uploads nobody came back for after this long
+MAX_AGE_SECONDS = 7 * 24 * 3600
+
+
+def temp_path(remote_path):
+    directory, name = posixpath.split(remote_path)
+    return posixpath.join(directory, "." + name + TEMP_SUFFIX)
+
+
+def remote_sha1(transport, path, offset, length):
+    """SHA-1 of path[offset:offset + length] on the server, or None if exec is unavailable."""
+    command = f"tail -c +{offset + 1} {shlex.quote(path)} | head -c {length} | sha1sum"
+    try:
+        status, out, _ = remote.run(transport, command, timeout=120)
+    except Exception:
+        return None
+    digest = out.decode("ascii", "replace").split(" ", 1)[0].strip()
+    return digest if status == 0 and len(digest) == 40 else None
+
+
+class ResumeState:
+    __slots__ = ("size", "mtime_ns", "chunk_size", "offset", "digests")
+
+    def __init__(self, size, mtime_ns, chunk_size, offset=0, digests=()):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.chunk_size = chunk_size
+        self.offset = offset  # Bytes confirmed on the server
+        self.digests = list(digests)  # SHA-1 per confirmed chunk
+
+    def matches(self, size, mtime_ns, chunk_size):
+        return (self.size, self.mtime_ns, self.chunk_size) == (size, mtime_ns, chunk_size)
+
+
+class ResumeStore:
+    """Confirmed progress of partial uploads per profile and remote path, kept across restarts."""
+
+    def __init__(self, profile, db_path=RESUME_FILE):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS uploads (
+            profile TEXT, remote_path TEXT, size INTEGER, mtime_ns INTEGER, chunk_size INTEGER,
+            confirmed INTEGER, digests TEXT, updated REAL,
+            PRIMARY KEY (profile, remote_path))""")
+
+    def lookup(self, remote_path):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, chunk_size, confirmed, digests FROM uploads "
+                "WHERE profile=? AND remote_path=?", (self.profile, remote_path)).fetchone()
+        if not row:
+            return None
+        size, mtime_ns, chunk_size, confirmed, digests = row
+        return ResumeState(size, mtime_ns, chunk_size, confirmed, digests.split(",") if digests else ())
+
+    def save(self, remote_path, state):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.profile, remote_path, state.size, state.mtime_ns, state.chunk_size, state.offset,
+                 ",".join(state.digests), time.time()))
+
+    def forget(self, remote_path):
+        with self.lock:
+            self.db.execute("DELETE FROM uploads WHERE profile=? AND remote_path=?", (self.profile, remote_path))
+
+    def pending(self):
+        """{remote_path: (confirmed bytes, size)} of partial uploads waiting to be resumed."""
+        with self.lock:
+            rows = self.db.execute("SELECT remote_path, confirmed, size FROM uploads WHERE profile=?",
+                                   (self.profile,)).fetchall()
+        return {path: (confirmed, size) for path, confirmed, size in rows}
+
+    def expired(self):
+        """Remote paths whose partial upload nobody came back for; the caller removes their temporary files."""
+        with self.lock:
+            rows = self.db.execute("SELECT remote_path FROM uploads WHERE profile=? AND updated < ?",
+                                   (self.profile, time.time() - MAX_AGE_SECONDS)).fetchall()
+        return [path for path, in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
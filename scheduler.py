@@ -0,0 +1,299 @@
+"""Upload order and bandwidth for background traffic.
+
+UploadScheduler sits between SyncHandler and the upload workers. Every job
+gets a priority class: "high", "normal" or "low". Path globs from the
+profile's `priority_rules` decide first. Otherwise, files of
+`background_min_mb` and up, and the catch-up pass after connecting, are
+"low" and everything else is "normal". Within a class, smaller files go
+first, and among files of about the same size, the most recently edited.
+Once the longest-waiting job has waited AGING_SECONDS, every AGED_SHARE-th
+pick goes to it whatever its class, so a steady stream of saves cannot hold
+back a large file forever, and a large backlog cannot hold back saves.
+"low" jobs run on at most max_background workers at once, so one worker
+is always left for saves. Jobs for
+the same path still run one at a time, in submission order.
+
+TokenBucket caps the upload rate of "low" jobs and of the catch-up pass's
+bulk tar batches (`background_limit_mbit`, shared by all profiles), so a
+large binary or a catch-up sync cannot saturate the uplink. Saves,
+including "save all" and checkout batches, pass unthrottled.
+"""
+import heapq
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import ignore
+import metrics
+
+CLASSES = ("high", "normal", "low")
+# Classes whose transfers go through the bandwidth limit
+LIMITED_CLASSES = ("low",)
+# Jobs waiting this long get every AGED_SHARE-th pick, oldest first
+AGING_SECONDS = 30
+AGED_SHARE = 4
+# Files are ordered by size in power-of-two steps from this size up
+SIZE_STEP = 64 * 1024
+
+_context = threading.local()
+
+
+def current_class(default=None):
+    """Priority class of the job this thread is working on."""
+    return getattr(_context, "cls", default)
+
+
+@contextmanager
+def class_scope(cls):
+    previous = getattr(_context, "cls", None)
+    _context.cls = cls
+    try:
+        yield
+    finally:
+        _context.cls = previous
+
+
+def size_step(size):
+    return (size // SIZE_STEP).bit_length()
+
+
+class PriorityRules:
+    """Priority class of a path from per-class globs (.gitignore syntax), size and origin."""
+
+    def __init__(self, rules=None, background_min_size=8 * 1024 * 1024):
+        rules = rules or {}
+        unknown = set(rules) - set(CLASSES)
+        if unknown:
+            print(f"Ignoring priority rules for unknown class(es): {', '.join(sorted(unknown))}")
+        self.matchers = [(cls, ignore.IgnoreMatcher([ignore.parse_rule(g) for g in rules[cls]]))
+                         for cls in CLASSES if rules.get(cls)]
+        self.background_min_size = background_min_size
+
+    def classify(self, relative_path, size, background=False):
+        for cls, matcher in self.matchers:
+            if matcher.match(relative_path):
+                return cls
+        if background or (self.background_min_size and size >= self.background_min_size):
+            return "low"
+        return "normal"
+
+    def key(self, relative_path, size, edited, background=False):
+        """(class, sort key); edited is when the file last changed (larger is more recent)."""
+        cls = self.classify(relative_path, size, background)
+        return cls, (CLASSES.index(cls), size_step(size), -edited)
+
+
+class UploadScheduler:
+    """Priority queue of upload jobs with at most one job per key being worked on.
+
+    classify(job) returns (class, sort key) and is called outside the lock
+    (it may stat the file). put() blocks while maxsize jobs are queued.
+    """
+
+    def __init__(self, classify=None, maxsize=1000, max_background=None):
+        self.classify = classify or (lambda job: ("normal", ()))
+        self.maxsize = max(1, int(maxsize))
+        # Workers that may be busy with LIMITED_CLASSES jobs at once; None for no cap
+        self.max_background = max_background
+        self.cond = threading.Condition()
+        self.queued = {}    # key -> deque of jobs, in submission order
+        self.heads = {}     # key -> seq of its first job while it can be picked
+        self.heap = []      # (sort key, seq, key)
+        self.by_age = []    # (enqueued, seq, key)
+        self.active = {}    # key -> class of the job being worked on
+        self.background = 0
+        self.count = 0
+        self.unfinished = 0
+        self.seq = 0
+        self.closed = False
+        self.waits = {cls: {"queued": 0, "served": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                      for cls in CLASSES}
+        self.picks = 0
+        self.aged = 0
+
+    def put(self, key, job):
+        cls, order = self.classify(job)
+        with self.cond:
+            while self.count >= self.maxsize and not self.closed:
+                self.cond.wait()
+            self.seq += 1
+            jobs = self.queued.setdefault(key, deque())
+            jobs.append((self.seq, job, cls, order, time.monotonic()))
+            self.count += 1
+            self.unfinished += 1
+            self.waits[cls]["queued"] += 1
+            if len(jobs) == 1 and key not in self.active:
+                self._offer(key)
+            self.cond.notify_all()
+
+    def _offer(self, key):
+        # Caller holds self.cond
+        seq, _, _, order, enqueued = self.queued[key][0]
+        self.heads[key] = seq
+        heapq.heappush(self.heap, (order, seq, key))
+        heapq.heappush(self.by_age, (enqueued, seq, key))
+
+    def _allowed(self, key):
+        return (self.max_background is None or self.background < self.max_background
+                or self.queued[key][0][2] not in LIMITED_CLASSES)
+
+    def _pop(self, heap):
+        """Key of the first entry in heap that may start now, or None."""
+        skipped = []
+        key = None
+        while heap:
+            entry = heapq.heappop(heap)
+            if self.heads.get(entry[-1]) != entry[-2]:
+                continue  # Already taken through the other heap
+            if self._allowed(entry[-1]):
+                key = entry[-1]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return key
+
+    def _next(self, now):
+        while self.by_age and self.heads.get(self.by_age[0][2]) != self.by_age[0][1]:
+            heapq.heappop(self.by_age)
+        if not self.by_age:
+            return None
+        self.picks += 1
+        oldest = self.by_age[0]
+        if now - oldest[0] >= AGING_SECONDS and self.picks % AGED_SHARE == 0 and self._allowed(oldest[2]):
+            self.aged += 1
+            return self._pop(self.by_age)
+        return self._pop(self.heap)
+
+    def get(self):
+        """(key, job, class) of the next job, or None once closed."""
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                now = time.monotonic()
+                key = self._next(now)
+                if key is not None:
+                    break
+                self.cond.wait()
+            del self.heads[key]
+            jobs = self.queued[key]
+            _, job, cls, _, enqueued = jobs.popleft()
+            if not jobs:
+                del self.queued[key]
+            self.active[key] = cls
+            if cls in LIMITED_CLASSES:
+                self.background += 1
+            self.count -= 1
+            waited = now - enqueued
+            waits = self.waits[cls]
+            waits["queued"] -= 1
+            waits["served"] += 1
+            waits["wait_seconds"] += waited
+            waits["max_wait_seconds"] = max(waits["max_wait_seconds"], waited)
+            self.cond.notify_all()
+        metrics.observe("queue_wait_seconds", waited, priority=cls)
+        return key, job, cls
+
+    def task_done(self, key):
+        with self.cond:
+            if self.active.pop(key, None) in LIMITED_CLASSES:
+                self.background -= 1
+            self.unfinished -= 1
+            if key in self.queued:
+                self._offer(key)
+            self.cond.notify_all()
+
+    def drain(self):
+        """Remove and return every queued job that has not started."""
+        with self.cond:
+            jobs = []
+            for queued in self.queued.values():
+                for _, job, cls, _, _ in queued:
+                    jobs.append(job)
+                    self.waits[cls]["queued"] -= 1
+            self.unfinished -= self.count
+            self.count = 0
+            self.queued.clear()
+            self.heads.clear()
+            self.heap = []
+            self.by_age = []
+            self.cond.notify_all()
+        return jobs
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            while self.unfinished:
+                self.cond.wait()
+
+    def qsize(self):
+        with self.cond:
+            return self.count
+
+    def stats(self):
+        with self.cond:
+            classes = {}
+            for cls, w in self.waits.items():
+                classes[cls] = {
+                    "queued": w["queued"],
+                    "served": w["served"],
+                    "mean_wait_seconds": round(w["wait_seconds"] / w["served"], 3) if w["served"] else 0.0,
+                    "max_wait_seconds": round(w["max_wait_seconds"], 3),
+                }
+            return {"classes": classes, "active": len(self.active), "background_active": self.background,
+                    "aged": self.aged}
+
+
+class TokenBucket:
+    """Bytes-per-second limit shared by every thread that calls consume(); rate 0 means unlimited."""
+
+    # Bytes that may go out at once after an idle spell, as seconds of the rate
+    BURST_SECONDS = 0.25
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.bytes = 0
+        self.waited = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = max(0, int(rate))
+            self.tokens = min(self.tokens, self.rate * self.BURST_SECONDS)
+
+    def set_mbit(self, mbit):
+        self.set_rate((mbit or 0) * 1000 * 1000 / 8)
+
+    def consume(self, n):
+        """Take n bytes, sleeping as long as the rate requires."""
+        with self.lock:
+            self.bytes += n
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate * self.BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Callers go into debt and sleep it off, so they are served in order
+            self.tokens -= n
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            return {"limit_mbit": round(self.rate * 8 / 1000 / 1000, 2), "bytes": self.bytes,
+                    "throttled_seconds": round(self.waited, 2)}
+
+
+# Background upload limit for the whole process, set from background_limit_mbit
+LIMITER = TokenBucket()
@@ -0,0 +1,29 @@
+import os
+
+from checkout import CheckoutTracker
+from coalescer import PendingEvent
+
+
+def make_git_dir(tmp_path, commit):
+    git_dir = tmp_path / ".git"
+    (git_dir / "refs" / "heads").mkdir(parents=True)
+    (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+    (git_dir / "refs" / "heads" / "main").write_text(commit + "\n")
+    return str(git_dir)
+
+
+def test_held_changes_are_released_when_on_settled_fails(tmp_path):
+    git_dir = make_git_dir(tmp_path, "a" * 40)
+    released = []
+
+    def on_settled(old, new, held, since):
+        raise RuntimeError("git diff failed")
+
+    tracker = CheckoutTracker(git_dir, git_dir, on_settled, released.extend)
+    (tmp_path / ".git" / "refs" / "heads" / "main").write_text("b" * 40 + "\n")
+    entry = PendingEvent(os.path.join(str(tmp_path), "a.py"), "a.py", "modified", 0.0)
+    assert tracker.hold([entry])
+    tracker.last_activity = 0.0  # Quiet for long enough
+    tracker._poll()
+    assert released == [entry]
+    assert tracker.head == "b" * 40 and not tracker.active
@@ -0,0 +1,91 @@
+import os
+import threading
+
+from coalescer import EventCoalescer, PendingEvent
+
+BASE = os.path.join(os.sep, "work")
+
+
+def local(*parts):
+    return os.path.join(BASE, *parts)
+
+
+def collect(coalescer_kwargs=None):
+    flushed = []
+    ready = threading.Event()
+
+    def on_flush(entries):
+        flushed.extend(entries)
+        ready.set()
+
+    coalescer = EventCoalescer(on_flush, quiet_seconds=0.05, **(coalescer_kwargs or {}))
+    return coalescer, flushed, ready
+
+
+def test_edit_then_rename_parent_dir_moves_the_pending_edit():
+    coalescer, flushed, ready = collect()
+    old_file, new_file = os.path.join("pkg", "mod.py"), os.path.join("lib", "mod.py")
+    coalescer.add(local(old_file), old_file, "modified")
+    coalescer.add(local("lib"), "lib", "dir_moved", local("pkg"), "pkg")
+    coalescer.start()
+    try:
+        assert ready.wait(2)
+        # Only the directory move is handed on; the edit waits for it
+        assert [e.kind for e in flushed] == ["dir_moved"]
+        moved = flushed[0]
+        assert [(c.path, c.relative_path, c.kind) for c in moved.children] == [
+            (local(new_file), new_file, "modified")]
+
+        # Once the directory is moved on the server, the edit goes to the new path
+        flushed.clear()
+        ready.clear()
+        coalescer.requeue(moved.children)
+        assert ready.wait(2)
+        assert [(e.path, e.relative_path, e.kind) for e in flushed] == [(local(new_file), new_file, "modified")]
+    finally:
+        coalescer.stop()
+
+
+def test_rename_inside_moved_dir_keeps_its_source_under_the_new_path():
+    coalescer, _, _ = collect()
+    coalescer.add(local("pkg", "b.py"), os.path.join("pkg", "b.py"), "renamed", local("pkg", "a.py"),
+                  os.path.join("pkg", "a.py"))
+    coalescer.add(local("lib"), "lib", "dir_moved", local("pkg"), "pkg")
+    coalescer.add(local("src"), "src", "dir_moved", local("lib"), "lib")
+    (moved,) = coalescer.stop()
+    assert (moved.src_relative_path, moved.relative_path) == ("pkg", "src")
+    (child,) = moved.children
+    assert (child.src_relative_path, child.relative_path) == (os.path.join("src", "a.py"), os.path.join("src", "b.py"))
+    assert child.src_path == local("src", "a.py")
+
+
+def test_requeue_keeps_a_newer_pending_entry():
+    coalescer, _, _ = collect()
+    child = PendingEvent(local("lib", "b.py"), os.path.join("lib", "b.py"), "renamed", 0.0,
+                         local("lib", "a.py"), os.path.join("lib", "a.py"), edited=False)
+    coalescer.add(local("lib", "b.py"), os.path.join("lib", "b.py"), "modified")
+    coalescer.requeue([child])
+    (entry,) = coalescer.stop()
+    # The newer edit is kept, and the server copy is still renamed first
+    assert entry.kind == "renamed" and entry.src_relative_path == os.path.join("lib", "a.py") and entry.edited
+
+
+def test_entries_of_a_failed_dispatch_go_to_on_failed():
+    failed = []
+    done = threading.Event()
+
+    def on_flush(entries):
+        raise OSError("queue closed")
+
+    def on_failed(entry, attempted):
+        failed.append((entry.relative_path, attempted))
+        done.set()
+
+    coalescer = EventCoalescer(on_flush, quiet_seconds=0.05, on_failed=on_failed)
+    coalescer.add(local("a.py"), "a.py")
+    coalescer.start()
+    try:
+        assert done.wait(2)
+    finally:
+        coalescer.stop()
+    assert failed == [("a.py", True)]
@@ -0,0 +1,39 @@
+import os
+import random
+
+import delta
+
+BLOCK = 1024
+
+
+def apply(ops, remote, block_size):
+    out = bytearray()
+    for kind, value in ops:
+        out += remote[value * block_size:(value + 1) * block_size] if kind == "copy" else value
+    return bytes(out)
+
+
+def test_small_edit_is_sent_as_a_delta():
+    remote = os.urandom(64 * BLOCK)
+    data = remote[:10 * BLOCK] + b"edit" + remote[10 * BLOCK:]
+    ops = delta.compute_delta(data, delta.signature(remote, BLOCK), BLOCK)
+    assert ops is not None and apply(ops, remote, BLOCK) == data
+    assert sum(len(v) for k, v in ops if k == "data") < 2 * BLOCK
+
+
+def test_rewritten_file_is_refused_before_scanning():
+    # More new bytes than remote blocks could ever cover: no scan at all
+    remote = os.urandom(8 * BLOCK)
+    data = os.urandom(64 * BLOCK)
+    assert delta.compute_delta(data, delta.signature(remote, BLOCK), BLOCK) is None
+
+
+def test_scan_stops_after_max_literal_run():
+    # Same size as the remote, so only the run limit can end the scan early
+    remote = os.urandom(64 * BLOCK)
+    data = remote[:8 * BLOCK] + random.Random(1).randbytes(56 * BLOCK)
+    sig = delta.signature(remote, BLOCK)
+    assert delta.compute_delta(data, sig, BLOCK, max_literal_ratio=1.0, max_literal_run=4 * BLOCK) is None
+    # Without the limit the same file still produces a (mostly literal) delta
+    ops = delta.compute_delta(data, sig, BLOCK, max_literal_ratio=1.0, max_literal_run=len(data))
+    assert ops is not None and apply(ops, remote, BLOCK) == data
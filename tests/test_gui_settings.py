@@ -0,0 +1,64 @@
+import queue
+
+from gui_settings import DISCOVER_MAX_MS, DISCOVER_MIN_MS, SettingsDialog
+
+
+class FakeRoot:
+    def __init__(self):
+        self.timers = []
+
+    def after(self, ms, callback):
+        self.timers.append((ms, callback))
+
+    def run_next(self):
+        ms, callback = self.timers.pop(0)
+        callback()
+        return ms
+
+
+def dialog(ipc_address=None, service=lambda: False):
+    # Only the discovery state; building the widgets needs a display
+    d = SettingsDialog.__new__(SettingsDialog)
+    d.root = FakeRoot()
+    d.ipc_address = ipc_address
+    d.ipc_client = None
+    d.discover_delay = DISCOVER_MIN_MS
+    d.discover_pending = False
+    d.connect_ipc = service
+    return d
+
+
+def test_discovery_backs_off_while_there_is_no_service():
+    d = dialog()
+    d.schedule_discovery()
+    d.schedule_discovery()  # Already pending: no second timer
+    assert len(d.root.timers) == 1
+    delays = [d.root.run_next() for _ in range(4)]
+    assert delays == [DISCOVER_MIN_MS, 2 * DISCOVER_MIN_MS, DISCOVER_MAX_MS, DISCOVER_MAX_MS]
+    assert delays[0] >= 2000  # Never anywhere near the 100 ms event pump
+
+
+def test_discovery_stops_once_connected_and_resets_the_delay():
+    attempts = []
+    d = dialog(service=lambda: attempts.append(1) or len(attempts) == 3)
+    d.schedule_discovery()
+    while d.root.timers:
+        d.root.run_next()
+    assert len(attempts) == 3
+    assert d.discover_delay == DISCOVER_MIN_MS and not d.discover_pending
+
+
+def test_embedded_gui_does_not_poll():
+    d = dialog(ipc_address=("127.0.0.1", 1))
+    d.schedule_discovery()
+    assert d.root.timers == []
+
+
+def test_event_pump_does_not_look_for_the_service():
+    attempts = []
+    d = dialog(service=lambda: attempts.append(1) or False)
+    d.events = queue.Queue()
+    for _ in range(10):
+        d.process_events()
+    assert attempts == []
+    assert [ms for ms, _ in d.root.timers] == [100] * 10
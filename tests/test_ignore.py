@@ -0,0 +1,33 @@
+import os
+import subprocess
+
+import ignore
+
+
+def git(repo, *args):
+    subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+
+def write(repo, relative_path, text=""):
+    path = os.path.join(repo, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_untracked_nested_gitignore_applies(tmp_path):
+    repo = str(tmp_path)
+    git(repo, "init", "-q")
+    write(repo, "pkg/.gitignore", "*.log\n")
+    matcher = ignore.build(repo, use_gitignore=True, git_dir=os.path.join(repo, ".git"))
+    assert matcher.match("pkg/build.log")
+    assert not matcher.match("build.log")
+
+
+def test_tracked_gitignores_follow_the_index(tmp_path):
+    repo = str(tmp_path)
+    git(repo, "init", "-q")
+    write(repo, "pkg/.gitignore", "*.log\n")
+    assert ignore.tracked_gitignores(repo) == frozenset()
+    git(repo, "add", "pkg/.gitignore")
+    assert ignore.tracked_gitignores(repo) == frozenset({"pkg/.gitignore"})
@@ -0,0 +1,107 @@
+"""Streaming SFTP write path tuned for large files.
+
+paramiko's SFTPClient.put reads the source in 32 KB pieces through a
+buffered file object and caps in-flight writes at an internal limit. Here the
+source is memory-mapped and WRITE requests are issued directly, keeping up to
+max_outstanding of them in flight before waiting for the oldest reply.
+"""
+import mmap
+import os
+import time
+from collections import deque
+
+import paramiko
+from paramiko.sftp import CMD_STATUS, CMD_WRITE, SFTPError, int64
+
+# Payload per WRITE request. 32 KB is what every server accepts; OpenSSH
+# takes up to 255 KB.
+DEFAULT_CHUNK_SIZE = 32 * 1024
+DEFAULT_MAX_OUTSTANDING = 64
+
+# Channel tuning. The window/packet sizes we advertise govern how fast the
+# server may send to us (write acknowledgements, signatures). paramiko's rekey
+# limits are left alone: pooled connections live for hours and must rekey.
+WINDOW_SIZE = 16 * 1024 * 1024
+MAX_PACKET_SIZE = 32 * 1024
+
+
+def tune_transport(transport):
+    """Apply throughput-oriented settings to a freshly connected transport."""
+    transport.default_window_size = WINDOW_SIZE
+    transport.default_max_packet_size = MAX_PACKET_SIZE
+
+
+def open_sftp(transport):
+    """Open an SFTP channel using the tuned window and packet sizes."""
+    return paramiko.SFTPClient.from_transport(transport, window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE)
+
+
+def _wait_write(sftp, num):
+    t, msg = sftp._read_response(num)
+    if t != CMD_STATUS:
+        raise SFTPError("Expected status")
+
+
+def write_data(sftp, data, remote_path, chunk_size=DEFAULT_CHUNK_SIZE,
+               max_outstanding=DEFAULT_MAX_OUTSTANDING, on_chunk=None):
+    """Write a bytes-like object to remote_path with pipelined WRITE requests.
+
+    on_chunk(n), if given, is called before each chunk is sent (e.g. for
+    rate limiting or progress).
+    """
+    size = len(data)
+    with sftp.open(remote_path, 'wb') as rf:
+        write_range(sftp, rf, data, 0, size, chunk_size, max_outstanding, on_chunk)
+    return size
+
+
+def write_range(sftp, rf, data, start, end, chunk_size=DEFAULT_CHUNK_SIZE,
+                max_outstanding=DEFAULT_MAX_OUTSTANDING, on_chunk=None):
+    """Write data[start:end] at the same offsets of the open remote file rf.
+
+    Returns once every WRITE has been acknowledged, so the range is known
+    to be on the server.
+    """
+    pending = deque()
+    offset = start
+    try:
+        while offset < end:
+            chunk = data[offset:min(offset + chunk_size, end)]
+            if on_chunk:
+                on_chunk(len(chunk))
+            pending.append(sftp._async_request(type(None), CMD_WRITE, rf.handle, int64(offset), chunk))
+            offset += len(chunk)
+            if len(pending) >= max_outstanding:
+                _wait_write(sftp, pending.popleft())
+    finally:
+        # Always collect replies so later requests on this channel stay in sync
+        error = None
+        while pending:
+            try:
+                _wait_write(sftp, pending.popleft())
+            except Exception as e:
+                error = error or e
+    if error:
+        raise error
+    return end - start
+
+
+def write_file(sftp, local_path, remote_path, chunk_size=DEFAULT_CHUNK_SIZE,
+               max_outstanding=DEFAULT_MAX_OUTSTANDING, on_chunk=None):
+    """Upload local_path to remote_path. Returns (bytes_written, seconds)."""
+    start = time.perf_counter()
+    with open(local_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            # mmap cannot map empty files
+            written = write_data(sftp, b'', remote_path)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                written = write_data(sftp, data, remote_path, chunk_size, max_outstanding, on_chunk)
+    return written, time.perf_counter() - start
+
+
+def format_rate(nbytes, seconds):
+    mb = nbytes / (1024 * 1024)
+    rate = mb / seconds if seconds > 0 else 0.0
+    return f"{mb:.2f} MB in {seconds:.2f}s, {rate:.2f} MB/s"
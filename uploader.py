@@ -1,76 +1,965 @@
 import paramiko
+import hashlib
+import mmap
 import os
 import stat
+import threading
+import time
+from collections import deque
+
+import bulk
+import compression
+import delta
+import logs
+import metrics
+import resumable
+import scheduler
+import transfer
+
+# Channels open at once outside the upload workers: a bulk batch or probe on
+# the coalescer and checkout threads, and the reconciler's SFTP and exec channels
+EXTRA_CHANNELS = 4
+
 
 class Uploader:
-    def __init__(self, host, port, username, remote_base_path):
+    # Below this size a delta round trip costs more than just sending the file
+    DELTA_MIN_SIZE = 64 * 1024
+    # Reconnects within one resumable upload before it is left to the retry journal
+    RESUME_ATTEMPTS = 3
+    RESUME_BACKOFF_SECONDS = 2
+
+    @staticmethod
+    def channels_needed(workers):
+        """Channels open at once at most: the main SFTP channel, an SFTP and an
+        exec channel (delta, gzip) per upload worker, and EXTRA_CHANNELS."""
+        return 1 + 2 * workers + EXTRA_CHANNELS
+
+    def __init__(self, host, port, username, remote_base_path, delta_transfer=True,
+                 max_outstanding_writes=transfer.DEFAULT_MAX_OUTSTANDING, key_filename=None, bulk_compress=True,
+                 manifest=None, compression_mode="auto", pool=None, resume_store=None,
+                 resumable_min_size=32 * 1024 * 1024, limiter=None, channels=1 + EXTRA_CHANNELS):
         self.host = host
         self.port = port
         self.username = username
         self.remote_base_path = remote_base_path
+        self.key_filename = key_filename
+        self.max_outstanding_writes = max_outstanding_writes
+        self.bulk_compress = bulk_compress
+        # Optional UploadManifest used to skip uploads of unchanged content
+        self.manifest = manifest
+        # "auto": decide per file/batch; "ssh": zlib on the whole SSH connection; "off"
+        self.compression_mode = compression_mode
+        self.advisor = compression.CompressionAdvisor() if compression_mode == "auto" else None
+        self.gzip_available = None
+        # Optional connpool.ConnectionPool: share one SSH login with other
+        # uploaders for the same server instead of opening our own
+        self.pool = pool
+        self.lease = None
+        # Most channels open at once (see channels_needed), so the pool can
+        # keep a shared connection under the server's MaxSessions
+        self.channels = channels
+        # Optional resumable.ResumeStore: files of resumable_min_size and up are
+        # sent in confirmed chunks and continue where a broken upload stopped
+        self.resume_store = resume_store
+        self.resumable_min_size = resumable_min_size
+        self.resumable_stats = {"uploads": 0, "resumed": 0, "bytes_not_resent": 0}
+        self.resumable_progress = {}
+        # Optional scheduler.TokenBucket for low-priority jobs and bulk batches
+        self.limiter = limiter
         self.ssh = None
         self.sftp = None
+        self.delta_transfer = delta_transfer
+        self.delta_available = None  # Probed lazily once per connection
+        self.tar_available = None
+        self.stats_lock = threading.Lock()
+        self.delta_stats = {"files": 0, "bytes_total": 0, "bytes_sent": 0}
+        self.transfer_stats = {"files": 0, "bytes": 0, "seconds": 0.0, "last_mbps": 0.0}
+        self.bulk_stats = {"batches": 0, "files": 0, "failed": 0, "bytes": 0}
+        self.op_stats = {"renamed": 0, "removed": 0, "removed_dirs": 0, "rename_failed": 0}
+        # Remote directories known to exist on the current connection
+        self.dirs_lock = threading.Lock()
+        self.known_dirs = set()
+        self.dir_cache_hits = 0
+        self.dir_cache_misses = 0
+        # Bumped on every (re)connect so workers can tell their channel is stale
+        self.generation = 0
+        self.connect_lock = threading.Lock()
 
     def connect(self):
+        with self.connect_lock:
+            return self._connect()
+
+    def _connect(self):
+        stale = self.ssh
+        self._close()
         try:
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            # allow_agent=True should pick up Pageant on Windows automatically
-            self.ssh.connect(self.host, port=self.port, username=self.username, allow_agent=True, look_for_keys=True)
-            self.sftp = self.ssh.open_sftp()
+            if self.pool:
+                if self.lease is None:
+                    self.lease = self.pool.lease(self.host, self.port, self.username, self.key_filename,
+                                                 self.compression_mode == "ssh", self.channels)
+                self.ssh = self.lease.client(stale)
+            else:
+                self.ssh = paramiko.SSHClient()
+                self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                # allow_agent=True should pick up Pageant on Windows automatically
+                self.ssh.connect(self.host, port=self.port, username=self.username, allow_agent=True,
+                                 look_for_keys=True, key_filename=self.key_filename,
+                                 compress=self.compression_mode == "ssh")
+                transfer.tune_transport(self.ssh.get_transport())
+            self.sftp = transfer.open_sftp(self.ssh.get_transport())
+            self.delta_available = None
+            self.tar_available = None
+            self.gzip_available = None
+            with self.dirs_lock:
+                self.known_dirs = set()
+            self.prefill_remote_dirs()
+            if self.resume_store:
+                for remote_file_path in self.resume_store.expired():
+                    self.discard_partial(remote_file_path, self.sftp)
+            self.generation += 1
             print(f"Connected to {self.host}")
             return True
         except Exception as e:
             print(f"Connection failed: {e}")
             return False
 
-    def ensure_remote_dir(self, remote_path):
-        """Recursively create remote directories if they don't exist."""
-        dirs = []
+    def reconnect(self, seen_generation):
+        """Reconnect unless another worker already did since seen_generation."""
+        with self.connect_lock:
+            if self.generation != seen_generation and self.is_connected():
+                return True
+            return self._connect()
+
+    def is_connected(self):
+        transport = self.ssh.get_transport() if self.ssh else None
+        return transport is not None and transport.is_active()
+
+    def open_channel(self):
+        """Open an additional SFTP channel on the shared SSH transport."""
+        transport = self.ssh.get_transport() if self.ssh else None
+        if transport is None or not transport.is_active():
+            raise paramiko.SSHException("SSH transport is not connected")
+        return transfer.open_sftp(transport)
+
+    def prefill_remote_dirs(self, sftp=None):
+        """Seed the directory cache with the remote base path and its subdirectories."""
+        sftp = sftp or self.sftp
+        base = self.remote_base_path.rstrip('/') or '/'
+        try:
+            entries = sftp.listdir_attr(base)
+        except OSError:
+            return
+        with self.dirs_lock:
+            self._mark_known(base)
+            for attr in entries:
+                if stat.S_ISDIR(attr.st_mode or 0):
+                    self.known_dirs.add(base.rstrip('/') + '/' + attr.filename)
+
+    def _mark_known(self, path):
+        # Caller holds dirs_lock. A directory existing implies its parents do.
+        while path and path not in self.known_dirs:
+            self.known_dirs.add(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    def forget_remote_dir(self, remote_path, ancestors=True):
+        """Drop remote_path, its subdirectories and its ancestors from the cache.
+
+        Used when the server reports a cached directory missing; we cannot
+        tell which level was removed, so the whole chain is re-checked. When
+        we removed or renamed the directory ourselves, ancestors=False keeps
+        its parents cached.
+        """
+        prefix = remote_path.rstrip('/') + '/'
+        if not ancestors:
+            with self.dirs_lock:
+                self.known_dirs = {d for d in self.known_dirs if d != remote_path and not d.startswith(prefix)}
+            return
+        ancestors = set()
         path = remote_path
         while True:
-            try:
-                self.sftp.stat(path)
+            ancestors.add(path)
+            parent = os.path.dirname(path)
+            if parent == path:
                 break
-            except FileNotFoundError:
-                dirs.append(path)
-                path = os.path.dirname(path)
-        
-        while dirs:
-            dir_to_create = dirs.pop()
+            path = parent
+        with self.dirs_lock:
+            self.known_dirs = {d for d in self.known_dirs if d not in ancestors and not d.startswith(prefix)}
+
+    def _mkdirs_pipelined(self, sftp, dirs):
+        """Create dirs (parents first) with all MKDIR requests in flight at once.
+
+        SFTP servers answer requests in order, so a parent is created before
+        its child is processed. Uses paramiko's request API directly since
+        SFTPClient.mkdir waits for each reply.
+        """
+        attr = paramiko.SFTPAttributes()
+        attr.st_mode = 0o777
+        requests = [(d, sftp._async_request(type(None), paramiko.sftp.CMD_MKDIR, d, attr)) for d in dirs]
+        for d, num in requests:
             try:
-                self.sftp.mkdir(dir_to_create)
-                print(f"Created remote dir: {dir_to_create}")
+                sftp._read_response(num)
+                print(f"Created remote dir: {d}")
             except OSError:
-                pass # Already exists
+                pass # Already exists (possibly created by another worker)
+
+    def ensure_remote_dir(self, remote_path, sftp=None):
+        """Recursively create remote directories if they don't exist.
+
+        Directories known to exist on this connection are cached, so the
+        common case of uploading into a familiar directory costs no round trip.
+        """
+        with metrics.timer("stage_seconds", stage="ensure_remote_dir"):
+            self._ensure_remote_dir(remote_path, sftp or self.sftp)
 
-    def upload_file(self, local_path, relative_path):
-        if not self.sftp:
-            if not self.connect():
+    def _ensure_remote_dir(self, remote_path, sftp):
+        with self.dirs_lock:
+            if remote_path in self.known_dirs:
+                self.dir_cache_hits += 1
                 return
-        
+            self.dir_cache_misses += 1
+            known = set(self.known_dirs)
+
+        dirs = []
+        path = remote_path
+        while path not in known:
+            try:
+                sftp.stat(path)
+                break
+            except FileNotFoundError:
+                dirs.append(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+        if dirs:
+            dirs.reverse()
+            self._mkdirs_pipelined(sftp, dirs)
+            # Make sure the target really exists now, e.g. no permission error
+            sftp.stat(remote_path)
+
+        with self.dirs_lock:
+            self._mark_known(remote_path)
+
+    def upload_file(self, local_path, relative_path, sftp=None, force=False):
+        """Upload one file. force=True bypasses the unchanged-content check.
+
+        Returns False if the upload failed and should be retried.
+        """
+        if sftp is None:
+            if not self.sftp:
+                if not self.connect():
+                    return False
+            sftp = self.sftp
+        generation = self.generation
+
         remote_file_path = self.remote_base_path.rstrip('/') + '/' + relative_path.replace('\\', '/')
         remote_dir = os.path.dirname(remote_file_path)
 
         try:
-            self.ensure_remote_dir(remote_dir)
-            
             # Normalize paths for Windows/Linux strings
             local_path = os.path.abspath(local_path)
-            
-            print(f"Uploading {local_path} to {remote_file_path}")
-            self.sftp.put(local_path, remote_file_path)
-            print("Upload successful")
-            
+
+            with open(local_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                entry = self.manifest.lookup(relative_path) if self.manifest and not force else None
+                if entry and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                    self._skip_unchanged(relative_path, st.st_size)
+                    return True
+
+                # The mapped file is hashed and sent from the same pages, so it
+                # is only read from disk once.
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+                try:
+                    digest = hashlib.sha1(data).hexdigest() if self.manifest else None
+                    if entry and entry.size == st.st_size and entry.sha1 == digest:
+                        self.manifest.record(relative_path, st.st_size, st.st_mtime_ns, digest)
+                        self._skip_unchanged(relative_path, st.st_size)
+                        return True
+
+                    self.ensure_remote_dir(remote_dir, sftp)
+                    if self.resume_store and not self.is_resumable(st.st_size):
+                        # Shrunk below resumable_min_mb since a partial upload
+                        self.discard_partial(remote_file_path, sftp)
+                    with metrics.timer("stage_seconds", stage="write"):
+                        if self.is_resumable(st.st_size):
+                            # A delta would start over after every break; a partial upload continues
+                            if (self.resume_store.lookup(remote_file_path) is not None
+                                    or not self.try_delta_upload(data, remote_file_path)):
+                                self.upload_resumable(data, local_path, relative_path, remote_file_path, st, sftp)
+                        elif (not self.try_delta_upload(data, remote_file_path)
+                                and not self.try_compressed_upload(data, local_path, remote_file_path)):
+                            print(f"Uploading {local_path} to {remote_file_path}")
+                            try:
+                                self.write_data(sftp, data, remote_file_path)
+                            except FileNotFoundError:
+                                # The cached directory was removed on the server; recreate it
+                                self.forget_remote_dir(remote_dir)
+                                self.ensure_remote_dir(remote_dir, sftp)
+                                self.write_data(sftp, data, remote_file_path)
+                finally:
+                    if st.st_size:
+                        data.close()
+
+            if self.manifest:
+                self.manifest.record(relative_path, st.st_size, st.st_mtime_ns, digest)
+
         except Exception as e:
             print(f"Failed to upload {local_path}: {e}")
-            # Try reconnecting once
-            if self.connect():
-                 # Retry upload logic (simplified for now)
-                 pass
+            metrics.inc("errors_total", stage="upload")
+            if not os.path.isfile(local_path):
+                return True  # Deleted meanwhile; its delete event takes over
+            # Reconnect once; the caller journals the file for a later retry
+            self.reconnect(generation)
+            return False
+        return True
 
-    def close(self):
+    def remote_path(self, relative_path):
+        return self.remote_base_path.rstrip('/') + '/' + relative_path.replace('\\', '/').strip('/')
+
+    def was_uploaded(self, relative_path):
+        """True if the manifest says we put relative_path on the server."""
+        return self.manifest is not None and self.manifest.lookup(relative_path) is not None
+
+    def rename_remote(self, src_relative_path, dest_relative_path, sftp=None, is_dir=False):
+        """Rename a file or directory on the server instead of uploading it again.
+
+        Returns False if the source does not exist remotely or the server
+        refused; the caller then falls back to uploading.
+        """
+        sftp = sftp or self.sftp
+        generation = self.generation
+        src = self.remote_path(src_relative_path)
+        dest = self.remote_path(dest_relative_path)
+        try:
+            self.ensure_remote_dir(os.path.dirname(dest), sftp)
+            try:
+                # posix-rename@openssh.com replaces an existing target atomically
+                sftp.posix_rename(src, dest)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # Server without the extension: plain SFTP rename refuses to
+                # overwrite, so clear a file target first.
+                if not is_dir:
+                    try:
+                        sftp.remove(dest)
+                    except OSError:
+                        pass
+                sftp.rename(src, dest)
+        except FileNotFoundError:
+            with self.stats_lock:
+                self.op_stats["rename_failed"] += 1
+            return False
+        except Exception as e:
+            print(f"Failed to rename {src} to {dest}: {e}")
+            metrics.inc("errors_total", stage="rename")
+            with self.stats_lock:
+                self.op_stats["rename_failed"] += 1
+            if not self.is_connected():
+                self.reconnect(generation)
+            return False
+
+        print(f"Renamed remote {'dir' if is_dir else 'file'}: {src} -> {dest}")
+        if is_dir:
+            self.forget_remote_dir(src, ancestors=False)
+            with self.dirs_lock:
+                self._mark_known(dest)
+        if self.manifest:
+            self.manifest.rename(src_relative_path, dest_relative_path)
+        with self.stats_lock:
+            self.op_stats["renamed"] += 1
+        return True
+
+    def remove_remote(self, relative_path, sftp=None):
+        """Delete one file on the server."""
+        sftp = sftp or self.sftp
+        generation = self.generation
+        remote_file_path = self.remote_path(relative_path)
+        removed = 0
+        try:
+            self.discard_partial(remote_file_path, sftp)
+            sftp.remove(remote_file_path)
+            print(f"Removed remote file: {remote_file_path}")
+            removed = 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Failed to remove {remote_file_path}: {e}")
+            metrics.inc("errors_total", stage="remove")
+            if not self.is_connected():
+                self.reconnect(generation)
+            return False
+        if self.manifest:
+            self.manifest.forget(relative_path)
+        with self.stats_lock:
+            self.op_stats["removed"] += removed
+        return True
+
+    def remove_remote_dir(self, relative_path, file_paths, sftp=None):
+        """Delete a directory's files we know about, then the directories left empty.
+
+        Files on the server that we never synced keep their directories
+        alive. All REMOVE/RMDIR requests are pipelined, deepest first.
+        """
+        sftp = sftp or self.sftp
+        generation = self.generation
+        base = self.remote_path(relative_path)
+        files = [self.remote_path(p) for p in file_paths]
+        partials = [p for p in self.resume_store.pending() if p.startswith(base + '/')] if self.resume_store else []
+        # Temporary files of partial uploads would keep their directories alive
+        files += [resumable.temp_path(p) for p in partials]
+        dirs = {base}
+        for f in files:
+            d = os.path.dirname(f)
+            while d.startswith(base + '/') and d not in dirs:
+                dirs.add(d)
+                d = os.path.dirname(d)
+        dirs = sorted(dirs, key=lambda d: d.count('/'), reverse=True)
+        try:
+            requests = [(False, sftp._async_request(type(None), paramiko.sftp.CMD_REMOVE, f)) for f in files]
+            requests += [(True, sftp._async_request(type(None), paramiko.sftp.CMD_RMDIR, d)) for d in dirs]
+            removed = kept = 0
+            for is_dir, num in requests:
+                try:
+                    sftp._read_response(num)
+                    removed += not is_dir
+                except OSError:
+                    kept += is_dir  # Already gone, or a directory holding files we do not own
+        except Exception as e:
+            print(f"Failed to remove {base}: {e}")
+            metrics.inc("errors_total", stage="remove")
+            if not self.is_connected():
+                self.reconnect(generation)
+            return False
+
+        print(f"Removed remote dir: {base} ({removed} file(s), {kept} dir(s) left in place)")
+        self.forget_remote_dir(base, ancestors=False)
+        for remote_file_path in partials:
+            self.resume_store.forget(remote_file_path)
+        if self.manifest:
+            self.manifest.forget_tree(relative_path)
+        with self.stats_lock:
+            self.op_stats["removed"] += removed
+            self.op_stats["removed_dirs"] += len(dirs) - kept
+        return True
+
+    def _unchanged_by_metadata(self, local_path, relative_path):
+        """True (and counted as skipped) if size and mtime match the last upload."""
+        entry = self.manifest.lookup(relative_path)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            return False
+        if entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+            self._skip_unchanged(relative_path, st.st_size)
+            return True
+        return False
+
+    def _skip_unchanged(self, relative_path, size):
+        self.manifest.note_skipped(size)
+        metrics.inc("events_filtered_total", filter="unchanged")
+        print(f"Skipping {relative_path}: content unchanged since last upload")
+
+    def write_data(self, sftp, data, remote_file_path):
+        """Stream file contents with pipelined writes and record the achieved rate."""
+        start = time.perf_counter()
+        written = transfer.write_data(sftp, data, remote_file_path, max_outstanding=self.max_outstanding_writes,
+                                      on_chunk=self.throttle)
+        seconds = time.perf_counter() - start
+        if self.advisor:
+            self.advisor.observe_link(written, seconds)
+        metrics.inc("bytes_sent_total", written, method="sftp")
+        with self.stats_lock:
+            self.transfer_stats["files"] += 1
+            self.transfer_stats["bytes"] += written
+            self.transfer_stats["seconds"] += seconds
+            if seconds > 0:
+                self.transfer_stats["last_mbps"] = round(written / seconds / (1024 * 1024), 2)
+        print(f"Upload successful ({transfer.format_rate(written, seconds)})")
+
+    def throttle(self, n, background=False):
+        """Wait for the bandwidth limit before sending n bytes of a low-priority job or bulk batch."""
+        if self.limiter and (background or scheduler.current_class() in scheduler.LIMITED_CLASSES):
+            self.limiter.consume(n)
+
+    def is_resumable(self, size):
+        return self.resume_store is not None and 0 < self.resumable_min_size <= size
+
+    def upload_resumable(self, data, local_path, relative_path, remote_file_path, st, sftp):
+        """Send a large file in confirmed chunks to a temporary name, then rename it into place.
+
+        A broken connection is re-established up to RESUME_ATTEMPTS times,
+        continuing from the last confirmed chunk; after that the exception
+        goes to the caller and the retry journal resumes it later.
+        """
+        tmp = resumable.temp_path(remote_file_path)
+        state = self.resume_store.lookup(remote_file_path)
+        if state is None or not state.matches(st.st_size, st.st_mtime_ns, resumable.CHUNK_SIZE):
+            if state is not None:
+                # The file changed since the partial upload; start over from an empty temporary file
+                self.discard_partial(remote_file_path, sftp)
+            state = resumable.ResumeState(st.st_size, st.st_mtime_ns, resumable.CHUNK_SIZE)
+        progress = {"size": st.st_size, "confirmed": state.offset, "sent": 0, "resumes": 0}
+        with self.stats_lock:
+            self.resumable_progress[relative_path] = progress
+            self.resumable_stats["uploads"] += 1
+        own_sftp = None
+        start = time.perf_counter()
+        print(f"Uploading {local_path} to {remote_file_path} in {resumable.CHUNK_SIZE // (1024 * 1024)} MB chunks")
+        try:
+            for attempt in range(self.RESUME_ATTEMPTS):
+                generation = self.generation
+                try:
+                    if state.offset:
+                        self._resume_point(state, tmp, sftp)
+                    if state.offset:
+                        print(f"Resuming upload of {relative_path} at {state.offset / (1024 * 1024):.1f} MB "
+                              f"of {state.size / (1024 * 1024):.1f} MB")
+                        metrics.inc("resumable_resumes_total")
+                        progress["resumes"] += 1
+                        with self.stats_lock:
+                            self.resumable_stats["resumed"] += 1
+                            self.resumable_stats["bytes_not_resent"] += state.offset
+                    self._write_chunks(sftp, data, tmp, remote_file_path, state, progress)
+                    break
+                except Exception as e:
+                    if attempt + 1 == self.RESUME_ATTEMPTS or not os.path.isfile(local_path):
+                        raise
+                    print(f"Upload of {relative_path} interrupted at {state.offset / (1024 * 1024):.1f} MB: {e}")
+                    time.sleep(self.RESUME_BACKOFF_SECONDS * (attempt + 1))
+                    if not self.reconnect(generation):
+                        raise
+                    if own_sftp:
+                        own_sftp.close()
+                    # The caller's channel died with the old connection
+                    own_sftp = sftp = self.open_channel()
+            self._rename_into_place(sftp, tmp, remote_file_path)
+            self.resume_store.forget(remote_file_path)
+        finally:
+            with self.stats_lock:
+                self.resumable_progress.pop(relative_path, None)
+            if own_sftp:
+                try:
+                    own_sftp.close()
+                except Exception:
+                    pass
+        seconds = time.perf_counter() - start
+        with self.stats_lock:
+            self.transfer_stats["files"] += 1
+            self.transfer_stats["bytes"] += progress["sent"]
+            self.transfer_stats["seconds"] += seconds
+        print(f"Upload successful ({transfer.format_rate(progress['sent'], seconds)}, "
+              f"{progress['resumes']} resume(s))")
+
+    def _resume_point(self, state, tmp, sftp):
+        """Trim state back to what the temporary file on the server still confirms."""
+        try:
+            remote_size = sftp.stat(tmp).st_size
+        except IOError:
+            remote_size = 0
+        if remote_size < state.offset:
+            keep = remote_size // state.chunk_size
+            state.digests = state.digests[:keep]
+            state.offset = keep * state.chunk_size
+        # The last confirmed chunk must still hold what we sent
+        transport = self.ssh.get_transport()
+        while state.digests:
+            chunk_start = (len(state.digests) - 1) * state.chunk_size
+            length = min(state.chunk_size, state.size - chunk_start)
+            digest = resumable.remote_sha1(transport, tmp, chunk_start, length)
+            if digest is None or digest == state.digests[-1]:
+                break
+            print(f"Chunk at {chunk_start} of {tmp} does not match; sending it again")
+            state.digests.pop()
+            state.offset = chunk_start
+
+    def _write_chunks(self, sftp, data, tmp, remote_file_path, state, progress):
+        def sent(n):
+            self.throttle(n)
+            progress["sent"] += n
+            metrics.inc("bytes_sent_total", n, method="resumable")
+
+        with sftp.open(tmp, 'r+b' if state.offset else 'wb') as rf:
+            while state.offset < state.size:
+                end = min(state.offset + state.chunk_size, state.size)
+                transfer.write_range(sftp, rf, data, state.offset, end,
+                                     max_outstanding=self.max_outstanding_writes, on_chunk=sent)
+                # Every WRITE of the chunk is acknowledged: record it as confirmed
+                state.digests.append(hashlib.sha1(data[state.offset:end]).hexdigest())
+                state.offset = end
+                self.resume_store.save(remote_file_path, state)
+                progress["confirmed"] = end
+
+    def discard_partial(self, remote_file_path, sftp=None):
+        """Remove the temporary file and resume state of a partial upload of remote_file_path, if any."""
+        if not self.resume_store or self.resume_store.lookup(remote_file_path) is None:
+            return
+        tmp = resumable.temp_path(remote_file_path)
+        try:
+            (sftp or self.sftp).remove(tmp)
+            print(f"Removed partial upload {tmp}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Could not remove partial upload {tmp}: {e}")
+            return  # Keep the row so the next attempt tries again
+        self.resume_store.forget(remote_file_path)
+
+    @staticmethod
+    def _rename_into_place(sftp, tmp, remote_file_path):
+        # The temporary file replaces the target, so it takes over the target's mode
+        try:
+            sftp.chmod(tmp, stat.S_IMODE(sftp.stat(remote_file_path).st_mode))
+        except FileNotFoundError:
+            pass
+        try:
+            sftp.posix_rename(tmp, remote_file_path)
+        except IOError:
+            # No posix-rename extension: a plain rename does not replace an existing file
+            try:
+                sftp.remove(remote_file_path)
+            except IOError:
+                pass
+            sftp.rename(tmp, remote_file_path)
+
+    def try_compressed_upload(self, data, local_path, remote_file_path):
+        """Send compressible content through gzip on the server. Returns True on success."""
+        if not self.advisor or not self.advisor.should_compress(local_path, data):
+            return False
+        transport = self.ssh.get_transport()
+        if self.gzip_available is None:
+            self.gzip_available = compression.gzip_available(transport)
+            if self.gzip_available is False:
+                print("Compressed uploads unavailable (remote has no gzip or exec is disabled)")
+        if not self.gzip_available:
+            return False
+
+        start = time.perf_counter()
+        try:
+            sent, compress_seconds = compression.upload_compressed(transport, data, remote_file_path,
+                                                                   on_chunk=self.throttle)
+        except Exception as e:
+            print(f"Compressed upload failed for {remote_file_path}, sending uncompressed: {e}")
+            return False
+        seconds = time.perf_counter() - start
+        self.advisor.record(local_path, len(data), sent, compress_seconds, seconds)
+        metrics.inc("bytes_sent_total", sent, method="compressed")
+        print(f"Upload successful, compressed {len(data)} -> {sent} bytes "
+              f"({transfer.format_rate(len(data), seconds)})")
+        return True
+
+    def try_delta_upload(self, data, remote_file_path):
+        """Send only changed blocks of an existing remote file. Returns True on success."""
+        if not self.delta_transfer:
+            return False
+        size = len(data)
+        if size < self.DELTA_MIN_SIZE:
+            return False
+        transport = self.ssh.get_transport()
+        if self.delta_available is None:
+            self.delta_available = delta.probe_helper(transport)
+            if self.delta_available is False:
+                print("Delta transfer unavailable (remote needs exec and python3); sending whole files")
+        if not self.delta_available:
+            return False
+
+        try:
+            sent = delta.delta_upload(transport, data, remote_file_path)
+        except Exception as e:
+            print(f"Delta upload failed for {remote_file_path}, sending whole file: {e}")
+            return False
+        if sent is None:
+            return False
+
+        metrics.inc("bytes_sent_total", sent, method="delta")
+        with self.stats_lock:
+            self.delta_stats["files"] += 1
+            self.delta_stats["bytes_total"] += size
+            self.delta_stats["bytes_sent"] += sent
+        print(f"Delta upload {remote_file_path}: sent {sent} of {size} bytes (saved {max(0, size - sent)})")
+        return True
+
+    def upload_bulk(self, items, force=False, background=False):
+        """Upload [(local_path, relative_path), ...] as one tar stream.
+
+        A background batch (the catch-up pass) goes through the bandwidth
+        limit; saves and checkouts are sent at full speed. Returns the
+        relative paths that still need a per-file upload, or None if the
+        server has no tar or the connection is gone (caller should upload
+        everything per file).
+        """
+        if not self.is_connected() and not self.connect():
+            return None
+        # Another worker may reconnect or close in the meantime
+        ssh = self.ssh
+        transport = ssh.get_transport() if ssh else None
+        if transport is None or not transport.is_active():
+            print("Bulk upload skipped, connection lost; uploading per file")
+            return None
+        if self.tar_available is None:
+            self.tar_available = bulk.probe_tar(transport)
+            if self.tar_available is False:
+                print("Bulk mode unavailable (remote has no tar or exec is disabled); uploading per file")
+        if not self.tar_available:
+            return None
+
+        if self.manifest and not force:
+            items = [item for item in items if not self._unchanged_by_metadata(*item)]
+            if not items:
+                return []
+
+        remote_base = self.remote_base_path.rstrip('/') or '/'
+        print(f"Bulk uploading {len(items)} files to {remote_base}")
+        digests = {}
+        try:
+            compress = self.bulk_compress and (not self.advisor or self.advisor.should_compress_batch(items))
+            # Files already on the server keep their mode, as with an SFTP upload
+            modes = bulk.remote_modes(self.sftp, remote_base, [relative_path for _, relative_path in items])
+            with metrics.timer("stage_seconds", stage="bulk_write"):
+                on_chunk = (lambda n: self.throttle(n, background=True)) if background else None
+                uploaded, failed, sent = bulk.tar_upload(transport, items, remote_base, compress, digests=digests,
+                                                         on_chunk=on_chunk, modes=modes)
+        except Exception as e:
+            print(f"Bulk upload failed, falling back to per-file uploads: {e}")
+            metrics.inc("errors_total", stage="bulk")
+            return [relative_path for _, relative_path in items]
+        metrics.inc("bytes_sent_total", sent, method="bulk")
+
+        if self.manifest:
+            for relative_path in uploaded:
+                if relative_path in digests:
+                    self.manifest.record(relative_path, *digests[relative_path])
+
+        with self.dirs_lock:
+            for relative_path in uploaded:
+                remote_file_path = remote_base.rstrip('/') + '/' + relative_path.replace('\\', '/')
+                self._mark_known(os.path.dirname(remote_file_path))
+        with self.stats_lock:
+            self.bulk_stats["batches"] += 1
+            self.bulk_stats["files"] += len(uploaded)
+            self.bulk_stats["failed"] += len(failed)
+            self.bulk_stats["bytes"] += sent
+        for relative_path in uploaded:
+            print(f"Bulk uploaded: {relative_path}")
+        for relative_path in failed:
+            print(f"Bulk upload did not confirm {relative_path}; retrying individually")
+        print(f"Bulk upload finished: {len(uploaded)} ok, {len(failed)} to retry, {sent} bytes sent")
+        return failed
+
+    def stats(self):
+        with self.stats_lock:
+            stats = {"delta": dict(self.delta_stats), "transfer": dict(self.transfer_stats),
+                     "bulk": dict(self.bulk_stats), "remote_ops": dict(self.op_stats)}
+        if self.manifest:
+            stats["manifest"] = self.manifest.stats()
+        if self.advisor:
+            stats["compression"] = self.advisor.snapshot()
+        with self.dirs_lock:
+            stats["dir_cache"] = {
+                "hits": self.dir_cache_hits,
+                "misses": self.dir_cache_misses,
+                "known": len(self.known_dirs)
+            }
+        if self.resume_store:
+            with self.stats_lock:
+                stats["resumable"] = dict(self.resumable_stats, in_progress={
+                    path: dict(p, percent=round(100 * p["confirmed"] / p["size"], 1) if p["size"] else 100.0)
+                    for path, p in self.resumable_progress.items()})
+            stats["resumable"]["waiting"] = len(self.resume_store.pending())
+        return stats
+
+    def _close(self):
         if self.sftp:
-            self.sftp.close()
+            try:
+                self.sftp.close()
+            except Exception:
+                pass
+            self.sftp = None
         if self.ssh:
-            self.ssh.close()
+            if not self.pool:  # A pooled connection is shared and closed by the pool
+                self.ssh.close()
+            self.ssh = None
+
+    def close(self):
+        with self.connect_lock:
+            self._close()
+            if self.lease:
+                self.lease.release()
+                self.lease = None
+        if self.manifest:
+            self.manifest.close()
+        if self.resume_store:
+            self.resume_store.close()
+
+
+class WorkerBudget:
+    """Caps the number of jobs processed at once across all upload pools.
+
+    Each worker holds a slot while it processes a job. When all slots are
+    taken, owners (profiles) with waiting workers are served round robin, so
+    a profile with a deep queue cannot starve the others.
+    """
+
+    def __init__(self, slots=8):
+        self.slots = max(1, int(slots))
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.waiting = {}    # owner -> number of waiting workers
+        self.turns = deque()  # owners with waiting workers, next to be served first
+
+    def resize(self, slots):
+        with self.cond:
+            self.slots = max(1, int(slots))
+            self.cond.notify_all()
+
+    def acquire(self, owner):
+        with self.cond:
+            if self.in_use < self.slots and not self.turns:
+                self.in_use += 1
+                return
+            self.waiting[owner] = self.waiting.get(owner, 0) + 1
+            if owner not in self.turns:
+                self.turns.append(owner)
+            while self.in_use >= self.slots or self.turns[0] != owner:
+                self.cond.wait()
+            self.in_use += 1
+            self.turns.popleft()
+            self.waiting[owner] -= 1
+            if self.waiting[owner]:
+                self.turns.append(owner)  # Back of the line for its next worker
+            else:
+                del self.waiting[owner]
+            self.cond.notify_all()
+
+    def release(self):
+        with self.cond:
+            self.in_use -= 1
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {"slots": self.slots, "in_use": self.in_use, "waiting": dict(self.waiting)}
+
+
+class UploadPool:
+    """Upload workers, each with its own SFTP channel on the shared transport.
+
+    Jobs are taken from an UploadScheduler in priority order. Only one job
+    per path is worked on at a time, so two versions of the same file are
+    always handled in submission order and cannot race. With a shared
+    WorkerBudget, each job also waits for one of the budget's slots, so
+    several profiles together stay within one worker limit.
+    """
+
+    def __init__(self, uploader, process, workers=4, queue_size=1000, on_failed=None, budget=None, owner="",
+                 classify=None):
+        self.uploader = uploader
+        self.process = process  # process(job, sftp)
+        # on_failed(job, attempted) for jobs that failed (attempted=True) or were dropped on stop
+        self.on_failed = on_failed
+        self.budget = budget
+        self.owner = owner
+        self.workers = max(1, int(workers))
+        # classify(job) -> (priority class, sort key), see scheduler.PriorityRules
+        self.scheduler = scheduler.UploadScheduler(classify, maxsize=queue_size,
+                                                   max_background=max(1, self.workers - 1))
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=logs.inherit_profile(self._run), name=f"UploadWorker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        # Drop queued work; workers finish the job in hand and exit
+        for job in self.scheduler.drain():
+            self._failed(job, attempted=False)
+        self.scheduler.close()
+        for t in self.threads:
+            t.join(timeout=10)
+        self.threads = []
+
+    def submit(self, key, job):
+        """Queue job under key (blocks while the queue is full)."""
+        self.scheduler.put(key, job)
+
+    def qsize(self):
+        return self.scheduler.qsize()
+
+    def join(self):
+        """Block until every job submitted so far has been processed."""
+        self.scheduler.join()
+
+    def stats(self):
+        return self.scheduler.stats()
+
+    def _failed(self, job, attempted=True):
+        if self.on_failed and job is not None:
+            try:
+                self.on_failed(job, attempted)
+            except Exception as e:
+                print(f"Could not record failed upload: {e}")
+
+    def _open_channel(self):
+        generation = self.uploader.generation
+        try:
+            return self.uploader.open_channel(), generation
+        except Exception as e:
+            print(f"Could not open SFTP channel: {e}")
+            if self.uploader.reconnect(generation):
+                try:
+                    return self.uploader.open_channel(), self.uploader.generation
+                except Exception as e:
+                    print(f"Could not open SFTP channel after reconnect: {e}")
+            return None, generation
+
+    def _run(self):
+        sftp = None
+        generation = None
+        while True:
+            item = self.scheduler.get()
+            if item is None:
+                break
+            key, job, cls = item
+            try:
+                with scheduler.class_scope(cls):
+                    sftp, generation = self._handle(job, sftp, generation)
+            finally:
+                self.scheduler.task_done(key)
+        if sftp is not None:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+    def _handle(self, job, sftp, generation):
+        """Process one job; returns the worker's (possibly reopened) channel and its generation."""
+        if sftp is None or generation != self.uploader.generation:
+            # The connection was re-established; the old channel is dead
+            if sftp is not None:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            sftp, generation = self._open_channel()
+            if sftp is None:
+                self._failed(job)
+                return None, generation
+        if self.budget:
+            self.budget.acquire(self.owner)
+        try:
+            self.process(job, sftp)
+        except Exception as e:
+            print(f"Upload worker error: {e}")
+            self._failed(job)
+        finally:
+            if self.budget:
+                self.budget.release()
+        return sftp, generation